@@ -0,0 +1,101 @@
+'''Benchmark of the activity stream actions on a large activity table.
+
+Adds a few million activities by 1000 users about 10000 objects to the
+activity table and times the first page and a page deep in the activity
+streams of a user, a dataset and of all datasets, both with the activity
+indexes (see migration 064) and without them.
+
+The activities are deleted afterwards, but don't run this against a
+production database. PostgreSQL only.
+
+Usage:
+    python bin/benchmark_activity.py [config.ini] [activities]
+'''
+import os
+import sys
+import time
+
+import loadconfig
+path = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else 'development.ini')
+loadconfig.load_config(path)
+
+import ckan.model as model
+from ckan.logic import get_action
+
+INDEXES = ['activity_user_id_timestamp', 'activity_object_id_timestamp',
+           'activity_package_timestamp']
+
+ACTIONS = [
+    ('user', 'user_activity_list', {'id': u'benchmark-user-1'}),
+    ('dataset', 'package_activity_list', {'id': u'benchmark-object-1'}),
+    ('recently changed', 'recently_changed_packages_activity_list', {}),
+]
+
+
+def add_activities(activities):
+    # spread over about three years, with the types of the activities of
+    # a real site
+    model.Session.execute('''
+        INSERT INTO activity (id, timestamp, user_id, object_id,
+                              revision_id, activity_type, data)
+        SELECT 'benchmark-' || i,
+               now() - i * interval '1 minute' * 1000000 / :activities,
+               'benchmark-user-' || i % 1000,
+               'benchmark-object-' || i % 10000,
+               NULL,
+               (ARRAY['new package', 'changed package', 'changed package',
+                      'changed package', 'deleted package', 'new user',
+                      'changed user', 'follow dataset', 'new group',
+                      'changed group'])[i % 10 + 1],
+               '{}'
+        FROM generate_series(1, :activities) AS i''',
+        {'activities': activities})
+    model.Session.execute('ANALYZE activity')
+    model.Session.commit()
+
+
+def delete_activities():
+    model.Session.execute(
+        "DELETE FROM activity WHERE id LIKE 'benchmark-%'")
+    model.Session.commit()
+
+
+def timed_pages(action, data_dict, pages=10):
+    '''Times the first page of the stream, and the last of the given
+    number of pages.'''
+    context = {'model': model, 'session': model.Session, 'user': u''}
+    function = get_action(action)
+    start = time.time()
+    page = function(context, dict(data_dict))
+    first = time.time() - start
+    for i in range(pages - 2):
+        page = function(context, dict(data_dict, before=page[-1]['id']))
+    start = time.time()
+    function(context, dict(data_dict, before=page[-1]['id']))
+    return first, time.time() - start
+
+
+def run(label):
+    for name, action, data_dict in ACTIONS:
+        first, deep = timed_pages(action, data_dict)
+        print '%-8s %-16s first page %8.1fms, page 10 %8.1fms' % (
+            label, name, first * 1000, deep * 1000)
+
+
+def main():
+    activities = int(sys.argv[2]) if len(sys.argv) > 2 else 3000000
+    delete_activities()
+    add_activities(activities)
+    try:
+        run('now')
+        # dropped only in this transaction
+        for index in INDEXES:
+            model.Session.execute('DROP INDEX %s' % index)
+        run('before')
+    finally:
+        model.Session.rollback()
+        delete_activities()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+'''Micro-benchmark of the navl validation of dataset dicts.
+
+Compares the current validation (compiled, cached schemas and copying only
+the mutable values of the data) with the previous implementation, which
+flattened the schema and deep copied the data on every call, for datasets
+with an increasing number of resources.
+
+Usage:
+    python bin/benchmark_navl.py [repeats]
+'''
+import sys
+import copy
+import timeit
+import inspect
+
+import formencode as fe
+
+from ckan.lib.navl import dictization_functions as df
+from ckan.lib.navl.validators import ignore_missing, not_empty, ignore, empty
+from ckan.logic.schema import (default_resource_schema,
+                               default_tags_schema,
+                               default_extras_schema)
+
+
+def package_schema():
+    '''The dataset schema, without the validators using the database.'''
+    return {
+        'id': [ignore_missing, unicode],
+        'name': [not_empty, unicode],
+        'title': [ignore_missing, unicode],
+        'author': [ignore_missing, unicode],
+        'author_email': [ignore_missing, unicode],
+        'maintainer': [ignore_missing, unicode],
+        'maintainer_email': [ignore_missing, unicode],
+        'license_id': [ignore_missing, unicode],
+        'notes': [ignore_missing, unicode],
+        'url': [ignore_missing, unicode],
+        'version': [ignore_missing, unicode],
+        'type': [ignore_missing, unicode],
+        '__extras': [ignore],
+        '__junk': [empty],
+        'resources': default_resource_schema(),
+        'tags': default_tags_schema(),
+        'extras': default_extras_schema(),
+        'groups': {
+            'id': [ignore_missing, unicode],
+            'name': [ignore_missing, unicode],
+            'title': [ignore_missing, unicode],
+            '__extras': [ignore],
+        }
+    }
+
+
+def package_dict(resources):
+    return {
+        'name': u'benchmark',
+        'title': u'Benchmark dataset',
+        'author': u'Author',
+        'author_email': u'author@example.com',
+        'license_id': u'cc-by',
+        'notes': u'Some notes ' * 50,
+        'url': u'http://example.com',
+        'version': u'1.0',
+        'resources': [{
+            'url': u'http://example.com/data/%s.csv' % i,
+            'description': u'Resource %s' % i,
+            'format': u'CSV',
+            'hash': u'abc%s' % i,
+            'name': u'resource-%s' % i,
+            'size': u'%s' % (i * 1000),
+            'last_modified': u'2012-05-01T12:00:00',
+            'custom_field': u'value %s' % i,
+        } for i in range(resources)],
+        'tags': [{'name': u'tag%s' % i} for i in range(10)],
+        'extras': [{'key': u'key%s' % i, 'value': u'value %s' % i}
+                   for i in range(10)],
+        'groups': [{'name': u'group%s' % i} for i in range(3)],
+    }
+
+
+def legacy_order_key(key):
+    return tuple([len(key)] + list(key))
+
+
+def legacy_convert(converter, key, converted_data, errors, context):
+    '''Calls a converter as before, trying each way of calling it.'''
+    if inspect.isclass(converter) or isinstance(converter, fe.Validator):
+        return df.convert(converter, key, converted_data, errors, context)
+    try:
+        converted_data[key] = converter(converted_data.get(key))
+        return
+    except TypeError, e:
+        if not converter.__name__ in str(e):
+            raise
+    except df.Invalid, e:
+        errors[key].append(e.error)
+        return
+    try:
+        converter(key, converted_data, errors, context)
+        return
+    except df.Invalid, e:
+        errors[key].append(e.error)
+        return
+    except TypeError, e:
+        if not converter.__name__ in str(e):
+            raise
+    try:
+        converted_data[key] = converter(converted_data.get(key), context)
+    except df.Invalid, e:
+        errors[key].append(e.error)
+
+
+def legacy_run_converters(converters, key, converted_data, errors, context):
+    for converter in converters:
+        try:
+            legacy_convert(converter, key, converted_data, errors, context)
+        except df.StopOnError:
+            break
+
+
+def legacy_validate(data, schema, context=None):
+    '''The flattened validation before schemas were compiled.'''
+    context = context or {}
+    flattened = df.flatten_dict(data)
+
+    flattented_schema = df.flatten_schema(schema)
+    key_combinations = df.get_all_key_combinations(flattened,
+                                                   flattented_schema)
+    full_schema = {}
+    for combination in key_combinations:
+        sub_schema = schema
+        for key in combination[::2]:
+            sub_schema = sub_schema[key]
+        for key, value in sub_schema.iteritems():
+            if isinstance(value, list):
+                full_schema[combination + (key,)] = value
+
+    converted_data = copy.deepcopy(flattened)
+    for key, value in converted_data.items():
+        if key in full_schema:
+            continue
+        initial_tuple = key[::2]
+        if initial_tuple in [initial_key[:len(initial_tuple)]
+                             for initial_key in flattented_schema]:
+            if flattened[key] <> []:
+                raise df.DataError('Only lists of dicts can be placed '
+                                   'against subschema %s' % (key,))
+        if key[:-1] in key_combinations:
+            extras_key = key[:-1] + ('__extras',)
+            extras = converted_data.get(extras_key, {})
+            extras[key[-1]] = value
+            converted_data[extras_key] = extras
+        else:
+            junk = converted_data.get(('__junk',), {})
+            junk[key] = value
+            converted_data[('__junk',)] = junk
+        converted_data.pop(key)
+    for key, value in full_schema.items():
+        if key not in converted_data and not key[-1].startswith('__'):
+            converted_data[key] = df.missing
+
+    errors = dict((key, []) for key in full_schema)
+    runs = [lambda key: key[-1] == '__before',
+            lambda key: not key[-1].startswith('__'),
+            lambda key: key[-1] == '__extras']
+    for run in runs:
+        for key in sorted(full_schema, key=legacy_order_key):
+            if run(key):
+                legacy_run_converters(full_schema[key], key, converted_data,
+                                      errors, context)
+    for key in reversed(sorted(full_schema, key=legacy_order_key)):
+        if key[-1] == '__after':
+            legacy_run_converters(full_schema[key], key, converted_data,
+                                  errors, context)
+    if ('__junk',) in full_schema:
+        legacy_run_converters(full_schema[('__junk',)], ('__junk',),
+                              converted_data, errors, context)
+
+    return df.unflatten(converted_data), errors
+
+
+def main(repeats=20):
+    schema = package_schema()
+    for resources in (1, 10, 100):
+        data = package_dict(resources)
+        new_result = df.validate(data, schema)
+        old_result = legacy_validate(data, schema)
+        assert new_result[0] == old_result[0], 'Different results'
+
+        old = min(timeit.repeat(lambda: legacy_validate(data, schema),
+                                number=repeats, repeat=3)) / repeats
+        new = min(timeit.repeat(lambda: df.validate(data, schema),
+                                number=repeats, repeat=3)) / repeats
+        print '%3i resources: before %7.2fms, now %7.2fms (%.1fx)' % (
+            resources, old * 1000, new * 1000, old / new)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,123 @@
+'''Benchmark of the commit latency of datasets with many resources.
+
+Creates a dataset with 1, 50 and 500 resources and then changes the dataset
+and all its resources, timing the commits. Each is done with the current
+revisioning code, which updates the rows of each revision table with a few
+statements, and with the previous code, which updated the revision rows of
+each object one by one.
+
+The datasets are purged afterwards, but don't run this against a
+production database.
+
+Usage:
+    python bin/benchmark_revisioning.py [config.ini]
+'''
+import os
+import sys
+import time
+import datetime
+
+import loadconfig
+path = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else 'development.ini')
+loadconfig.load_config(path)
+
+from sqlalchemy import and_
+import sqlalchemy.orm as orm
+
+import ckan.model as model
+from ckan.model.meta import CkanSessionExtension
+
+
+def legacy_update_revisions(self, session, objs, revision):
+    '''The revision rows updates before they were set based.'''
+    for obj in objs:
+        if not hasattr(obj, '__revision_class__'):
+            continue
+        revision_cls = obj.__revision_class__
+        revision_table = orm.class_mapper(revision_cls).mapped_table
+        if 'pending' not in obj.state:
+            session.execute(
+                revision_table.update().where(
+                    and_(revision_table.c.id == obj.id,
+                         revision_table.c.current == '1')
+                ).values(current='0')
+            )
+        q = session.query(revision_cls)
+        q = q.filter_by(expired_timestamp=datetime.datetime(9999, 12, 31),
+                        id=obj.id)
+        for rev_obj in q.all():
+            values = {}
+            if rev_obj.revision_id == revision.id:
+                values['revision_timestamp'] = revision.timestamp
+                if 'pending' not in obj.state:
+                    values['current'] = '1'
+            else:
+                values['expired_id'] = revision.id
+                values['expired_timestamp'] = revision.timestamp
+            session.execute(
+                revision_table.update().where(
+                    and_(revision_table.c.id == rev_obj.id,
+                         revision_table.c.revision_id == rev_obj.revision_id)
+                ).values(**values)
+            )
+
+
+def timed_commit():
+    start = time.time()
+    model.repo.commit()
+    elapsed = time.time() - start
+    model.Session.remove()
+    return elapsed
+
+
+def create_package(name, resources):
+    rev = model.repo.new_revision()
+    rev.author = u'benchmark'
+    pkg = model.Package(name=name)
+    model.Session.add(pkg)
+    for i in range(resources):
+        pkg.add_resource(u'http://example.com/%s.csv' % i, format=u'CSV')
+    return timed_commit()
+
+
+def update_package(name):
+    rev = model.repo.new_revision()
+    rev.author = u'benchmark'
+    pkg = model.Package.by_name(name)
+    pkg.notes = u'Changed'
+    for res in pkg.resources:
+        res.description = u'Changed'
+    return timed_commit()
+
+
+def purge_package(name):
+    model.repo.new_revision()
+    pkg = model.Package.by_name(name)
+    if pkg:
+        pkg.purge()
+    model.repo.commit_and_remove()
+
+
+def run(label):
+    for resources in (1, 50, 500):
+        name = u'benchmark-revisioning-%s' % resources
+        purge_package(name)
+        create = create_package(name, resources)
+        update = update_package(name)
+        purge_package(name)
+        print '%-8s %3i resources: create %7.1fms, update %7.1fms' % (
+            label, resources, create * 1000, update * 1000)
+
+
+def main():
+    update_revisions = CkanSessionExtension._update_revisions
+    run('now')
+    CkanSessionExtension._update_revisions = legacy_update_revisions
+    try:
+        run('before')
+    finally:
+        CkanSessionExtension._update_revisions = update_revisions
+
+
+if __name__ == '__main__':
+    main()
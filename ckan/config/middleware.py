@@ -2,10 +2,8 @@
 import urllib
 import urllib2
 import logging
-import json
 import hashlib
 
-import sqlalchemy as sa
 from beaker.middleware import CacheMiddleware, SessionMiddleware
 from paste.cascade import Cascade
 from paste.registry import RegistryManager
@@ -21,6 +19,8 @@ from repoze.who.middleware import PluggableAuthenticationMiddleware
 from ckan.plugins import PluginImplementations
 from ckan.plugins.interfaces import IMiddleware
 from ckan.lib.i18n import get_locales_from_config
+import ckan.lib.tracking as tracking
+import ckan.lib.page_cache as page_cache
 
 from ckan.config.environment import load_environment
 
@@ -189,18 +189,16 @@ class I18nMiddleware(object):
 
 class PageCacheMiddleware(object):
     ''' A simple page cache that can store and serve pages. It uses
-    Redis as storage. It caches pages that have a http status code of
-    200, use the GET method. Only non-logged in users receive cached
-    pages.
+    Redis as storage (see ckan.lib.page_cache). It caches pages that have
+    a http status code of 200, use the GET method. Only non-logged in users
+    receive cached pages.
     Cachable pages are indicated by a environ CKAN_PAGE_CACHABLE
-    variable.'''
+    variable, and the entities shown in them by CKAN_PAGE_TAGS, so they
+    can be removed from the cache when these change.'''
 
     def __init__(self, app, config):
         self.app = app
-        import redis    # only import if used
-        self.redis = redis  # we need to reference this within the class
-        self.redis_exception = redis.exceptions.ConnectionError
-        self.redis_connection = None
+        self.cache = page_cache.get_page_cache()
 
     def __call__(self, environ, start_response):
 
@@ -224,35 +222,25 @@ class PageCacheMiddleware(object):
                     return self.app(environ, start_response)
 
         # Make our cache key
-        key = 'page:%s?%s' % (environ['PATH_INFO'], environ['QUERY_STRING'])
-
-        # Try to connect if we don't have a connection. Doing this here
-        # allows the redis server to be unavailable at times.
-        if self.redis_connection is None:
-            try:
-                self.redis_connection = self.redis.StrictRedis()
-                self.redis_connection.flushdb()
-            except self.redis_exception:
-                # Connection may have failed at flush so clear it.
-                self.redis_connection = None
-                return self.app(environ, start_response)
+        key = '%s?%s' % (environ['PATH_INFO'], environ['QUERY_STRING'])
 
         # If cached return cached result
-        try:
-            result = self.redis_connection.lrange(key, 0, 2)
-        except self.redis_exception:
-            # Connection failed so clear it and return the page as normal.
-            self.redis_connection = None
-            return self.app(environ, start_response)
-
+        result = self.cache.get(key)
         if result:
-            headers = json.loads(result[1])
+            status, headers, page = result
             # Convert headers from list to tuples.
             headers = [(str(key), str(value)) for key, value in headers]
-            start_response(str(result[0]), headers)
+            # The cached page is current, so if the client has it (see
+            # ckan.lib.base.conditional_get) it needn't be sent again.
+            etag = dict(headers).get('ETag')
+            if etag and etag in environ.get('HTTP_IF_NONE_MATCH', ''):
+                start_response('304 Not Modified', [
+                    (name, value) for name, value in headers
+                    if name in ('ETag', 'Last-Modified')])
+                return []
+            start_response(str(status), headers)
             # Returning a huge string slows down the server. Therefore we
             # cut it up into more usable chunks.
-            page = result[2]
             out = []
             total = len(page)
             position = 0
@@ -277,12 +265,10 @@ class PageCacheMiddleware(object):
         if cachable:
             # Make sure we consume any file handles etc.
             page_string = ''.join(list(page))
-            # Use a pipe to add page in a transaction.
-            pipe = self.redis_connection.pipeline()
-            pipe.rpush(key, environ['CKAN_PAGE_STATUS'])
-            pipe.rpush(key, json.dumps(environ['CKAN_PAGE_HEADERS']))
-            pipe.rpush(key, page_string)
-            pipe.execute()
+            self.cache.set(key, environ['CKAN_PAGE_STATUS'],
+                           environ['CKAN_PAGE_HEADERS'], page_string,
+                           environ.get('CKAN_PAGE_TAGS', ()))
+            return [page_string]
         return page
 
 
@@ -290,7 +276,7 @@ class TrackingMiddleware(object):
 
     def __init__(self, app, config):
         self.app = app
-        self.engine = sa.create_engine(config.get('sqlalchemy.url'))
+        self.buffer = tracking.get_tracking_buffer()
 
 
     def __call__(self, environ, start_response):
@@ -314,10 +300,7 @@ class TrackingMiddleware(object):
                 environ['HTTP_ACCEPT_ENCODING'],
             ])
             key = hashlib.md5(key).hexdigest()
-            # store key/data here
-            sql = '''INSERT INTO tracking_raw
-                     (user_key, url, tracking_type)
-                     VALUES (%s, %s, %s)'''
-            self.engine.execute(sql, key, data.get('url'), data.get('type'))
+            # store key/data here, the buffer writes them to the database
+            self.buffer.add(key, data.get('url'), data.get('type'))
             return []
         return self.app(environ, start_response)
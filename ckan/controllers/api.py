@@ -2,6 +2,7 @@ import logging
 import cgi
 import datetime
 import glob
+from hashlib import md5
 
 from pylons import c, request, response
 from pylons.i18n import _, gettext
@@ -173,6 +174,11 @@ class ApiController(base.BaseController):
                 gettext('Bad request data: %s') %
                 'Request data JSON decoded to %r but '
                 'it needs to be a dictionary.' % request_data)
+        if side_effect_free and request.method == 'GET':
+            # answer 304 Not Modified without running the action if it can
+            self._conditional_get_action(
+                logic_function, context, request_data,
+                h.json.dumps(request_data, sort_keys=True))
         try:
             result = function(context, request_data)
             return_dict['success'] = True
@@ -219,7 +225,15 @@ class ApiController(base.BaseController):
                                     'message': 'Search error: %r' % e.args}
             return_dict['success'] = False
             return self._finish(409, return_dict, content_type='json')
-        return self._finish_ok(return_dict)
+        response_msg = self._finish_ok(return_dict)
+        if side_effect_free and 'ETag' not in response.headers:
+            # the action has no cache key, so at least save sending the
+            # response again
+            body = response_msg
+            if isinstance(body, unicode):
+                body = body.encode('utf8')
+            base.conditional_get(md5(body).hexdigest())
+        return response_msg
 
     def _get_action_from_map(self, action_map, register, subregister):
         ''' Helper function to get the action function specified in
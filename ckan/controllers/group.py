@@ -105,6 +105,12 @@ class GroupController(BaseController):
         # unicode format (decoded from utf8)
         q = c.q = request.params.get('q', '')
 
+        # answer 304 Not Modified before building the page, if the client
+        # has its current version (the search within the group is in the
+        # query string)
+        self._conditional_get_action('group_show', context, data_dict,
+                                     request.query_string)
+
         try:
             c.group_dict = get_action('group_show')(context, data_dict)
             c.group = context['group']
@@ -282,6 +282,13 @@ class PackageController(BaseController):
             abort(400, _('Invalid revision format: %r') %
                   'Too many "@" symbols')
 
+        pkg = model.Package.get(data_dict['id'])
+        if pkg is not None:
+            # answer 304 Not Modified before building the page, if the
+            # client has its current version
+            self._conditional_get_action('package_show', context, data_dict,
+                                         format, len(pkg.related))
+
         #check if package exists
         try:
             c.pkg_dict = get_action('package_show')(context, data_dict)
@@ -3,9 +3,12 @@
 Provides the BaseController class for subclassing.
 """
 from datetime import datetime
+from email.utils import formatdate
 from hashlib import md5
+import calendar
 import logging
 import os
+import time
 import urllib
 
 from paste.deploy.converters import asbool
@@ -151,6 +154,42 @@ def render(template_name, extra_vars=None, cache_key=None, cache_type=None,
                         % (template_name, e.message))
 
 
+def conditional_get(etag, last_modified=None):
+    '''Sets the ETag (and Last-Modified) headers of the response to a GET
+    request, and answers 304 Not Modified if the client's copy, given in
+    the If-None-Match (or If-Modified-Since) header, is still current.
+
+    etag is a string that changes whenever the response does. It is
+    combined with the user, language and CKAN version, which all pages
+    depend on. last_modified is a naive datetime, as stored in the database.
+    '''
+    if request.method not in ('GET', 'HEAD'):
+        return
+    if h.are_there_flash_messages():
+        # the page shows the messages, so must be rendered
+        return
+    key = u'%s|%s|%s|%s' % (ckan.__version__, c.user,
+                            request.environ.get('CKAN_LANG'), etag)
+    etag = md5(key.encode('utf8')).hexdigest()
+    headers = [('ETag', '"%s"' % etag)]
+    if last_modified is not None:
+        modified = int(time.mktime(last_modified.timetuple()))
+        headers.append(('Last-Modified', formatdate(modified, usegmt=True)))
+    for name, value in headers:
+        response.headers[name] = value
+
+    # If-None-Match takes precedence, as in RFC 2616
+    if 'If-None-Match' in request.headers:
+        not_modified = etag in request.if_none_match
+    elif request.if_modified_since and last_modified is not None:
+        since = calendar.timegm(request.if_modified_since.utctimetuple())
+        not_modified = modified <= since
+    else:
+        not_modified = False
+    if not_modified:
+        _abort(304, headers=headers)
+
+
 class ValidationException(Exception):
     pass
 
@@ -261,6 +300,26 @@ class BaseController(WSGIController):
         response.headers['Access-Control-Allow-Methods'] = "POST, PUT, GET, DELETE, OPTIONS"
         response.headers['Access-Control-Allow-Headers'] = "X-CKAN-API-KEY, Authorization, Content-Type"
 
+    def _conditional_get_action(self, action, context, data_dict, *parts):
+        '''Answers 304 Not Modified (see conditional_get) before the given
+        action is run, if it has a cache_key (see ckan.logic.cache_key)
+        and the client's copy of the response is current. Other things the
+        response depends on can be given as parts of its ETag.'''
+        import ckan.logic as logic
+        key_function = getattr(logic.get_action(action), 'cache_key', None)
+        if key_function is None or request.method not in ('GET', 'HEAD'):
+            return
+        try:
+            key = key_function(dict(context), dict(data_dict))
+        except (logic.NotFound, logic.NotAuthorized, logic.ValidationError):
+            # the action reports these
+            return
+        if key is None:
+            return
+        etag, last_modified = key
+        etag = u':'.join([etag] + [unicode(part) for part in parts])
+        conditional_get(etag, last_modified)
+
     def _get_user(self, reference):
         return model.User.by_name(reference)
 
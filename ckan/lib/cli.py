@@ -275,8 +275,10 @@ class SearchIndexCommand(CkanCommand):
     '''Creates a search index for all datasets
 
     Usage:
-      search-index [-i] [-o] [-r] rebuild [dataset-name]     - reindex dataset-name if given, if not then rebuild full search index (all datasets)
-      search-index check                                     - checks for datasets not indexed
+      search-index [-i] [-o] [-r] [-b N] [-w N] [--commit-every N] [--checkpoint FILE] rebuild [dataset-name]
+                                                             - reindex dataset-name if given, if not then rebuild full search index (all datasets)
+      search-index check                                     - checks for datasets not indexed, or indexed but not in the database
+      search-index [-b N] process-queue                      - updates the index with the changes queued by the asynchronous_search plugin
       search-index show {dataset-name}                       - shows index of a dataset
       search-index clear [dataset-name]                      - clears the search index for the provided dataset or for the whole ckan instance
     '''
@@ -294,11 +296,23 @@ class SearchIndexCommand(CkanCommand):
             action='store_true', default=False, help='Ignore exceptions when rebuilding the index')
 
         self.parser.add_option('-o', '--only-missing', dest='only_missing',
-            action='store_true', default=False, help='Index non indexed datasets only')
+            action='store_true', default=False, help='Index non indexed datasets only (and remove the ones not in the database)')
 
         self.parser.add_option('-r', '--refresh', dest='refresh',
             action='store_true', default=False, help='Refresh current index (does not clear the existing one)')
 
+        self.parser.add_option('-b', '--batch-size', dest='batch_size',
+            type='int', default=None, help='Number of datasets sent to the index on each request')
+
+        self.parser.add_option('-w', '--workers', dest='workers',
+            type='int', default=None, help='Number of processes used to dictize the datasets')
+
+        self.parser.add_option('--commit-every', dest='commit_every',
+            type='int', default=None, help='Commit the index every N datasets (default is only at the end)')
+
+        self.parser.add_option('--checkpoint', dest='checkpoint',
+            default=None, help='File used to store the progress, so an interrupted rebuild can be resumed')
+
     def command(self):
         self._load_config()
 
@@ -312,6 +326,8 @@ class SearchIndexCommand(CkanCommand):
             self.rebuild()
         elif cmd == 'check':
             self.check()
+        elif cmd == 'process-queue':
+            self.process_queue()
         elif cmd == 'show':
             self.show()
         elif cmd == 'clear':
@@ -325,14 +341,28 @@ class SearchIndexCommand(CkanCommand):
         if len(self.args) > 1:
             rebuild(self.args[1])
         else:
+            # the options added for large sites are optional
+            option = lambda name: getattr(self.options, name, None)
             rebuild(only_missing=self.options.only_missing,
                     force=self.options.force,
-                    refresh=self.options.refresh)
+                    refresh=self.options.refresh,
+                    batch_size=option('batch_size'),
+                    workers=option('workers'),
+                    commit_every=option('commit_every'),
+                    checkpoint=option('checkpoint'))
+
     def check(self):
         from ckan.lib.search import check
 
         check()
 
+    def process_queue(self):
+        from ckan.lib.search import process_queue
+
+        processed = process_queue(
+            batch_size=getattr(self.options, 'batch_size', None))
+        print 'Processed %i search index queue entries' % processed
+
     def show(self):
         from ckan.lib.search import show
 
@@ -888,113 +918,292 @@ class Tracking(CkanCommand):
     '''Update tracking statistics
 
     Usage:
-      tracking   - update tracking stats
+      tracking [update] [start_date] - update tracking stats with the data
+                                       recorded since the last update, or
+                                       since start_date (YYYY-MM-DD),
+                                       including any archived data
+      tracking archive [days]        - move the raw tracking data older
+                                       than days (30 by default) before the
+                                       last update to tracking_raw_archive
     '''
 
     summary = __doc__.split('\n')[0]
     usage = __doc__
-    max_args = 1
+    max_args = 2
     min_args = 0
 
+    PACKAGE_URL = '/dataset/'
+
     def command(self):
         self._load_config()
         import ckan.model as model
         engine = model.meta.engine
 
-        if len(self.args) == 1:
-            # Get summeries from specified date
-            start_date = datetime.datetime.strptime(self.args[0], '%Y-%m-%d')
+        args = list(self.args)
+        cmd = 'update'
+        if args and args[0] in ('update', 'archive'):
+            cmd = args.pop(0)
+
+        if cmd == 'archive':
+            days = int(args[0]) if args else 30
+            if days < 2:
+                raise self.BadCommand('The last 2 days of raw tracking data '
+                                      'are needed by the next update')
+            print '%i tracking rows archived' % \
+                self.archive_tracking(engine, days)
+            return
+
+        start_date = None
+        if args:
+            start_date = datetime.datetime.strptime(args[0], '%Y-%m-%d')
+            start_date = start_date.date()
+        first_day = self.update_tracking(engine, start_date)
+        if first_day is None:
+            print 'no new tracking data'
         else:
-            # No date given. See when we last have data for and get data
-            # from 2 days before then in case new data is available.
-            # If no date here then use 2010-01-01 as the start date
-            sql = '''SELECT tracking_date from tracking_summary
-                     ORDER BY tracking_date DESC LIMIT 1;'''
-            result = engine.execute(sql).fetchall()
-            if result:
-                start_date = result[0]['tracking_date']
-                start_date += datetime.timedelta(-2)
-                # convert date to datetime
-                combine = datetime.datetime.combine
-                start_date = combine(start_date, datetime.time(0))
-            else:
-                start_date = datetime.datetime(2011, 1, 1)
-        end_date = datetime.datetime.now()
-
-        while start_date < end_date:
-            stop_date = start_date + datetime.timedelta(1)
-            self.update_tracking(engine, start_date)
-            print 'tracking updated for %s' % start_date
-            start_date = stop_date
-
-    def update_tracking(self, engine, summary_date):
-        PACKAGE_URL = '/dataset/'
-        # clear out existing data before adding new
-        sql = '''DELETE FROM tracking_summary
-                 WHERE tracking_date='%s'; ''' % summary_date
-        engine.execute(sql)
-
-        sql = '''SELECT DISTINCT url, user_key,
-                     CAST(access_timestamp AS Date) AS tracking_date,
-                     tracking_type INTO tracking_tmp
-                 FROM tracking_raw
-                 WHERE CAST(access_timestamp as Date)='%s';
-
-                 INSERT INTO tracking_summary
-                   (url, count, tracking_date, tracking_type)
-                 SELECT url, count(user_key), tracking_date, tracking_type
-                 FROM tracking_tmp
-                 GROUP BY url, tracking_date, tracking_type;
-
-                 DROP TABLE tracking_tmp;
-                 COMMIT;''' % summary_date
-        engine.execute(sql)
-
-        # get ids for dataset urls
-        sql = '''UPDATE tracking_summary t
-                 SET package_id = COALESCE(
-                        (SELECT id FROM package p
-                        WHERE t.url =  %s || p.name)
-                     ,'~~not~found~~')
-                 WHERE t.package_id IS NULL
-                 AND tracking_type = 'page';'''
-        engine.execute(sql, PACKAGE_URL)
-
-        # update summary totals for resources
-        sql = '''UPDATE tracking_summary t1
-                 SET running_total = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.url = t2.url
-                    AND t2.tracking_date <= t1.tracking_date
-                 ) + t1.count
-                 ,recent_views = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.url = t2.url
-                    AND t2.tracking_date <= t1.tracking_date AND t2.tracking_date >= t1.tracking_date - 14
-                 ) + t1.count
-                 WHERE t1.running_total = 0 AND tracking_type = 'resource';'''
-        engine.execute(sql)
-
-        # update summary totals for pages
-        sql = '''UPDATE tracking_summary t1
-                 SET running_total = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.package_id = t2.package_id
-                    AND t2.tracking_date <= t1.tracking_date
-                 ) + t1.count
-                 ,recent_views = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.package_id = t2.package_id
-                    AND t2.tracking_date <= t1.tracking_date AND t2.tracking_date >= t1.tracking_date - 14
-                 ) + t1.count
-                 WHERE t1.running_total = 0 AND tracking_type = 'page'
-                 AND t1.package_id IS NOT NULL
-                 AND t1.package_id != '~~not~found~~';'''
-        engine.execute(sql)
+            print 'tracking updated since %s' % first_day
+
+    def _watermark(self, conn, lock=False):
+        sql = '''SELECT access_timestamp FROM tracking_watermark
+                 WHERE name = 'summary' '''
+        if lock:
+            sql += ' FOR UPDATE'
+        return conn.execute(sql).scalar()
+
+    def _first_day(self, conn, watermark):
+        '''Returns the first day to summarise again after the last update.
+        The day before the last data summarised is counted again too, so
+        events written to the database late are included.'''
+        if watermark is not None:
+            return watermark.date() - datetime.timedelta(1)
+        # first update since the summaries were kept incrementally, carry
+        # on from the existing ones as the full update used to do
+        last_date = conn.execute(
+            'SELECT max(tracking_date) FROM tracking_summary').scalar()
+        if last_date is not None:
+            if isinstance(last_date, datetime.datetime):
+                last_date = last_date.date()
+            return last_date - datetime.timedelta(2)
+        first = conn.execute(
+            'SELECT min(access_timestamp) FROM tracking_raw').scalar()
+        return first.date()
+
+    def update_tracking(self, engine, start_date=None):
+        '''Summarises the tracking data recorded since the last update, or
+        since start_date if given, and updates the totals of the datasets
+        and resources viewed since then. Returns the first day updated, or
+        None if there was no new data.
+
+        Only the raw data of the days being updated is read, and the
+        running totals carry on from the last summary of each url or
+        dataset before them, so the cost depends on the new data only.'''
+        conn = engine.connect()
+        trans = conn.begin()
+        try:
+            # locked, so updates can't run at the same time
+            watermark = self._watermark(conn, lock=True)
+            latest = conn.execute(
+                'SELECT max(access_timestamp) FROM tracking_raw').scalar()
+            if latest is None or (start_date is None and
+                                  watermark is not None and
+                                  latest <= watermark):
+                trans.rollback()
+                return None
+            if start_date is None:
+                start_date = self._first_day(conn, watermark)
+            params = {'first_day': start_date,
+                      'package_url': self.PACKAGE_URL}
+
+            # the raw data of days already archived is read from the
+            # archive too, so their summaries are not lost
+            raw = 'tracking_raw'
+            archived = conn.execute(
+                'SELECT max(access_timestamp) FROM tracking_raw_archive'
+            ).scalar()
+            if archived is not None and archived.date() >= start_date:
+                raw = '''(SELECT user_key, url, tracking_type, access_timestamp
+                         FROM tracking_raw
+                         UNION ALL
+                         SELECT user_key, url, tracking_type, access_timestamp
+                         FROM tracking_raw_archive) raw'''
+
+            # count the unique users of each url and day again
+            conn.execute('''
+                DELETE FROM tracking_summary
+                WHERE tracking_date >= %(first_day)s;
+
+                INSERT INTO tracking_summary
+                  (url, count, tracking_date, tracking_type)
+                SELECT url, count(DISTINCT user_key),
+                  CAST(access_timestamp AS Date), tracking_type
+                FROM ''' + raw + '''
+                WHERE access_timestamp >= %(first_day)s
+                GROUP BY url, CAST(access_timestamp AS Date), tracking_type;
+
+                UPDATE tracking_summary t
+                SET package_id = COALESCE(
+                       (SELECT id FROM package p
+                       WHERE t.url = %(package_url)s || p.name)
+                    ,'~~not~found~~')
+                WHERE t.tracking_date >= %(first_day)s
+                AND t.tracking_type = 'page';''', params)
+
+            # running totals, from the last total before the first day
+            conn.execute('''
+                UPDATE tracking_summary t
+                SET running_total = s.running_total
+                FROM (
+                  SELECT n.url, n.tracking_date,
+                    COALESCE((SELECT b.running_total
+                              FROM tracking_summary b
+                              WHERE b.url = n.url
+                              AND b.tracking_type = 'resource'
+                              AND b.tracking_date < %(first_day)s
+                              ORDER BY b.tracking_date DESC LIMIT 1), 0)
+                    + sum(n.count) OVER (PARTITION BY n.url
+                                         ORDER BY n.tracking_date)
+                    AS running_total
+                  FROM tracking_summary n
+                  WHERE n.tracking_type = 'resource'
+                  AND n.tracking_date >= %(first_day)s
+                ) s
+                WHERE t.url = s.url AND t.tracking_date = s.tracking_date
+                AND t.tracking_type = 'resource';
+
+                UPDATE tracking_summary t
+                SET running_total = s.running_total
+                FROM (
+                  SELECT d.package_id, d.tracking_date,
+                    COALESCE((SELECT b.running_total
+                              FROM tracking_summary b
+                              WHERE b.package_id = d.package_id
+                              AND b.tracking_type = 'page'
+                              AND b.tracking_date < %(first_day)s
+                              ORDER BY b.tracking_date DESC LIMIT 1), 0)
+                    + sum(d.count) OVER (PARTITION BY d.package_id
+                                         ORDER BY d.tracking_date)
+                    AS running_total
+                  FROM (SELECT package_id, tracking_date, sum(count) AS count
+                        FROM tracking_summary
+                        WHERE tracking_type = 'page'
+                        AND tracking_date >= %(first_day)s
+                        AND package_id != '~~not~found~~'
+                        GROUP BY package_id, tracking_date) d
+                ) s
+                WHERE t.package_id = s.package_id
+                AND t.tracking_date = s.tracking_date
+                AND t.tracking_type = 'page';''', params)
+
+            # views in the last 14 days, of the days updated only
+            conn.execute('''
+                UPDATE tracking_summary t1
+                SET recent_views = (
+                   SELECT sum(count)
+                   FROM tracking_summary t2
+                   WHERE t2.url = t1.url
+                   AND t2.tracking_type = 'resource'
+                   AND t2.tracking_date <= t1.tracking_date
+                   AND t2.tracking_date >= t1.tracking_date - 14)
+                WHERE t1.tracking_date >= %(first_day)s
+                AND t1.tracking_type = 'resource';
+
+                UPDATE tracking_summary t1
+                SET recent_views = (
+                   SELECT sum(count)
+                   FROM tracking_summary t2
+                   WHERE t2.package_id = t1.package_id
+                   AND t2.tracking_type = 'page'
+                   AND t2.tracking_date <= t1.tracking_date
+                   AND t2.tracking_date >= t1.tracking_date - 14)
+                WHERE t1.tracking_date >= %(first_day)s
+                AND t1.tracking_type = 'page'
+                AND t1.package_id != '~~not~found~~';''', params)
+
+            self.update_tracking_totals(conn, start_date)
+
+            params['latest'] = max(latest, watermark or latest)
+            result = conn.execute('''
+                UPDATE tracking_watermark SET access_timestamp = %(latest)s
+                WHERE name = 'summary';''', params)
+            if not result.rowcount:
+                conn.execute('''
+                    INSERT INTO tracking_watermark (name, access_timestamp)
+                    VALUES ('summary', %(latest)s);''', params)
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+        return start_date
+
+    def update_tracking_totals(self, conn, first_day):
+        '''Copies the latest totals of the datasets and resources with
+        summaries since first_day to tracking_total, which is used to look
+        them up and keeps the totals of all the others.'''
+        conn.execute('''
+            DELETE FROM tracking_total
+            WHERE (tracking_type = 'page' AND key IN (
+                     SELECT package_id FROM tracking_summary
+                     WHERE tracking_date >= %(first_day)s
+                     AND tracking_type = 'page'))
+            OR (tracking_type = 'resource' AND key IN (
+                     SELECT url FROM tracking_summary
+                     WHERE tracking_date >= %(first_day)s
+                     AND tracking_type = 'resource'));
+
+            INSERT INTO tracking_total
+              (tracking_type, key, running_total, recent_views,
+               tracking_date)
+            SELECT DISTINCT ON (package_id)
+              'page', package_id, running_total, recent_views,
+              tracking_date
+            FROM tracking_summary
+            WHERE tracking_date >= %(first_day)s
+            AND tracking_type = 'page'
+            AND package_id IS NOT NULL
+            AND package_id != '~~not~found~~'
+            ORDER BY package_id, tracking_date DESC;
+
+            INSERT INTO tracking_total
+              (tracking_type, key, running_total, recent_views,
+               tracking_date)
+            SELECT DISTINCT ON (url)
+              'resource', url, running_total, recent_views,
+              tracking_date
+            FROM tracking_summary
+            WHERE tracking_date >= %(first_day)s
+            AND tracking_type = 'resource'
+            ORDER BY url, tracking_date DESC;''', {'first_day': first_day})
+
+    def archive_tracking(self, engine, days):
+        '''Moves the raw tracking data older than the given number of days
+        before the last update to tracking_raw_archive, so tracking_raw
+        only keeps the recent data. Returns the number of rows moved.'''
+        conn = engine.connect()
+        trans = conn.begin()
+        try:
+            watermark = self._watermark(conn)
+            if watermark is None:
+                trans.rollback()
+                return 0
+            params = {'cutoff': watermark.date() - datetime.timedelta(days)}
+            conn.execute('''
+                INSERT INTO tracking_raw_archive
+                  (user_key, url, tracking_type, access_timestamp)
+                SELECT user_key, url, tracking_type, access_timestamp
+                FROM tracking_raw
+                WHERE access_timestamp < %(cutoff)s;''', params)
+            result = conn.execute('''
+                DELETE FROM tracking_raw
+                WHERE access_timestamp < %(cutoff)s;''', params)
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+        return result.rowcount
 
 class PluginInfo(CkanCommand):
     ''' Provide info on installed plugins.
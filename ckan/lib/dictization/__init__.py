@@ -9,66 +9,135 @@ from pylons import config
 # these functions.  Copy code from here as needed.
 
 
-def table_dictize(obj, context, **kw):
-    '''Get any model object and represent it as a dict'''
-
-    result_dict = {}
-
-    model = context["model"]
-    session = model.Session
-
-    if isinstance(obj, sqlalchemy.engine.base.RowProxy):
-        fields = obj.keys()
+# Columns of the revision tables which are not part of the dicts
+SKIPPED_FIELDS = frozenset(['current', 'expired_timestamp', 'expired_id',
+                            'continuity_id'])
+
+def _value(value):
+    '''Represent the value of a column in a dict'''
+    if value is None:
+        return value
+    elif isinstance(value, dict):
+        return value
+    elif isinstance(value, int):
+        return value
+    elif isinstance(value, datetime.datetime):
+        return value.isoformat()
+    elif isinstance(value, list):
+        return value
     else:
-        ModelClass = obj.__class__
+        return unicode(value)
+
+def _text_value(value):
+    if value.__class__ is unicode:
+        return value
+    return _value(value)
+
+def _datetime_value(value):
+    if value.__class__ is datetime.datetime:
+        return value.isoformat()
+    return _value(value)
+
+def _column_converter(column):
+    '''The function representing the values of a table column, checking the
+    type of the value expected for the column first'''
+    if isinstance(column.type, sqlalchemy.types.DateTime):
+        return _datetime_value
+    if isinstance(column.type, sqlalchemy.types.String):
+        return _text_value
+    return _value
+
+# Dictization plans: the (name, converter) of the fields to dictize for each
+# mapped class, and the (name, index, converter) for each shape of result
+# row, worked out on first use.
+_class_plans = {}
+_row_plans = {}
+
+def _class_plan(ModelClass):
+    plan = _class_plans.get(ModelClass)
+    if plan is None:
         table = class_mapper(ModelClass).mapped_table
-        fields = [field.name for field in table.c]
+        plan = [(column.name, _column_converter(column))
+                for column in table.c if column.name not in SKIPPED_FIELDS]
+        _class_plans[ModelClass] = plan
+    return plan
+
+def _row_plan(keys):
+    keys = tuple(keys)
+    plan = _row_plans.get(keys)
+    if plan is None:
+        plan = [(name, index, _value) for index, name in enumerate(keys)
+                if name not in SKIPPED_FIELDS]
+        _row_plans[keys] = plan
+    return plan
+
+def _dictize_objects(obj_list):
+    '''Represent each object (or result row) in a list as a dict, reusing
+    the plan of the previous object if it is of the same class or comes from
+    the same result'''
+    last_class = last_keys = plan = None
+    RowProxy = sqlalchemy.engine.base.RowProxy
 
-    for field in fields:
-        name = field
-        if name in ('current', 'expired_timestamp', 'expired_id'):
-            continue
-        if name == 'continuity_id':
-            continue
-        value = getattr(obj, name)
-        if value is None:
-            result_dict[name] = value
-        elif isinstance(value, dict):
-            result_dict[name] = value
-        elif isinstance(value, int):
-            result_dict[name] = value
-        elif isinstance(value, datetime.datetime):
-            result_dict[name] = value.isoformat()
-        elif isinstance(value, list):
-            result_dict[name] = value
+    for obj in obj_list:
+        result_dict = {}
+        if isinstance(obj, RowProxy):
+            keys = obj.keys()
+            if keys is not last_keys:
+                plan = _row_plan(keys)
+                last_keys, last_class = keys, None
+            for name, index, convert in plan:
+                result_dict[name] = convert(obj[index])
         else:
-            result_dict[name] = unicode(value)
+            if obj.__class__ is not last_class:
+                plan = _class_plan(obj.__class__)
+                last_keys, last_class = None, obj.__class__
+            for name, convert in plan:
+                result_dict[name] = convert(getattr(obj, name))
+        yield result_dict
+
+def _update_metadata_modified(result_list, context):
+    ##HACK For optimisation to get metadata_modified created faster.
+    metadata_modified = context.get('metadata_modified', '')
+    for result_dict in result_list:
+        metadata_modified = max(result_dict.get('revision_timestamp', ''),
+                                metadata_modified)
+    context['metadata_modified'] = metadata_modified
 
-    result_dict.update(kw)
+def table_dictize(obj, context, **kw):
+    '''Get any model object and represent it as a dict'''
 
-    ##HACK For optimisation to get metadata_modified created faster.
-    
-    context['metadata_modified'] = max(result_dict.get('revision_timestamp', ''),
-                                       context.get('metadata_modified', ''))
+    result_dict = _dictize_objects([obj]).next()
+    result_dict.update(kw)
+    _update_metadata_modified([result_dict], context)
 
     return result_dict
 
+def table_list_dictize(obj_list, context):
+    '''Get a list of model objects (or result rows) and represent them as a
+    list of dicts, in the same order, as table_dictize does for each one'''
+
+    result_list = list(_dictize_objects(obj_list))
+    _update_metadata_modified(result_list, context)
+
+    return result_list
+
 
 def obj_list_dictize(obj_list, context, sort_key=lambda x:x):
     '''Get a list of model object and represent it as a list of dicts'''
 
-    result_list = []
     active = context.get('active', True)
 
-    for obj in obj_list:
-        if context.get('with_capacity'):
-            obj, capacity = obj
-            dictized = table_dictize(obj, context, capacity=capacity)
-        else:
-            dictized = table_dictize(obj, context)
-        if active and obj.state not in ('active', 'pending'):
-            continue
-        result_list.append(dictized)
+    if context.get('with_capacity'):
+        obj_list, capacities = zip(*obj_list) or ((), ())
+        dictized_list = table_list_dictize(obj_list, context)
+        for dictized, capacity in zip(dictized_list, capacities):
+            dictized['capacity'] = capacity
+    else:
+        obj_list = list(obj_list)
+        dictized_list = table_list_dictize(obj_list, context)
+
+    result_list = [dictized for obj, dictized in zip(obj_list, dictized_list)
+                   if not active or obj.state in ('active', 'pending')]
 
     return sorted(result_list, key=sort_key)
 
@@ -76,10 +145,7 @@ def obj_dict_dictize(obj_dict, context, sort_key=lambda x:x):
     '''Get a dict whose values are model objects
     and represent it as a list of dicts'''
 
-    result_list = []
-
-    for key, obj in obj_dict.items():
-        result_list.append(table_dictize(obj, context))
+    result_list = table_list_dictize(obj_dict.values(), context)
 
     return sorted(result_list, key=sort_key)
 
@@ -18,20 +18,26 @@ def group_list_dictize(obj_list, context,
     with_private = context.get('include_private_packages', False)
     result_list = []
 
-    for obj in obj_list:
+    obj_list = list(obj_list)
+    if context.get('with_capacity'):
+        groups = [obj for obj, capacity in obj_list]
+    else:
+        groups = obj_list
+    package_counts = context['model'].Group.get_package_counts(
+        [obj.id for obj in groups], with_private=with_private)
+    group_dicts = d.table_list_dictize(groups, context)
+
+    for index, obj in enumerate(groups):
+        group_dict = group_dicts[index]
         if context.get('with_capacity'):
-            obj, capacity = obj
-            group_dict = d.table_dictize(obj, context, capacity=capacity)
-        else:
-            group_dict = d.table_dictize(obj, context)
+            group_dict['capacity'] = obj_list[index][1]
         group_dict.pop('created')
         if active and obj.state not in ('active', 'pending'):
             continue
 
         group_dict['display_name'] = obj.display_name
 
-        group_dict['packages'] = \
-                len(obj.active_packages(with_private=with_private).all())
+        group_dict['packages'] = package_counts[obj.id]
 
         if context.get('for_view'):
             for item in plugins.PluginImplementations(
@@ -39,16 +45,27 @@ def group_list_dictize(obj_list, context,
                 group_dict = item.before_view(group_dict)
 
         result_list.append(group_dict)
+    if sort_key is None:
+        # already sorted
+        return result_list
     return sorted(result_list, key=sort_key, reverse=reverse)
 
-def resource_list_dictize(res_list, context):
+def resource_list_dictize(res_list, context, tracking_summaries=None):
 
     active = context.get('active', True)
+    res_list = list(res_list)
+    if tracking_summaries is None and not context.get('for_edit'):
+        # get the tracking totals of all the resources at once
+        model = context['model']
+        tracking_summaries = model.TrackingSummary.get_totals(
+            urls=[res.url for res in res_list])[1]
     result_list = []
-    for res in res_list:
-        resource_dict = resource_dictize(res, context)
+    for res, resource_dict in zip(res_list,
+                                  d.table_list_dictize(res_list, context)):
         if active and res.state not in ('active', 'pending'):
             continue
+        _add_resource_properties(resource_dict, res, context,
+                                 tracking_summaries)
 
         result_list.append(resource_dict)
 
@@ -65,8 +82,8 @@ def related_list_dictize(related_list, context):
 
 def extras_dict_dictize(extras_dict, context):
     result_list = []
-    for name, extra in extras_dict.iteritems():
-        dictized = d.table_dictize(extra, context)
+    extras = extras_dict.values()
+    for extra, dictized in zip(extras, d.table_list_dictize(extras, context)):
         if not extra.state == 'active':
             continue
         value = dictized["value"]
@@ -81,8 +98,9 @@ def extras_dict_dictize(extras_dict, context):
 def extras_list_dictize(extras_list, context):
     result_list = []
     active = context.get('active', True)
-    for extra in extras_list:
-        dictized = d.table_dictize(extra, context)
+    extras_list = list(extras_list)
+    for extra, dictized in zip(extras_list,
+                               d.table_list_dictize(extras_list, context)):
         if active and extra.state not in ('active', 'pending'):
             continue
         value = dictized["value"]
@@ -92,17 +110,25 @@ def extras_list_dictize(extras_list, context):
 
     return sorted(result_list, key=lambda x: x["key"])
 
-def resource_dictize(res, context):
+def resource_dictize(res, context, tracking_summaries=None):
     resource = d.table_dictize(res, context)
+    _add_resource_properties(resource, res, context, tracking_summaries)
+    return resource
+
+def _add_resource_properties(resource, res, context, tracking_summaries):
+    '''Adds the extras and the tracking summary to the dict of a
+    resource.'''
     extras = resource.pop("extras", None)
     if extras:
         resource.update(extras)
     #tracking
     if not context.get('for_edit'):
-        model = context['model']
-        tracking = model.TrackingSummary.get_for_resource(res.url)
+        if tracking_summaries is not None:
+            tracking = dict(tracking_summaries[res.url])
+        else:
+            model = context['model']
+            tracking = model.TrackingSummary.get_for_resource(res.url)
         resource['tracking_summary'] = tracking
-    return resource
 
 def related_dictize(rel, context):
     return d.table_dictize(rel, context)
@@ -175,8 +201,15 @@ def package_dictize(pkg, context):
     q = select([res_rev], from_obj = res_rev.join(resource_group,
                resource_group.c.id == res_rev.c.resource_group_id))
     q = q.where(resource_group.c.package_id == pkg.id)
-    result = _execute_with_revision(q, res_rev, context)
-    result_dict["resources"] = resource_list_dictize(result, context)
+    resources = _execute_with_revision(q, res_rev, context).fetchall()
+    # tracking totals of the package and its resources
+    urls = []
+    if not context.get('for_edit'):
+        urls = [res.url for res in resources]
+    package_tracking, resource_tracking = \
+        model.TrackingSummary.get_totals([pkg.id], urls)
+    result_dict["resources"] = resource_list_dictize(resources, context,
+                                                     resource_tracking)
 
     #tags
     tag_rev = model.package_tag_revision_table
@@ -200,8 +233,7 @@ def package_dictize(pkg, context):
     result = _execute_with_revision(q, extra_rev, context)
     result_dict["extras"] = extras_list_dictize(result, context)
     #tracking
-    tracking = model.TrackingSummary.get_for_package(pkg.id)
-    result_dict['tracking_summary'] = tracking
+    result_dict['tracking_summary'] = dict(package_tracking[pkg.id])
     #groups
     member_rev = model.member_revision_table
     group = model.group_table
@@ -225,6 +257,20 @@ def package_dictize(pkg, context):
     if isinstance(pkg, ckan.model.PackageRevision):
         pkg = model.Package.get(pkg.id)
 
+    _add_package_properties(result_dict, pkg, context)
+
+    # creation date
+    result_dict['metadata_created'] = pkg.metadata_created.isoformat() \
+        if pkg.metadata_created else None
+
+    if context.get('for_view'):
+        for item in plugins.PluginImplementations( plugins.IPackageController):
+            result_dict = item.before_view(result_dict)
+
+    return result_dict
+
+def _add_package_properties(result_dict, pkg, context):
+    '''Adds the properties of the Package domain object to its dict.'''
     # isopen
     result_dict['isopen'] = pkg.isopen if isinstance(pkg.isopen,bool) else pkg.isopen()
 
@@ -240,16 +286,139 @@ def package_dictize(pkg, context):
     else:
         result_dict['license_title']= pkg.license_id
 
-    # creation and modification date
+    # modification date
     result_dict['metadata_modified'] = context.pop('metadata_modified')
-    result_dict['metadata_created'] = pkg.metadata_created.isoformat() \
-        if pkg.metadata_created else None
 
-    if context.get('for_view'):
-        for item in plugins.PluginImplementations( plugins.IPackageController):
-            result_dict = item.before_view(result_dict)
+def _rows_by(rows, key):
+    '''Groups the rows of a result by the value of one of its columns.'''
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[key], []).append(row)
+    return grouped
+
+def _pop_key(dict_list, key):
+    for dictized in dict_list:
+        dictized.pop(key, None)
+    return dict_list
+
+def package_list_dictize(pkg_list, context):
+    '''
+    Given a list of Package (or PackageRevision) objects, returns a list of
+    their dictionaries, the same as calling package_dictize on each of them
+    but fetching the related objects of all the packages with a single
+    query per table.
+
+    The revision_id, revision_date and pending context options are
+    honoured as in package_dictize.
+
+    May raise NotFound if any of the packages is not found.
+    '''
+    model = context['model']
+    pkg_list = list(pkg_list)
+    if not pkg_list:
+        return []
+    ids = [pkg.id for pkg in pkg_list]
+    #packages
+    package_rev = model.package_revision_table
+    q = select([package_rev]).where(package_rev.c.id.in_(ids))
+    packages = dict((row['id'], row) for row in
+                    _execute_with_revision(q, package_rev, context))
+    #resources
+    resource_group = model.resource_group_table
+    q = select([resource_group.c.id, resource_group.c.package_id]).\
+        where(resource_group.c.package_id.in_(ids))
+    resource_groups = dict(model.Session.execute(q).fetchall())
+    resources = {}
+    if resource_groups:
+        res_rev = model.resource_revision_table
+        q = select([res_rev]).where(
+            res_rev.c.resource_group_id.in_(resource_groups.keys()))
+        for row in _execute_with_revision(q, res_rev, context):
+            package_id = resource_groups[row['resource_group_id']]
+            resources.setdefault(package_id, []).append(row)
+    #tags
+    tag_rev = model.package_tag_revision_table
+    tag = model.tag_table
+    q = select([tag, tag_rev.c.state, tag_rev.c.revision_timestamp,
+                tag_rev.c.package_id.label('_package_id')],
+        from_obj=tag_rev.join(tag, tag.c.id == tag_rev.c.tag_id)
+        ).where(tag_rev.c.package_id.in_(ids))
+    tags = _rows_by(_execute_with_revision(q, tag_rev, context), '_package_id')
+    #extras
+    extra_rev = model.extra_revision_table
+    q = select([extra_rev]).where(extra_rev.c.package_id.in_(ids))
+    extras = _rows_by(_execute_with_revision(q, extra_rev, context),
+                      'package_id')
+    #groups
+    member_rev = model.member_revision_table
+    group = model.group_table
+    q = select([group, member_rev.c.capacity,
+                member_rev.c.table_id.label('_package_id')],
+               from_obj=member_rev.join(group, group.c.id == member_rev.c.group_id)
+               ).where(member_rev.c.table_id.in_(ids))\
+                .where(member_rev.c.state == 'active')
+    groups = _rows_by(_execute_with_revision(q, member_rev, context),
+                      '_package_id')
+    #relations
+    rel_rev = model.package_relationship_revision_table
+    q = select([rel_rev]).where(rel_rev.c.subject_package_id.in_(ids))
+    relationships_as_subject = _rows_by(
+        _execute_with_revision(q, rel_rev, context), 'subject_package_id')
+    q = select([rel_rev]).where(rel_rev.c.object_package_id.in_(ids))
+    relationships_as_object = _rows_by(
+        _execute_with_revision(q, rel_rev, context), 'object_package_id')
+
+    # We need actual Package objects for the domain object properties, not
+    # PackageRevisions
+    revision_ids = [pkg.id for pkg in pkg_list
+                    if isinstance(pkg, ckan.model.PackageRevision)]
+    domain_objects = {}
+    if revision_ids:
+        domain_objects = dict((pkg.id, pkg) for pkg in
+            model.Session.query(model.Package).filter(
+                model.Package.id.in_(revision_ids)))
+    #tracking
+    urls = []
+    if not context.get('for_edit'):
+        urls = [res.url for res_list in resources.values() for res in res_list]
+    package_tracking, resource_tracking = \
+        model.TrackingSummary.get_totals(ids, urls)
+
+    result_list = []
+    for pkg in pkg_list:
+        result = packages.get(pkg.id)
+        if not result:
+            raise logic.NotFound
+        result_dict = d.table_dictize(result, context)
+        result_dict["resources"] = resource_list_dictize(
+            resources.get(pkg.id, []), context, resource_tracking)
+        result_dict["tags"] = _pop_key(d.obj_list_dictize(
+            tags.get(pkg.id, []), context, lambda x: x["name"]), '_package_id')
+        for tag_dict in result_dict['tags']:
+            assert not tag_dict.has_key('display_name')
+            tag_dict['display_name'] = tag_dict['name']
+        result_dict["extras"] = extras_list_dictize(
+            extras.get(pkg.id, []), context)
+        result_dict['tracking_summary'] = dict(package_tracking[pkg.id])
+        result_dict["groups"] = _pop_key(d.obj_list_dictize(
+            groups.get(pkg.id, []), context), '_package_id')
+        result_dict["relationships_as_subject"] = d.obj_list_dictize(
+            relationships_as_subject.get(pkg.id, []), context)
+        result_dict["relationships_as_object"] = d.obj_list_dictize(
+            relationships_as_object.get(pkg.id, []), context)
+
+        pkg = domain_objects.get(pkg.id, pkg)
+        _add_package_properties(result_dict, pkg, context)
+        result_dict['metadata_created'] = pkg.metadata_created.isoformat() \
+            if pkg.metadata_created else None
+
+        if context.get('for_view'):
+            for item in plugins.PluginImplementations(plugins.IPackageController):
+                result_dict = item.before_view(result_dict)
+        result_list.append(result_dict)
+
+    return result_list
 
-    return result_dict
 
 def _get_members(context, group, member_type):
 
@@ -299,12 +468,16 @@ def group_dictize(group, context):
 def tag_list_dictize(tag_list, context):
 
     result_list = []
-    for tag in tag_list:
+    tag_list = list(tag_list)
+    if context.get('with_capacity'):
+        tags = [tag for tag, capacity in tag_list]
+    else:
+        tags = tag_list
+    tag_dicts = d.table_list_dictize(tags, context)
+
+    for index, dictized in enumerate(tag_dicts):
         if context.get('with_capacity'):
-            tag, capacity = tag
-            dictized = d.table_dictize(tag, context, capacity=capacity)
-        else:
-            dictized = d.table_dictize(tag, context)
+            dictized['capacity'] = tag_list[index][1]
 
         # Add display_names to tag dicts. At first a tag's display_name is just
         # the same as its name, but the display_name might get changed later
@@ -481,14 +654,13 @@ def activity_dictize(activity, context):
     return activity_dict
 
 def activity_list_dictize(activity_list, context):
-    return [activity_dictize(activity, context) for activity in activity_list]
+    return d.table_list_dictize(activity_list, context)
 
 def activity_detail_dictize(activity_detail, context):
     return d.table_dictize(activity_detail, context)
 
 def activity_detail_list_dictize(activity_detail_list, context):
-    return [activity_detail_dictize(activity_detail, context)
-            for activity_detail in activity_detail_list]
+    return d.table_list_dictize(activity_detail_list, context)
 
 
 def package_to_api1(pkg, context):
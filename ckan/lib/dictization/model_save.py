@@ -164,11 +164,19 @@ def package_tag_list_save(tag_dicts, package, context):
             pt.state in ['deleted', 'pending-deleted'] ]
         )
 
+    # tags already looked up (or created) while saving other datasets in
+    # the same batch, see package_create_many
+    tag_cache = context.get('tag_cache', {})
+
     tag_name_vocab = set()
     tags = set()
     for tag_dict in tag_dicts:
-        if (tag_dict.get('name'), tag_dict.get('vocabulary_id')) not in tag_name_vocab:
-            tag_obj = d.table_dict_save(tag_dict, model.Tag, context)
+        key = (tag_dict.get('name'), tag_dict.get('vocabulary_id'))
+        if key not in tag_name_vocab:
+            tag_obj = tag_cache.get(key)
+            if tag_obj is None:
+                tag_obj = d.table_dict_save(tag_dict, model.Tag, context)
+                tag_cache[key] = tag_obj
             tags.add(tag_obj)
             tag_name_vocab.add((tag_obj.name, tag_obj.vocabulary_id))
 
@@ -212,15 +220,22 @@ def package_membership_list_save(group_dicts, package, context):
     group_member = dict((member.group, member)
                          for member in
                          members)
+    # groups already looked up while saving other datasets in the same
+    # batch, see package_create_many
+    group_cache = context.get('group_cache', {})
     groups = set()
     for group_dict in group_dicts:
         id = group_dict.get("id")
         name = group_dict.get("name")
         capacity = group_dict.get("capacity", "public")
-        if id:
+        key = ('id', id) if id else ('name', name)
+        if key in group_cache:
+            group = group_cache[key]
+        elif id:
             group = session.query(model.Group).get(id)
         else:
             group = session.query(model.Group).filter_by(name=name).first()
+        group_cache[key] = group
         groups.add(group)
 
     ## need to flush so we can get out the package id
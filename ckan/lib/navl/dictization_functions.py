@@ -1,4 +1,6 @@
 import copy
+import weakref
+import datetime
 import formencode as fe
 import inspect
 from pylons.i18n import _
@@ -46,10 +48,18 @@ class StopOnError(DictizationError):
     '''error to stop validations for a particualar key'''
     pass
 
+def output_transform(converter):
+    '''mark a converter as a pure output transform: it only changes how valid
+    data is shown (dropping, moving or reformatting values), so it is the
+    only kind of converter run by validate_trusted'''
+
+    converter.output_transform = True
+    return converter
+
 def flattened_order_key(key):
     '''order by key length first then values'''
 
-    return tuple([len(key)] + list(key))
+    return (len(key), key)
 
 def flatten_schema(schema, flattened=None, key=None):
     '''convert schema into flat dict where the keys are tuples'''
@@ -91,67 +101,165 @@ def make_full_schema(data, schema):
     '''make schema by getting all valid combinations and making sure that all keys
     are available'''
 
-    flattented_schema = flatten_schema(schema)
+    compiled = compile_schema(schema)
+    return compiled.full_schema(compiled.key_combinations(data))
 
-    key_combinations = get_all_key_combinations(data, flattented_schema)
+def augment_data(data, schema):
+    '''add missing, extras and junk data'''
+    compiled = compile_schema(schema)
+    key_combinations = compiled.key_combinations(data)
+    full_schema = compiled.full_schema(key_combinations)
+    return compiled.augment_data(data, key_combinations, full_schema)
+
+# Types of the values which are never changed in place, so they can be
+# shared between the data given to validate and the converted data
+_IMMUTABLE_TYPES = frozenset([str, unicode, int, long, float, bool,
+                              type(None), datetime.datetime, datetime.date,
+                              Missing])
+
+def copy_data(data):
+    '''copy a flattened dict, only copying the values that can be changed in
+    place by the converters (lists, dicts...)'''
+
+    new_data = {}
+    for key, value in data.iteritems():
+        if type(value) not in _IMMUTABLE_TYPES:
+            value = copy.deepcopy(value)
+        new_data[key] = value
+    return new_data
 
-    full_schema = {}
+class CompiledSchema(object):
+    '''The parts of the validation of a schema that do not depend on the
+    data: the flattened schema, the prefixes of its keys and the validators
+    of each sub schema. See compile_schema.'''
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.flattened_schema = flatten_schema(schema)
+        ## prefixes of the keys in the data that match a sub schema
+        self.schema_prefixes = frozenset(
+            key[:-1] for key in self.flattened_schema)
+        ## all the prefixes of the flattened keys, including themselves
+        self.initial_keys = frozenset(
+            key[:length] for key in self.flattened_schema
+            for length in range(len(key) + 1))
+        ## (key, validators) of each sub schema, by path in the schema
+        self.sub_schemas = {}
+        self._add_sub_schemas(schema, ())
+
+    def _add_sub_schemas(self, schema, path):
+        self.sub_schemas[path] = sorted(
+            (key, value) for key, value in schema.iteritems()
+            if isinstance(value, list))
+        for key, value in schema.iteritems():
+            if isinstance(value, dict):
+                self._add_sub_schemas(value, path + (key,))
+
+    def key_combinations(self, data):
+        '''all the tuples in the data that match the schema, see
+        get_all_key_combinations'''
+        schema_prefixes = self.schema_prefixes
+        combinations = set([()])
+
+        ## the keys only need to be in order of length, so that the parent
+        ## of a key is always added first
+        keys_by_length = {}
+        for key in data:
+            if key[:-1:2] in schema_prefixes:
+                keys_by_length.setdefault(len(key), []).append(key)
+
+        for length in sorted(keys_by_length):
+            for key in keys_by_length[length]:
+                if key[:-3] in combinations:
+                    combinations.add(key[:-1])
+
+        return combinations
+
+    def full_schema(self, key_combinations):
+        '''the validators of each key expected in the data, see
+        make_full_schema'''
+        full_schema = {}
+        sub_schemas = self.sub_schemas
+        for combination in key_combinations:
+            for key, value in sub_schemas[combination[::2]]:
+                full_schema[combination + (key,)] = value
+        return full_schema
 
-    for combination in key_combinations:
-        sub_schema = schema
-        for key in combination[::2]:
-            sub_schema = sub_schema[key]
+    def augment_data(self, data, key_combinations, full_schema):
+        '''copy the data, adding missing, extras and junk data'''
+        new_data = copy_data(data)
 
-        for key, value in sub_schema.iteritems():
-            if isinstance(value, list):
-                full_schema[combination + (key,)] = value
+        ## fill junk and extras
 
-    return full_schema
+        for key in data:
+            if key in full_schema:
+                continue
+            value = new_data.pop(key)
 
-def augment_data(data, schema):
-    '''add missing, extras and junk data'''
-    flattented_schema = flatten_schema(schema)
-    key_combinations = get_all_key_combinations(data, flattented_schema)
+            ## check if any thing naugthy is placed against subschemas
+            if key[::2] in self.initial_keys:
+                if data[key] <> []:
+                    raise DataError('Only lists of dicts can be placed against '
+                                    'subschema %s, not %s' % (key,type(data[key])))
 
-    full_schema = make_full_schema(data, schema)
+            if key[:-1] in key_combinations:
+                extras_key = key[:-1] + ('__extras',)
+                extras = new_data.setdefault(extras_key, {})
+                extras[key[-1]] = value
+            else:
+                junk = new_data.setdefault(("__junk",), {})
+                junk[key] = value
 
-    new_data = copy.deepcopy(data)
+        ## add missing
 
-    ## fill junk and extras
+        for key in full_schema:
+            if key not in new_data and not key[-1].startswith("__"):
+                new_data[key] = missing
 
-    for key, value in new_data.items():
-        if key in full_schema:
-            continue
+        return new_data
 
-        ## check if any thing naugthy is placed against subschemas
-        initial_tuple = key[::2]
-        if initial_tuple in [initial_key[:len(initial_tuple)]
-                             for initial_key in flattented_schema]:
-            if data[key] <> []:
-                raise DataError('Only lists of dicts can be placed against '
-                                'subschema %s, not %s' % (key,type(data[key])))
-
-        if key[:-1] in key_combinations:
-            extras_key = key[:-1] + ('__extras',)
-            extras = new_data.get(extras_key, {})
-            extras[key[-1]] = value
-            new_data[extras_key] = extras
-        else:
-            junk = new_data.get(("__junk",), {})
-            junk[key] = value
-            new_data[("__junk",)] = junk
-        new_data.pop(key)
+def compile_schema(schema):
+    '''get the compiled version of a schema. Most schemas are built again
+    for each call, and keys can be added to a schema after it is used, so it
+    is compiled once per validation rather than cached.'''
 
-    ## add missing
+    return CompiledSchema(schema)
 
-    for key, value in full_schema.items():
-        if key not in new_data and not key[-1].startswith("__"):
-            new_data[key] = missing
+# How each converter function needs to be called, worked out on its first
+# use: 1 for converter(value), 4 for converter(key, data, errors, context)
+# and 2 for converter(value, context)
+_converter_arities = weakref.WeakKeyDictionary()
 
-    return new_data
+def _get_arity(converter):
+    try:
+        return _converter_arities.get(converter)
+    except TypeError:
+        ## can not be weak referenced
+        return None
+
+def _set_arity(converter, arity):
+    try:
+        _converter_arities[converter] = arity
+    except TypeError:
+        pass
 
 def convert(converter, key, converted_data, errors, context):
 
+    arity = _get_arity(converter)
+    try:
+        if arity == 1:
+            converted_data[key] = converter(converted_data.get(key))
+            return
+        if arity == 4:
+            converter(key, converted_data, errors, context)
+            return
+        if arity == 2:
+            converted_data[key] = converter(converted_data.get(key), context)
+            return
+    except Invalid, e:
+        errors[key].append(e.error)
+        return
+
     if inspect.isclass(converter) and issubclass(converter, fe.Validator):
         try:
             value = converted_data.get(key)
@@ -171,6 +279,7 @@ def convert(converter, key, converted_data, errors, context):
     try:
         value = converter(converted_data.get(key))
         converted_data[key] = value
+        _set_arity(converter, 1)
         return
     except TypeError, e:
         ## hack to make sure the type error was caused by the wrong
@@ -178,13 +287,16 @@ def convert(converter, key, converted_data, errors, context):
         if not converter.__name__ in str(e):
             raise
     except Invalid, e:
+        _set_arity(converter, 1)
         errors[key].append(e.error)
         return
 
     try:
         converter(key, converted_data, errors, context)
+        _set_arity(converter, 4)
         return
     except Invalid, e:
+        _set_arity(converter, 4)
         errors[key].append(e.error)
         return
     except TypeError, e:
@@ -196,8 +308,10 @@ def convert(converter, key, converted_data, errors, context):
     try:
         value = converter(converted_data.get(key), context)
         converted_data[key] = value
+        _set_arity(converter, 2)
         return
     except Invalid, e:
+        _set_arity(converter, 2)
         errors[key].append(e.error)
         return
 
@@ -250,58 +364,74 @@ def validate_flattened(data, schema, context=None):
 
     return converted_data, errors
 
+def transforms_schema(schema):
+    '''copy of a schema with only the converters marked as output
+    transforms'''
+
+    transforms = {}
+    for key, value in schema.iteritems():
+        if isinstance(value, dict):
+            transforms[key] = transforms_schema(value)
+        else:
+            transforms[key] = [converter for converter in value
+                               if getattr(converter, 'output_transform', False)]
+    return transforms
+
+def validate_trusted(data, schema, context=None):
+    '''Convert an unflattened nested dict known to conform to a schema, like
+    the dicts of objects read from the database, running only the output
+    transforms of the schema. The converters checking the data are skipped,
+    so no errors are returned.'''
+    context = context or {}
+
+    assert isinstance(data, dict)
+    flattened = flatten_dict(data)
+    converted_data, errors = _validate(flattened, transforms_schema(schema),
+                                       context)
+    return unflatten(converted_data)
+
+def _run_converters(converters, key, converted_data, errors, context):
+    for converter in converters:
+        try:
+            convert(converter, key, converted_data, errors, context)
+        except StopOnError:
+            break
 
 def _validate(data, schema, context):
     '''validate a flattened dict against a schema'''
-    converted_data = augment_data(data, schema)
-    full_schema = make_full_schema(data, schema)
+    compiled = compile_schema(schema)
+    key_combinations = compiled.key_combinations(data)
+    full_schema = compiled.full_schema(key_combinations)
+    converted_data = compiled.augment_data(data, key_combinations,
+                                           full_schema)
 
     errors = dict((key, []) for key in full_schema)
 
-    ## before run
-    for key in sorted(full_schema, key=flattened_order_key):
-        if key[-1] == '__before':
-            for converter in full_schema[key]:
-                try:
-                    convert(converter, key, converted_data, errors, context)
-                except StopOnError:
-                    break
-
-    ## main run
-    for key in sorted(full_schema, key=flattened_order_key):
-        if not key[-1].startswith('__'):
-            for converter in full_schema[key]:
-                try:
-                    convert(converter, key, converted_data, errors, context)
-                except StopOnError:
-                    break
-
-    ## extras run
-    for key in sorted(full_schema, key=flattened_order_key):
-        if key[-1] == '__extras':
-            for converter in full_schema[key]:
-                try:
-                    convert(converter, key, converted_data, errors, context)
-                except StopOnError:
-                    break
-
-    ## after run
-    for key in reversed(sorted(full_schema, key=flattened_order_key)):
-        if key[-1] == '__after':
-            for converter in full_schema[key]:
-                try:
-                    convert(converter, key, converted_data, errors, context)
-                except StopOnError:
-                    break
+    ## the keys in the order of flattened_order_key, without sorting the
+    ## full schema: the keys of the same length are ordered by combination
+    ## and then by the (already sorted) keys of the sub schema
+    before_keys, main_keys, extras_keys, after_keys = [], [], [], []
+    for combination in sorted(key_combinations, key=flattened_order_key):
+        for key, value in compiled.sub_schemas[combination[::2]]:
+            if key == '__before':
+                before_keys.append(combination + (key,))
+            elif not key.startswith('__'):
+                main_keys.append(combination + (key,))
+            elif key == '__extras':
+                extras_keys.append(combination + (key,))
+            elif key == '__after':
+                after_keys.append(combination + (key,))
+    after_keys.reverse()
+
+    for keys in (before_keys, main_keys, extras_keys, after_keys):
+        for key in keys:
+            _run_converters(full_schema[key], key, converted_data, errors,
+                            context)
 
     ## junk
     if ('__junk',) in full_schema:
-        for converter in full_schema[('__junk',)]:
-            try:
-                convert(converter, ('__junk',), converted_data, errors, context)
-            except StopOnError:
-                break
-
+        _run_converters(full_schema[('__junk',)], ('__junk',),
+                        converted_data, errors, context)
 
     return converted_data, errors
 
@@ -1,9 +1,10 @@
-from dictization_functions import missing, StopOnError, Invalid
+from dictization_functions import missing, StopOnError, Invalid, output_transform
 from pylons.i18n import _
 
 def identity_converter(key, data, errors, context):
     return
 
+@output_transform
 def keep_extras(key, data, errors, context):
 
     extras = data.pop(key, {})
@@ -26,6 +27,7 @@ def not_empty(key, data, errors, context):
 
 def if_empty_same_as(other_key):
 
+    @output_transform
     def callable(key, data, errors, context):
         value = data.get(key)
         if not value or value is missing:
@@ -46,6 +48,7 @@ def both_not_empty(other_key):
 
     return callable
 
+@output_transform
 def empty(key, data, errors, context):
 
     value = data.pop(key, None)
@@ -54,6 +57,7 @@ def empty(key, data, errors, context):
         errors[key].append(_(
             'The input field %(name)s was not expected.') % {"name": key[-1]})
 
+@output_transform
 def ignore(key, data, errors, context):
 
     value = data.pop(key, None)
@@ -61,6 +65,7 @@ def ignore(key, data, errors, context):
 
 def default(defalult_value):
 
+    @output_transform
     def callable(key, data, errors, context):
 
         value = data.get(key)
@@ -69,6 +74,7 @@ def default(defalult_value):
 
     return callable
 
+@output_transform
 def ignore_missing(key, data, errors, context):
 
     value = data.get(key)
@@ -77,6 +83,7 @@ def ignore_missing(key, data, errors, context):
         data.pop(key, None)
         raise StopOnError
 
+@output_transform
 def ignore_empty(key, data, errors, context):
 
     value = data.get(key)
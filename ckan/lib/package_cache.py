@@ -0,0 +1,225 @@
+'''
+Cache of the dataset dicts returned by package_show.
+
+Dicts are cached by dataset id, the time the dataset was last modified,
+the user and the context options that change the output of package_show
+(see VARIANT_KEYS), and are invalidated once changes to the dataset or any
+of its related objects are committed (see ckan.model.modification).
+
+There is an in-process least recently used tier, and optionally a tier
+in Redis shared by all the CKAN processes.
+'''
+import time
+import json
+import logging
+import threading
+
+from pylons import config
+try:
+    from collections import OrderedDict # from python 2.7
+except ImportError:
+    from sqlalchemy.util import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Context options which change the dict returned by package_show
+VARIANT_KEYS = ['validate', 'for_view', 'for_edit', 'extras_as_string',
+                'active', 'api_version']
+
+# Context options asking for a past or pending version of the dataset, or
+# for a schema given by the caller, which are never cached
+BYPASS_KEYS = ['revision_id', 'revision_date', 'pending', 'schema']
+
+
+class PackageCache(object):
+    '''
+        Caches the package_show dicts of datasets. Values are stored
+        serialized, so callers always get their own copy.
+
+        Without a shared tier, an invalidation only clears the cache of the
+        process doing the change, so other processes will see the change
+        once their cached dicts expire. With the Redis tier, each dataset
+        has a generation number which is increased on invalidation and is
+        part of the keys of both tiers, so all processes see changes
+        straight away.
+    '''
+
+    def __init__(self, size, ttl, redis_url=None, shared=False):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._stats = dict.fromkeys(
+            ['hits', 'shared_hits', 'misses', 'invalidations'], 0)
+        self.redis_connection = None
+        if shared:
+            import redis    # only import if used
+            self.redis_exception = redis.exceptions.ConnectionError
+            if redis_url:
+                self.redis_connection = redis.StrictRedis.from_url(redis_url)
+            else:
+                self.redis_connection = redis.StrictRedis()
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _shared_key(self, package_id, generation=None):
+        key = 'package:%s:%s' % (config.get('ckan.site_id'), package_id)
+        if generation is not None:
+            key += ':%s' % generation
+        return key
+
+    def _generation(self, package_id):
+        if self.redis_connection is None:
+            return 0
+        try:
+            return int(self.redis_connection.get(
+                self._shared_key(package_id)) or 0)
+        except self.redis_exception:
+            return None
+
+    def get(self, package_id, variant):
+        generation = self._generation(package_id)
+        if generation is None:
+            return None
+        key = (package_id, generation, variant)
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None and time.time() - item[1] <= self.ttl:
+                # move to the end, as the most recently used
+                self._items[key] = item
+                self._stats['hits'] += 1
+                return json.loads(item[0])
+        value = None
+        if self.redis_connection is not None:
+            try:
+                value = self.redis_connection.hget(
+                    self._shared_key(package_id, generation), variant)
+            except self.redis_exception:
+                pass
+        if value is None:
+            self._count('misses')
+            return None
+        self._count('shared_hits')
+        self._set_local(key, value)
+        return json.loads(value)
+
+    def set(self, package_id, variant, package_dict):
+        generation = self._generation(package_id)
+        if generation is None:
+            return
+        try:
+            value = json.dumps(package_dict)
+        except TypeError, e:
+            log.debug('Could not cache dataset %s: %r', package_id, e)
+            return
+        self._set_local((package_id, generation, variant), value)
+        if self.redis_connection is not None:
+            key = self._shared_key(package_id, generation)
+            try:
+                pipe = self.redis_connection.pipeline()
+                pipe.hset(key, variant, value)
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+            except self.redis_exception:
+                pass
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, time.time())
+            while len(self._items) > self.size:
+                # the first key is the least recently used one
+                del self._items[iter(self._items).next()]
+
+    def invalidate(self, package_id):
+        self._count('invalidations')
+        with self._lock:
+            for key in [key for key in self._items if key[0] == package_id]:
+                del self._items[key]
+        if self.redis_connection is not None:
+            try:
+                self.redis_connection.incr(self._shared_key(package_id))
+            except self.redis_exception, e:
+                log.error('Could not invalidate the cached dataset %s: %r',
+                          package_id, e)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_package_cache = None
+
+
+def get_package_cache():
+    '''
+        Returns the dataset cache configured with ckan.package_cache
+        ("memory" or "redis"), or None if the cache is disabled (the
+        default).
+    '''
+    global _package_cache
+    if _package_cache is None:
+        backend = config.get('ckan.package_cache', 'none')
+        if backend not in ('memory', 'redis'):
+            return None
+        _package_cache = PackageCache(
+            int(config.get('ckan.package_cache.size', 1000)),
+            int(config.get('ckan.package_cache.ttl', 300)),
+            config.get('ckan.package_cache.redis_url'),
+            shared=(backend == 'redis'))
+    return _package_cache
+
+
+def reset_package_cache():
+    '''Discards the current cache, so the configuration is read again.'''
+    global _package_cache
+    _package_cache = None
+
+
+def invalidate(package_id):
+    '''Removes the cached dicts of a dataset, if the cache is enabled.'''
+    cache = get_package_cache()
+    if cache is not None:
+        cache.invalidate(package_id)
+
+
+def package_cache_stats():
+    '''
+        Returns the hits (in this process and in the shared tier), misses
+        and invalidations of the dataset cache in this process.
+    '''
+    cache = get_package_cache()
+    return cache.stats() if cache is not None else {}
+
+
+def variant_key(package, context):
+    '''
+        Returns the cache key of the dict of a dataset for the options in
+        the context, or None if the dict should not be cached.
+    '''
+    for key in BYPASS_KEYS:
+        if context.get(key):
+            return None
+    # don't cache dicts including changes not committed yet
+    session = context['model'].Session
+    if session.new or session.dirty or session.deleted or \
+            hasattr(session(), '_object_cache'):
+        return None
+    # metadata_modified changes with the dataset's resources, tags, extras
+    # and relationships too, unlike its revision_id
+    options = [unicode(package.metadata_modified)]
+    options.extend(unicode(context.get(key)) for key in VARIANT_KEYS)
+    # the schema's validators may hide fields depending on the user's
+    # permissions, e.g. ignore_not_package_admin
+    options.extend([context.get('user'), 'ignore_auth' in context])
+    if context.get('for_view'):
+        # before_view plugins may translate the dict
+        from pylons import request
+        try:
+            options.append(request.environ.get('CKAN_LANG'))
+        except TypeError:
+            # not in a request
+            pass
+    return json.dumps(options)
@@ -0,0 +1,208 @@
+'''
+Page cache used by PageCacheMiddleware (ckan.page_cache_enabled).
+
+Pages are stored in Redis for ckan.page_cache.ttl seconds, keeping up to
+ckan.page_cache.size pages. Each page is tagged with the entities shown in
+it, e.g. "package:<id>" for a dataset or "package" for any list or search
+of datasets, which are recorded while it is rendered with tag_page. When
+objects are committed to the database, only the pages tagged with them are
+removed from the cache (see ckan.model.meta.CkanCacheExtension).
+'''
+import json
+import time
+import logging
+import threading
+
+from pylons import config
+
+log = logging.getLogger(__name__)
+
+# Classes of objects only related to a dataset through their package_id
+PACKAGE_ID_CLASSES = ['ResourceGroup', 'PackageTag', 'PackageExtra',
+                      'Rating']
+
+
+def tag_page(*tags):
+    '''Records that the page being rendered shows the given entities, so
+    it is removed from the page cache when they change.'''
+    from pylons import request
+    try:
+        environ = request.environ
+    except TypeError:
+        # not in a request
+        return
+    environ.setdefault('CKAN_PAGE_TAGS', set()).update(tags)
+
+
+def object_tags(obj):
+    '''Returns the tags of the pages which may show the given object.'''
+    name = obj.__class__.__name__
+    if name in ('Package', 'Group', 'User'):
+        return [name.lower(), '%s:%s' % (name.lower(), obj.id)]
+    if name in PACKAGE_ID_CLASSES:
+        return ['package', 'package:%s' % obj.package_id]
+    if name == 'Resource':
+        if obj.resource_group is None:
+            return ['package']
+        return ['package', 'package:%s' % obj.resource_group.package_id]
+    if name == 'PackageRelationship':
+        return ['package', 'package:%s' % obj.subject_package_id,
+                'package:%s' % obj.object_package_id]
+    if name == 'Member':
+        tags = ['group', 'group:%s' % obj.group_id]
+        if obj.table_name in ('package', 'user'):
+            tags.append('%s:%s' % (obj.table_name, obj.table_id))
+        return tags
+    if name == 'Activity':
+        # e.g. "changed package", and the object is the dataset
+        return ['user:%s' % obj.user_id,
+                '%s:%s' % (obj.activity_type.split()[-1], obj.object_id)]
+    if name in ('Tag', 'Vocabulary'):
+        # tag lists and search facets
+        return ['package']
+    # other objects are not shown in the cached pages, or only until the
+    # pages expire
+    return []
+
+
+class PageCache(object):
+    '''
+        Stores pages (status, headers and body) in Redis. Pages expire
+        after ttl seconds, and the oldest pages are removed when there are
+        more than size of them.
+    '''
+
+    def __init__(self, size, ttl, redis_url=None):
+        import redis    # only import if used
+        self.redis = redis
+        self.redis_exception = redis.exceptions.ConnectionError
+        self.redis_url = redis_url
+        self.size = size
+        self.ttl = ttl
+        self._connection = None
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(
+            ['hits', 'misses', 'stores', 'invalidations'], 0)
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            self._stats[counter] += n
+
+    def _connect(self):
+        # Connecting here allows the redis server to be unavailable at
+        # times.
+        if self._connection is None:
+            if self.redis_url:
+                self._connection = self.redis.StrictRedis.from_url(
+                    self.redis_url)
+            else:
+                self._connection = self.redis.StrictRedis()
+        return self._connection
+
+    def _key(self, kind, name):
+        return '%s:%s:%s' % (kind, config.get('ckan.site_id'), name)
+
+    def get(self, key):
+        '''Returns the (status, headers, body) of a cached page, or None.'''
+        try:
+            result = self._connect().lrange(self._key('page', key), 0, 2)
+        except self.redis_exception:
+            # Connection failed so clear it
+            self._connection = None
+            return None
+        if len(result) < 3:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return result[0], json.loads(result[1]), result[2]
+
+    def set(self, key, status, headers, body, tags):
+        page_key = self._key('page', key)
+        index_key = self._key('pages', 'index')
+        now = time.time()
+        try:
+            connection = self._connect()
+            # Use a pipe to add page in a transaction.
+            pipe = connection.pipeline()
+            pipe.delete(page_key)
+            pipe.rpush(page_key, status)
+            pipe.rpush(page_key, json.dumps(headers))
+            pipe.rpush(page_key, body)
+            pipe.expire(page_key, self.ttl)
+            for tag in tags:
+                tag_key = self._key('page-tag', tag)
+                pipe.sadd(tag_key, page_key)
+                pipe.expire(tag_key, self.ttl)
+            # The index holds each page once, scored by the time it was
+            # stored, without the pages which have expired.
+            pipe.zadd(index_key, now, page_key)
+            pipe.zremrangebyscore(index_key, '-inf', now - self.ttl)
+            pipe.expire(index_key, self.ttl)
+            pipe.zcard(index_key)
+            pages = pipe.execute()[-1]
+            # remove the oldest pages over the size limit
+            if pages > self.size:
+                old_keys = connection.zrange(index_key, 0,
+                                             pages - self.size - 1)
+                if old_keys:
+                    pipe = connection.pipeline()
+                    pipe.delete(*old_keys)
+                    pipe.zrem(index_key, *old_keys)
+                    pipe.execute()
+        except self.redis_exception:
+            self._connection = None
+            return
+        self._count('stores')
+
+    def invalidate(self, tags):
+        '''Removes the pages tagged with any of the given tags.'''
+        if not tags:
+            return
+        tag_keys = [self._key('page-tag', tag) for tag in tags]
+        try:
+            connection = self._connect()
+            pipe = connection.pipeline()
+            for tag_key in tag_keys:
+                pipe.smembers(tag_key)
+            page_keys = set()
+            for members in pipe.execute():
+                page_keys.update(members)
+            pipe = connection.pipeline()
+            pipe.delete(*(list(page_keys) + tag_keys))
+            if page_keys:
+                pipe.zrem(self._key('pages', 'index'), *page_keys)
+            pipe.execute()
+        except self.redis_exception, e:
+            self._connection = None
+            log.error('Could not invalidate the cached pages: %r', e)
+            return
+        self._count('invalidations', len(page_keys))
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_page_cache = None
+
+
+def get_page_cache():
+    '''Returns the page cache, configured with the ckan.page_cache.*
+    options.'''
+    global _page_cache
+    if _page_cache is None:
+        _page_cache = PageCache(
+            int(config.get('ckan.page_cache.size', 10000)),
+            int(config.get('ckan.page_cache.ttl', 300)),
+            config.get('ckan.page_cache.redis_url'))
+    return _page_cache
+
+
+def page_cache_stats():
+    '''
+        Returns the hits, misses, stored pages and pages invalidated by the
+        page cache in this process.
+    '''
+    if _page_cache is None:
+        return {}
+    return _page_cache.stats()
@@ -243,6 +243,12 @@ class DefaultDatasetForm(object):
             return schema
         return self.db_to_form_schema()
 
+    def db_to_form_trusted(self):
+        '''Whether the converters of db_to_form_schema which are not marked
+        as output transforms can be skipped for data read from the database
+        (optional)'''
+        return False
+
     def check_data_dict(self, data_dict, schema=None):
         '''Check if the return data is correct, mostly for checking out
         if spammers are submitting only part of the form'''
@@ -1,20 +1,25 @@
 import logging
+import json
+import threading
 from pylons import config, c
 
 from ckan import model
 from ckan.plugins import SingletonPlugin, implements, IDomainObjectModification
-from ckan.logic import get_action
+from ckan.logic import get_action, NotFound
 import ckan.model.domain_object as domain_object
 
 from common import (SearchIndexError, SearchError, SearchQueryError,
-                    make_connection, is_available, SolrSettings)
+                    make_connection, is_available, SolrSettings,
+                    connection_pool_stats)
 from index import PackageSearchIndex, NoopSearchIndex
+from cache import query_cache_stats
 from query import (TagSearchQuery, ResourceSearchQuery, PackageSearchQuery,
                    QueryOptions, convert_legacy_parameters_to_solr)
 
 log = logging.getLogger(__name__)
 
 import sys
+import time
 import cgitb
 import warnings
 
@@ -109,6 +114,61 @@ def dispatch_by_operation(entity_type, entity, operation):
         raise
 
 
+# Changes to datasets recorded by SynchronousSearchPlugin while an index
+# batch is open in this thread, see begin_index_batch
+_index_batch = threading.local()
+
+
+def begin_index_batch():
+    '''
+        Starts recording the changes to datasets notified to
+        SynchronousSearchPlugin in this thread instead of indexing each one
+        straight away. They are sent to the search index together, with a
+        single commit, by commit_index_batch.
+    '''
+    _index_batch.operations = {}
+
+
+def commit_index_batch():
+    '''
+        Indexes the changes recorded since begin_index_batch and stops
+        recording them. Does nothing if no batch was started.
+    '''
+    operations = getattr(_index_batch, 'operations', None)
+    _index_batch.operations = None
+    package_index = index_for(model.Package)
+    if operations and not isinstance(package_index, NoopSearchIndex):
+        _index_operations(package_index, operations)
+
+
+def discard_index_batch():
+    '''Stops recording changes, forgetting the ones recorded.'''
+    _index_batch.operations = None
+
+
+def _index_operations(package_index, operations):
+    '''
+        Updates the search index with a dict of dataset ids to the last
+        operation on each of them, committing the index once.
+    '''
+    pkg_dicts = []
+    for pkg_id, operation in operations.iteritems():
+        if operation != domain_object.DomainObjectOperation.deleted:
+            try:
+                pkg_dicts.append(get_action('package_show')(
+                    {'model': model, 'ignore_auth': True,
+                     'validate': False},
+                    {'id': pkg_id}))
+                continue
+            except NotFound:
+                # purged since the change was recorded
+                pass
+        package_index.delete_package({'id': pkg_id}, defer_commit=True)
+
+    package_index.index_packages(pkg_dicts, defer_commit=True)
+    package_index.commit()
+
+
 class SynchronousSearchPlugin(SingletonPlugin):
     """Update the search index automatically."""
     implements(IDomainObjectModification, inherit=True)
@@ -116,6 +176,10 @@ class SynchronousSearchPlugin(SingletonPlugin):
     def notify(self, entity, operation):
         if not isinstance(entity, model.Package):
             return
+        operations = getattr(_index_batch, 'operations', None)
+        if operations is not None:
+            operations[entity.id] = operation
+            return
         if operation != domain_object.DomainObjectOperation.deleted:
             dispatch_by_operation(
                 entity.__class__.__name__,
@@ -131,15 +195,222 @@ class SynchronousSearchPlugin(SingletonPlugin):
             log.warn("Discarded Sync. indexing for: %s" % entity)
 
 
-def rebuild(package_id=None, only_missing=False, force=False, refresh=False):
+class AsynchronousSearchPlugin(SingletonPlugin):
+    """Record the changes to datasets in a queue, so the search index can be
+    updated later on by ``paster search-index process-queue``."""
+    implements(IDomainObjectModification, inherit=True)
+
+    def notify(self, entity, operation):
+        if not isinstance(entity, model.Package):
+            return
+        model.SearchIndexQueue.enqueue(entity.id, operation)
+
+
+def process_queue(batch_size=None):
+    '''
+        Updates the search index with the changes recorded in the search
+        index queue by AsynchronousSearchPlugin.
+
+        The queue is processed in batches of batch_size entries
+        (search.queue.batch_size, 500 by default). Several changes to the
+        same dataset within a batch are collapsed into a single index
+        operation, and the index is committed once per batch. Entries are
+        only removed from the queue once the index has been updated, so if
+        the search server is not available they will be processed on the
+        next run.
+
+        Returns the number of entries processed.
+    '''
+    from ckan import model
+    if batch_size is None:
+        batch_size = int(config.get('search.queue.batch_size', 500))
+
+    package_index = index_for(model.Package)
+    processed = 0
+    while True:
+        entries = model.SearchIndexQueue.next_batch(batch_size)
+        if not entries:
+            break
+
+        # Only the last operation on each dataset is relevant
+        operations = {}
+        for entry_id, pkg_id, operation in entries:
+            operations[pkg_id] = operation
+
+        _index_operations(package_index, operations)
+
+        model.SearchIndexQueue.remove([entry[0] for entry in entries])
+        model.Session.commit()
+        processed += len(entries)
+        log.info('Processed %i search index queue entries (%i datasets)',
+                 len(entries), len(operations))
+
+    return processed
+
+
+def _get_package_dicts(package_ids):
+    '''
+        Returns the package dicts to index for the given list of dataset ids.
+        Used by rebuild, both in the main process and in the worker processes.
+    '''
+    from ckan import model
+    context = {'model': model, 'ignore_auth': True, 'validate': False}
+    pkg_dicts = []
+    errors = []
+    for pkg_id in package_ids:
+        try:
+            pkg_dicts.append(get_action('package_show')(context.copy(),
+                                                        {'id': pkg_id}))
+        except Exception, e:
+            errors.append((pkg_id, str(e), text_traceback()))
+    model.Session.remove()
+    return package_ids, pkg_dicts, errors
+
+
+def _init_rebuild_worker():
+    '''
+        Worker processes must not share the database connections inherited
+        from the parent process.
+    '''
+    from ckan import model
+    model.Session.remove()
+    model.meta.engine.dispose()
+
+
+def _read_checkpoint(checkpoint):
+    import os
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            return f.read().strip() or None
+    return None
+
+
+def _write_checkpoint(checkpoint, last_id):
+    if checkpoint:
+        with open(checkpoint, 'w') as f:
+            f.write(last_id)
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_db_package_ids(after=None, chunk_size=1000):
+    '''
+        Yields the ids of all the active datasets in the database, in the
+        same order as the search index sorts them, fetching chunk_size ids at
+        a time. If after is given, only ids greater than it are returned.
+    '''
+    from ckan import model
+    while True:
+        query = model.Session.query(model.Package.id).\
+            filter(model.Package.state == 'active')
+        if after is not None:
+            # ~>~ and ~<~ compare strings byte by byte, as Solr does,
+            # regardless of the database collation
+            query = query.filter(model.Package.id.op('~>~')(after))
+        package_ids = [r[0] for r in
+                       query.order_by('package.id USING ~<~').
+                       limit(chunk_size)]
+        for package_id in package_ids:
+            yield package_id
+        if len(package_ids) < chunk_size:
+            break
+        after = package_ids[-1]
+
+
+def iter_indexed_package_ids(after=None, chunk_size=1000):
+    '''
+        Yields the ids of all the active datasets in the search index, sorted
+        by id, fetching chunk_size ids at a time. If after is given, only ids
+        greater than it are returned.
+    '''
+    from ckan import model
+    cursor = after or ''
+    while cursor is not None:
+        query = query_for(model.Package)
+        query.run({'q': '*:*', 'fl': 'id', 'rows': chunk_size,
+                   'cursor': cursor, 'facet': 'false'})
+        for package_id in query.results:
+            yield package_id
+        cursor = query.next_cursor
+
+
+def reconcile(after=None, chunk_size=1000):
+    '''
+        Compares the datasets in the database and in the search index,
+        yielding ('missing', id) for each active dataset not indexed and
+        ('orphaned', id) for each indexed dataset not active in the database.
+
+        Both lists of ids are streamed in sorted chunks and merged, so memory
+        use does not depend on the number of datasets.
+    '''
+    db_ids = iter_db_package_ids(after, chunk_size)
+    index_ids = iter_indexed_package_ids(after, chunk_size)
+    db_id = next(db_ids, None)
+    index_id = next(index_ids, None)
+    while db_id is not None or index_id is not None:
+        if index_id is None or (db_id is not None and
+                                db_id.encode('utf8') < index_id.encode('utf8')):
+            yield 'missing', db_id
+            db_id = next(db_ids, None)
+        elif db_id is None or index_id.encode('utf8') < db_id.encode('utf8'):
+            yield 'orphaned', index_id
+            index_id = next(index_ids, None)
+        else:
+            db_id = next(db_ids, None)
+            index_id = next(index_ids, None)
+
+
+def _missing_package_ids(package_index, after=None):
+    '''
+        Yields the ids of the datasets not indexed, removing from the index
+        any dataset that is not active in the database on the way.
+    '''
+    orphaned = 0
+    for status, package_id in reconcile(after):
+        if status == 'missing':
+            yield package_id
+        else:
+            package_index.delete_package({'id': package_id},
+                                         defer_commit=True)
+            orphaned += 1
+    if orphaned:
+        package_index.commit()
+        log.info('Removed %i datasets from the index not active in the '
+                 'database', orphaned)
+
+
+def rebuild(package_id=None, only_missing=False, force=False, refresh=False,
+            batch_size=None, workers=None, commit_every=None,
+            checkpoint=None):
     '''
         Rebuilds the search index.
 
         If a dataset id is provided, only this dataset will be reindexed.
         When reindexing all datasets, if only_missing is True, only the
-        datasets not already indexed will be processed. If force equals
-        True, if an exception is found, the exception will be logged, but
-        the process will carry on.
+        datasets not already indexed will be processed, and indexed datasets
+        not active in the database will be removed from the index. If force
+        equals True, if an exception is found, the exception will be logged,
+        but the process will carry on.
+
+        When reindexing all datasets, these are sent to the search index in
+        batches of batch_size datasets (search.rebuild.batch_size, 100 by
+        default), and the index is only committed at the end of the process,
+        or every commit_every datasets if provided. If workers is greater
+        than 1, the datasets are dictized in a pool of worker processes.
+
+        If a checkpoint file path is provided, the id of the last indexed
+        dataset is stored there after each batch, and a later rebuild using
+        the same file will resume from that point. The file is removed once
+        the rebuild finishes successfully.
     '''
     from ckan import model
     log.info("Rebuilding search index...")
@@ -154,42 +425,98 @@ def rebuild(package_id=None, only_missing=False, force=False, refresh=False):
         package_index.remove_dict(pkg_dict)
         package_index.insert_dict(pkg_dict)
     else:
-        package_ids = [r[0] for r in model.Session.query(model.Package.id).
-                       filter(model.Package.state == 'active').all()]
+        if batch_size is None:
+            batch_size = int(config.get('search.rebuild.batch_size', 100))
+        if workers is None:
+            workers = int(config.get('search.rebuild.workers', 1))
+        if commit_every is None:
+            commit_every = int(config.get('search.rebuild.commit_every', 0))
+        batch_size = max(1, batch_size)
+
+        last_indexed_id = _read_checkpoint(checkpoint)
+        if last_indexed_id:
+            log.info('Resuming from checkpoint, after dataset %s',
+                     last_indexed_id)
+
         if only_missing:
             log.info('Indexing only missing packages...')
-            package_query = query_for(model.Package)
-            indexed_pkg_ids = set(package_query.get_all_entity_ids(
-                max_results=len(package_ids)))
-            # Packages not indexed
-            package_ids = set(package_ids) - indexed_pkg_ids
-
-            if len(package_ids) == 0:
-                log.info('All datasets are already indexed')
-                return
+            package_ids = _missing_package_ids(package_index, last_indexed_id)
+            total = None
         else:
             log.info('Rebuilding the whole index...')
-            # When refreshing, the index is not previously cleared
-            if not refresh:
+            # When refreshing or resuming, the index is not previously cleared
+            if not refresh and not last_indexed_id:
                 package_index.clear()
-
-        for pkg_id in package_ids:
-            try:
-                package_index.insert_dict(
-                    get_action('package_show')(
-                        {'model': model, 'ignore_auth': True,
-                         'validate': False},
-                        {'id': pkg_id}
-                    )
-                )
-            except Exception, e:
-                log.error('Error while indexing dataset %s: %s' %
-                          (pkg_id, str(e)))
-                if force:
-                    log.error(text_traceback())
-                    continue
-                else:
-                    raise
+            package_ids = iter_db_package_ids(last_indexed_id)
+            total = model.Session.query(model.Package.id).\
+                filter(model.Package.state == 'active').count()
+
+        batches = _chunks(package_ids, batch_size)
+
+        pool = None
+        if workers > 1:
+            import multiprocessing
+            model.Session.remove()
+            pool = multiprocessing.Pool(workers, _init_rebuild_worker)
+            results = pool.imap(_get_package_dicts, batches)
+        else:
+            results = (_get_package_dicts(batch) for batch in batches)
+
+        start_time = time.time()
+        indexed = 0
+        failed = 0
+        since_commit = 0
+        try:
+            for batch, pkg_dicts, errors in results:
+                for pkg_id, error, traceback in errors:
+                    log.error('Error while indexing dataset %s: %s' %
+                              (pkg_id, error))
+                    if force:
+                        log.error(traceback)
+                    else:
+                        raise SearchIndexError(error)
+                failed += len(errors)
+
+                try:
+                    package_index.index_packages(pkg_dicts, defer_commit=True)
+                except Exception, e:
+                    log.error('Error while indexing datasets %s to %s: %s' %
+                              (batch[0], batch[-1], str(e)))
+                    if force:
+                        log.error(text_traceback())
+                        failed += len(pkg_dicts)
+                        continue
+                    else:
+                        raise
+                indexed += len(pkg_dicts)
+                since_commit += len(pkg_dicts)
+
+                if commit_every and since_commit >= commit_every:
+                    package_index.commit()
+                    since_commit = 0
+                _write_checkpoint(checkpoint, batch[-1])
+
+                elapsed = time.time() - start_time
+                log.info('Indexed %i of %s datasets (%.1f datasets/sec)',
+                         indexed + failed, total or 'the missing',
+                         indexed / elapsed if elapsed else 0)
+        finally:
+            if pool:
+                pool.terminate()
+            if indexed:
+                package_index.commit()
+
+        if only_missing and not indexed + failed:
+            log.info('All datasets are already indexed')
+        else:
+            elapsed = time.time() - start_time
+            log.info('Indexed %i datasets in %.1f seconds (%.1f datasets/sec), '
+                     '%i errors', indexed, elapsed,
+                     indexed / elapsed if elapsed else 0, failed)
+        if checkpoint:
+            import os
+            if os.path.exists(checkpoint):
+                os.remove(checkpoint)
 
     model.Session.commit()
     log.info('Finished rebuilding search index.')
@@ -197,19 +524,22 @@ def rebuild(package_id=None, only_missing=False, force=False, refresh=False):
 
 def check():
     from ckan import model
-    package_query = query_for(model.Package)
 
     log.debug("Checking packages search index...")
-    pkgs_q = model.Session.query(model.Package).filter_by(
-        state=model.State.ACTIVE)
-    pkgs = set([pkg.id for pkg in pkgs_q])
-    indexed_pkgs = set(package_query.get_all_entity_ids(max_results=len(pkgs)))
-    pkgs_not_indexed = pkgs - indexed_pkgs
-    print 'Packages not indexed = %i out of %i' % (len(pkgs_not_indexed),
-                                                   len(pkgs))
-    for pkg_id in pkgs_not_indexed:
-        pkg = model.Session.query(model.Package).get(pkg_id)
-        print pkg.revision.timestamp.strftime('%Y-%m-%d'), pkg.name
+    total = model.Session.query(model.Package.id).\
+        filter(model.Package.state == model.State.ACTIVE).count()
+    not_indexed = 0
+    orphaned = 0
+    for status, pkg_id in reconcile():
+        if status == 'missing':
+            not_indexed += 1
+            pkg = model.Session.query(model.Package).get(pkg_id)
+            print pkg.revision.timestamp.strftime('%Y-%m-%d'), pkg.name
+        else:
+            orphaned += 1
+            print 'Not in the database:', pkg_id
+    print 'Packages not indexed = %i out of %i' % (not_indexed, total)
+    print 'Indexed packages not active in the database = %i' % orphaned
 
 
 def show(package_reference):
@@ -219,6 +549,30 @@ def show(package_reference):
     return package_query.get_index(package_reference)
 
 
+def iter_packages(q='*:*', fq='+capacity:public', page_size=1000):
+    '''
+        Yields the dicts of all the datasets matching the given query, as
+        stored in the search index.
+
+        Results are fetched page_size at a time using cursor based paging,
+        so the whole result set is never held in memory and walking through
+        the full catalogue does not get slower on later pages. By default
+        only public datasets are returned.
+    '''
+    from ckan import model
+    cursor = ''
+    while cursor is not None:
+        query = query_for(model.Package)
+        query.run({'q': q, 'fq': fq, 'rows': page_size, 'cursor': cursor,
+                   'fl': 'id data_dict', 'facet': 'false'})
+        for result in query.results:
+            if result.get('data_dict'):
+                yield json.loads(result['data_dict'])
+            else:
+                yield result
+        cursor = query.next_cursor
+
+
 def clear(package_reference=None):
     from ckan import model
     package_index = index_for(model.Package)
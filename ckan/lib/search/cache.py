@@ -0,0 +1,207 @@
+import time
+import json
+import hashlib
+import logging
+import threading
+
+from pylons import config
+
+from ckan.lib.helpers import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+def make_key(query):
+    '''
+        Returns a cache key for a dict (or MultiDict) of Solr query
+        parameters. Parameters are sorted and whitespace is normalized, so
+        equivalent queries share the same key.
+    '''
+    items = []
+    for key in sorted(set(query.keys())):
+        if hasattr(query, 'getall'):
+            values = query.getall(key)
+        else:
+            values = query[key]
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        values = sorted(' '.join(unicode(value).split()) for value in values)
+        items.append((key, values))
+    return hashlib.md5(json.dumps(items)).hexdigest()
+
+
+class QueryCache(object):
+    '''
+        Caches the results of Solr package queries. Subclasses implement
+        _get, _set and _clear for a particular storage. Cached values are
+        stored serialized, so callers always get their own copy.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(['hits', 'misses', 'invalidations'], 0)
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def get(self, key):
+        value = self._get(key)
+        if value is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return json.loads(value)
+
+    def set(self, key, value):
+        self._set(key, json.dumps(value))
+
+    def invalidate(self):
+        self._count('invalidations')
+        self._clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _get(self, key):
+        return None
+
+    def _set(self, key, value):
+        pass
+
+    def _clear(self):
+        pass
+
+
+class NoopQueryCache(QueryCache):
+    '''Used when the query cache is disabled.'''
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def invalidate(self):
+        pass
+
+
+class MemoryQueryCache(QueryCache):
+    '''
+        A least recently used cache kept in the memory of each process.
+        Invalidations only clear the cache of the process doing the index
+        update, so other processes will see the changes once their cached
+        results expire.
+    '''
+
+    def __init__(self, size, ttl):
+        super(MemoryQueryCache, self).__init__()
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()
+
+    def _get(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return None
+            if time.time() - item[1] > self.ttl:
+                return None
+            # move to the end, as the most recently used
+            self._items[key] = item
+            return item[0]
+
+    def _set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, time.time())
+            while len(self._items) > self.size:
+                # the first key is the least recently used one
+                del self._items[iter(self._items).next()]
+
+    def _clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class RedisQueryCache(QueryCache):
+    '''
+        A cache shared by all the CKAN processes, stored in Redis. Keys
+        include a generation number which is increased on each invalidation,
+        so all the cached results are discarded at once, and old entries are
+        removed by Redis when their TTL expires. Redis must be configured
+        with a maxmemory policy to bound its size.
+    '''
+
+    GENERATION_KEY = 'search:generation'
+
+    def __init__(self, url, ttl):
+        super(RedisQueryCache, self).__init__()
+        import redis    # only import if used
+        self.redis_exception = redis.exceptions.ConnectionError
+        if url:
+            self.redis_connection = redis.StrictRedis.from_url(url)
+        else:
+            self.redis_connection = redis.StrictRedis()
+        self.ttl = ttl
+
+    def _key(self, key):
+        generation = self.redis_connection.get(self.GENERATION_KEY) or 0
+        return 'search:%s:%s:%s' % (config.get('ckan.site_id'),
+                                    generation, key)
+
+    def _get(self, key):
+        try:
+            return self.redis_connection.get(self._key(key))
+        except self.redis_exception:
+            return None
+
+    def _set(self, key, value):
+        try:
+            self.redis_connection.setex(self._key(key), self.ttl, value)
+        except self.redis_exception:
+            pass
+
+    def _clear(self):
+        try:
+            self.redis_connection.incr(self.GENERATION_KEY)
+        except self.redis_exception, e:
+            log.error('Could not invalidate the search cache: %r' % e)
+
+
+_query_cache = None
+
+
+def get_query_cache():
+    '''
+        Returns the query cache configured with search.cache.backend
+        ("memory" or "redis"). By default the cache is disabled.
+    '''
+    global _query_cache
+    if _query_cache is None:
+        backend = config.get('search.cache.backend', 'none')
+        ttl = int(config.get('search.cache.ttl', 60))
+        if backend == 'memory':
+            size = int(config.get('search.cache.size', 1000))
+            _query_cache = MemoryQueryCache(size, ttl)
+        elif backend == 'redis':
+            _query_cache = RedisQueryCache(
+                config.get('search.cache.redis_url'), ttl)
+        else:
+            _query_cache = NoopQueryCache()
+    return _query_cache
+
+
+def reset_query_cache():
+    '''Discards the current cache, so the configuration is read again.'''
+    global _query_cache
+    _query_cache = None
+
+
+def query_cache_stats():
+    '''
+        Returns the hits, misses and invalidations of the search query cache
+        in this process.
+    '''
+    return get_query_cache().stats()
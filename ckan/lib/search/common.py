@@ -1,3 +1,9 @@
+import os
+import time
+import socket
+import httplib
+import threading
+
 from pylons import config
 import logging
 log = logging.getLogger(__name__)
@@ -32,6 +38,8 @@ class SolrSettings(object):
         else:
             cls._url = DEFAULT_SOLR_URL
         cls._is_initialised = True
+        # Connections to a previous server are no longer valid
+        connection_pool.clear()
 
     @classmethod
     def get(cls):
@@ -59,12 +67,150 @@ def is_available():
     return True
 
 
-def make_connection():
+class SolrConnectionPool(object):
+    """
+    Keeps the connections to the Solr server open between requests, so
+    each query or index update does not need to open a new one.
+
+    Connections are kept per process (they can't be shared after a fork)
+    and up to solr_pool_size idle connections are kept. The counters
+    returned by stats() can be used for monitoring.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+        self._stats = dict.fromkeys(
+            ['hits', 'misses', 'discarded', 'retries', 'errors'], 0)
+
+    @property
+    def size(self):
+        return int(config.get('solr_pool_size', 5))
+
+    def _count(self, counter):
+        # must be called with the lock held
+        self._stats[counter] += 1
+
+    def record(self, counter):
+        with self._lock:
+            self._count(counter)
+
+    def _check_pid(self):
+        # Connections inherited from a parent process must not be used
+        if self._pid != os.getpid():
+            self._idle = []
+            self._pid = os.getpid()
+
+    def get(self):
+        with self._lock:
+            self._check_pid()
+            if self._idle:
+                self._count('hits')
+                return self._idle.pop()
+            self._count('misses')
+        return _new_connection()
+
+    def release(self, conn, broken=False):
+        with self._lock:
+            self._check_pid()
+            if not broken and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self._count('discarded')
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        return stats
+
+connection_pool = SolrConnectionPool()
+
+
+class PooledSolrConnection(object):
+    """
+    A Solr connection taken from the connection pool. It behaves as a
+    solr.SolrConnection, but close() returns the connection to the pool.
+    Requests failing because of network errors are retried up to
+    solr_max_retries times, waiting solr_retry_backoff seconds (doubled
+    on each attempt) between them.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = pool.get()
+        self._broken = False
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if not callable(attr):
+            return attr
+
+        def call_with_retries(*args, **kwargs):
+            max_retries = int(config.get('solr_max_retries', 2))
+            backoff = float(config.get('solr_retry_backoff', 0.1))
+            attempt = 0
+            while True:
+                try:
+                    return getattr(self._conn, name)(*args, **kwargs)
+                except (socket.error, httplib.HTTPException), e:
+                    self._pool.record('errors')
+                    if attempt >= max_retries:
+                        self._broken = True
+                        raise
+                    log.warn('Error connecting to SOLR (%r), retrying', e)
+                    self._pool.record('retries')
+                    time.sleep(backoff * 2 ** attempt)
+                    attempt += 1
+                    # Start again with a new connection
+                    self._conn.close()
+                    self._conn = _new_connection()
+        return call_with_retries
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn, broken=self._broken)
+            self._conn = None
+
+
+def _new_connection():
     from solr import SolrConnection
     solr_url, solr_user, solr_password = SolrSettings.get()
     assert solr_url is not None
+    kwargs = {}
+    timeout = config.get('solr_timeout')
+    if timeout:
+        kwargs['timeout'] = float(timeout)
     if solr_user is not None and solr_password is not None:
-        return SolrConnection(solr_url, http_user=solr_user,
-                              http_pass=solr_password)
-    else:
-        return SolrConnection(solr_url)
+        kwargs['http_user'] = solr_user
+        kwargs['http_pass'] = solr_password
+    return SolrConnection(solr_url, **kwargs)
+
+
+def make_connection():
+    """
+    Return a connection to the Solr server, taken from the connection pool.
+    Callers must call its close() method once done with it, so it can be
+    reused.
+    """
+    return PooledSolrConnection(connection_pool)
+
+
+def connection_pool_stats():
+    """
+    Return the counters of the Solr connection pool of this process: pool
+    hits and misses, connections discarded, requests retried, network
+    errors and idle connections.
+    """
+    return connection_pool.stats()
@@ -9,6 +9,7 @@ import re
 from pylons import config
 
 from common import SearchIndexError, make_connection
+from cache import get_query_cache
 from ckan.model import PackageRelationship
 import ckan.model as model
 from ckan.plugins import (PluginImplementations,
@@ -44,6 +45,7 @@ def clear_index():
     try:
         conn.delete_query(query)
         conn.commit()
+        get_query_cache().invalidate()
     except socket.error, e:
         err = 'Could not connect to SOLR %r: %r' % (conn.url, e)
         log.error(err)
@@ -88,6 +90,49 @@ class SearchIndex(object):
 
 class NoopSearchIndex(SearchIndex): pass
 
+
+class IndexingContext(object):
+    """
+    Data looked up in the database while building the SOLR documents of a
+    batch of packages, fetched once for the whole batch: the names of all
+    vocabularies, and the names of the packages related to the packages of
+    the batch.
+    """
+
+    def __init__(self, pkg_dicts):
+        # loaded on first use, as most packages have no vocabulary tags
+        self.vocabulary_names = None
+
+        related_ids = set()
+        for pkg_dict in pkg_dicts:
+            if not pkg_dict:
+                continue
+            for rel in pkg_dict.get('relationships_as_subject', []):
+                related_ids.add(rel['object_package_id'])
+            for rel in pkg_dict.get('relationships_as_object', []):
+                related_ids.add(rel['subject_package_id'])
+        self.package_names = {}
+        if related_ids:
+            self.package_names = dict(
+                model.Session.query(model.Package.id, model.Package.name).
+                filter(model.Package.id.in_(related_ids)))
+
+    def vocabulary_name(self, vocabulary_id):
+        if self.vocabulary_names is None:
+            self.vocabulary_names = dict(model.Session.query(
+                model.Vocabulary.id, model.Vocabulary.name))
+        if vocabulary_id not in self.vocabulary_names:
+            vocab = logic.get_action('vocabulary_show')(
+                {'model': model}, {'id': vocabulary_id})
+            self.vocabulary_names[vocabulary_id] = vocab['name']
+        return self.vocabulary_names[vocabulary_id]
+
+    def package_name(self, package_id):
+        if package_id not in self.package_names:
+            self.package_names[package_id] = model.Package.get(package_id).name
+        return self.package_names[package_id]
+
+
 class PackageSearchIndex(SearchIndex):
     def remove_dict(self, pkg_dict):
         self.delete_package(pkg_dict)
@@ -95,9 +140,62 @@ class PackageSearchIndex(SearchIndex):
     def update_dict(self, pkg_dict):
         self.index_package(pkg_dict)
 
-    def index_package(self, pkg_dict):
-        if pkg_dict is None:
+    def index_package(self, pkg_dict, defer_commit=False):
+        self.index_packages([pkg_dict], defer_commit=defer_commit)
+
+    def index_packages(self, pkg_dicts, defer_commit=False):
+        """
+        Index a list of package dicts, sending them to SOLR in a single
+        request. If defer_commit is True, no commit is issued, and the caller
+        is responsible for calling commit() once all documents are sent.
+        """
+        indexing_context = IndexingContext(pkg_dicts)
+        docs = []
+        for pkg_dict in pkg_dicts:
+            if pkg_dict is None:
+                continue
+            doc = self._package_document(pkg_dict, indexing_context)
+            if doc is None:
+                # Not active, make sure it is not in the index
+                self.delete_package(pkg_dict, defer_commit=defer_commit)
+                continue
+            docs.append(doc)
+
+        if not docs:
             return
+
+        # send to solr:
+        conn = make_connection()
+        try:
+            conn.add_many(docs)
+            if not defer_commit:
+                conn.commit(wait_flush=False, wait_searcher=False)
+                get_query_cache().invalidate()
+        except Exception, e:
+            log.exception(e)
+            raise SearchIndexError(e)
+        finally:
+            conn.close()
+
+        for doc in docs:
+            log.debug("Updated index for %s" % doc.get('name'))
+
+    def commit(self):
+        conn = make_connection()
+        try:
+            conn.commit(wait_flush=False, wait_searcher=False)
+            get_query_cache().invalidate()
+        except Exception, e:
+            log.exception(e)
+            raise SearchIndexError(e)
+        finally:
+            conn.close()
+
+    def _package_document(self, pkg_dict, indexing_context):
+        """
+        Build the SOLR document for a package dict, or return None if the
+        package should not be indexed.
+        """
         pkg_dict['data_dict'] = json.dumps(pkg_dict)
 
         # add to string field for sorting
@@ -106,7 +204,7 @@ class PackageSearchIndex(SearchIndex):
             pkg_dict['title_string'] = title
 
         if (not pkg_dict.get('state')) or ('active' not in pkg_dict.get('state')):
-            return self.delete_package(pkg_dict)
+            return None
 
         index_fields = RESERVED_FIELDS + pkg_dict.keys()
 
@@ -126,13 +224,12 @@ class PackageSearchIndex(SearchIndex):
         # vocab_<tag name> so that they can be used in facets
         non_vocab_tag_names = []
         tags = pkg_dict.pop('tags', [])
-        context = {'model': model}
 
         for tag in tags:
             if tag.get('vocabulary_id'):
-                data = {'id': tag['vocabulary_id']}
-                vocab = logic.get_action('vocabulary_show')(context, data)
-                key = u'vocab_%s' % vocab['name']
+                vocab_name = indexing_context.vocabulary_name(
+                    tag['vocabulary_id'])
+                key = u'vocab_%s' % vocab_name
                 if key in pkg_dict:
                     pkg_dict[key].append(tag['name'])
                 else:
@@ -174,10 +271,12 @@ class PackageSearchIndex(SearchIndex):
         objects = pkg_dict.pop("relationships_as_object", [])
         for rel in objects:
             type = model.PackageRelationship.forward_to_reverse_type(rel['type'])
-            rel_dict[type].append(model.Package.get(rel['subject_package_id']).name)
+            rel_dict[type].append(
+                indexing_context.package_name(rel['subject_package_id']))
         for rel in subjects:
             type = rel['type']
-            rel_dict[type].append(model.Package.get(rel['object_package_id']).name)
+            rel_dict[type].append(
+                indexing_context.package_name(rel['object_package_id']))
         for key, value in rel_dict.iteritems():
             if key not in pkg_dict:
                 pkg_dict[key] = value
@@ -219,27 +318,18 @@ class PackageSearchIndex(SearchIndex):
 
         assert pkg_dict, 'Plugin must return non empty package dict on index'
 
-        # send to solr:
-        try:
-            conn = make_connection()
-            conn.add_many([pkg_dict])
-            conn.commit(wait_flush=False, wait_searcher=False)
-        except Exception, e:
-            log.exception(e)
-            raise SearchIndexError(e)
-        finally:
-            conn.close()
-
-        log.debug("Updated index for %s" % pkg_dict.get('name'))
+        return pkg_dict
 
-    def delete_package(self, pkg_dict):
+    def delete_package(self, pkg_dict, defer_commit=False):
         conn = make_connection()
         query = "+%s:%s (+id:\"%s\" OR +name:\"%s\") +site_id:\"%s\"" % (TYPE_FIELD, PACKAGE_TYPE,
                                                        pkg_dict.get('id'), pkg_dict.get('id'),
                                                        config.get('ckan.site_id'))
         try:
             conn.delete_query(query)
-            conn.commit()
+            if not defer_commit:
+                conn.commit()
+                get_query_cache().invalidate()
         except Exception, e:
             log.exception(e)
             raise SearchIndexError(e)
@@ -5,6 +5,7 @@ from ckan import model
 from ckan.logic import get_action
 from ckan.lib.helpers import json
 from common import make_connection, SearchError, SearchQueryError
+from cache import get_query_cache, make_key
 import logging
 log = logging.getLogger(__name__)
 
@@ -13,7 +14,8 @@ _open_licenses = None
 VALID_SOLR_PARAMETERS = set([
     'q', 'fl', 'fq', 'rows', 'sort', 'start', 'wt', 'qf',
     'facet', 'facet.mincount', 'facet.limit', 'facet.field',
-    'extras' # Not used by Solr, but useful for extensions
+    'extras', # Not used by Solr, but useful for extensions
+    'cursor' # Not used by Solr, see PackageSearchQuery.run
 ])
 
 # for (solr) package searches, this specifies the fields that are searched
@@ -257,6 +259,15 @@ class PackageSearchQuery(SearchQuery):
         '''
         Performs a dataset search using the given query.
 
+        If the query has a 'cursor' key, results are sorted by dataset id and
+        only datasets with an id greater than the cursor are returned (use an
+        empty cursor for the first page). The returned dictionary then also
+        has a 'next_cursor' key, to be used as the cursor of the following
+        query, which is None once all the results have been returned, and
+        'count' is the number of results after the cursor. Unlike
+        paging with 'start', the cost of each query does not grow with the
+        number of results already seen.
+
         @param query - dictionary with keys like: q, fq, sort, rows, facet
         @return - dictionary with keys results and count
 
@@ -289,8 +300,18 @@ class PackageSearchQuery(SearchQuery):
         if order_by == 'rank' or order_by is None:
             query['sort'] = 'score desc, name asc'
 
-        # show only results from this CKAN instance
         fq = query.get('fq', '')
+
+        # cursor based paging, sorting on the dataset id
+        use_cursor = 'cursor' in query
+        if use_cursor:
+            cursor = query.pop('cursor')
+            query['sort'] = 'id asc'
+            query['start'] = 0
+            if cursor:
+                fq += ' +id:{"%s" TO *}' % cursor.replace('"', '')
+
+        # show only results from this CKAN instance
         if not '+site_id:' in fq:
             fq += ' +site_id:"%s"' % config.get('ckan.site_id')
 
@@ -306,6 +327,10 @@ class PackageSearchQuery(SearchQuery):
 
         # return the package ID and search scores
         query['fl'] = query.get('fl', 'name')
+        fl = query['fl']
+        if use_cursor and fl != '*' and 'id' not in fl.replace(',', ' ').split():
+            # the id of the last result is needed for the next cursor
+            query['fl'] = fl + ' id'
 
         # return results as json encoded string
         query['wt'] = query.get('wt', 'json')
@@ -317,6 +342,18 @@ class PackageSearchQuery(SearchQuery):
             query['mm'] = '1'
             query['qf'] = query.get('qf', QUERY_FIELDS)
 
+        # results of identical queries are served from the query cache,
+        # if enabled
+        query_cache = get_query_cache()
+        cache_key = make_key(query)
+        cached = query_cache.get(cache_key)
+        if cached is not None:
+            self.count = cached['count']
+            self.results = cached['results']
+            self.facets = cached['facets']
+            self.next_cursor = cached['next_cursor']
+            return self._result_dict(use_cursor)
+
         conn = make_connection()
         log.debug('Package query: %r' % query)
         try:
@@ -333,6 +370,11 @@ class PackageSearchQuery(SearchQuery):
             # #1683 Filter out the last row that is sometimes out of order
             self.results = self.results[:rows_to_return]
 
+            self.next_cursor = None
+            if use_cursor and self.results and \
+                    len(self.results) == rows_to_return:
+                self.next_cursor = self.results[-1]['id']
+
             # get any extras and add to 'extras' dict
             for result in self.results:
                 extra_keys = filter(lambda x: x.startswith('extras_'), result.keys())
@@ -344,8 +386,8 @@ class PackageSearchQuery(SearchQuery):
                     result['extras'] = extras
 
             # if just fetching the id or name, return a list instead of a dict
-            if query.get('fl') in ['id', 'name']:
-                self.results = [r.get(query.get('fl')) for r in self.results]
+            if fl in ['id', 'name']:
+                self.results = [r.get(fl) for r in self.results]
 
             # get facets and convert facets list to a dict
             self.facets = data.get('facet_counts', {}).get('facet_fields', {})
@@ -357,4 +399,14 @@ class PackageSearchQuery(SearchQuery):
         finally:
             conn.close()
 
-        return {'results': self.results, 'count': self.count}
+        query_cache.set(cache_key, {'results': self.results,
+                                    'count': self.count,
+                                    'facets': self.facets,
+                                    'next_cursor': self.next_cursor})
+        return self._result_dict(use_cursor)
+
+    def _result_dict(self, use_cursor):
+        result = {'results': self.results, 'count': self.count}
+        if use_cursor:
+            result['next_cursor'] = self.next_cursor
+        return result
@@ -1,40 +1,318 @@
-from sqlalchemy import or_, and_
-from ckan.lib.search.query import SearchQuery
+import re
+import logging
+
+from paste.util.multidict import MultiDict
+from sqlalchemy import or_, and_, not_, func, select, desc, literal_column
+
+from ckan.lib.search.query import SearchQuery, VALID_SOLR_PARAMETERS
+from ckan.lib.search.common import SearchQueryError
 import ckan.model as model
 
+log = logging.getLogger(__name__)
+
+# Weighted text search vector of a package. It must be exactly the same
+# expression used to create the package_search_vector_idx index (see
+# migration 060), otherwise PostgreSQL will not use the index.
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(notes, '')), 'C')")
+
+# Matches the field:value and field:"some value" terms of a Solr query
+FIELD_TERM = re.compile(r'([+-]?)([\w.-]+):(?:"([^"]*)"|(\S+))')
+
+# Fields handled by the search index itself, not by the query
+IGNORED_FIELDS = ['site_id', 'state', 'entity_type']
+
+PACKAGE_FIELDS = ['id', 'name', 'title', 'version', 'url', 'author',
+                  'author_email', 'maintainer', 'maintainer_email',
+                  'license_id', 'type']
+
+SORT_FIELDS = {
+    'name': model.package_table.c.name,
+    'title': model.package_table.c.title,
+    'title_string': model.package_table.c.title,
+    'id': model.package_table.c.id,
+    'metadata_modified': model.package_table.c.metadata_modified,
+    'metadata_created': model.package_table.c.metadata_created,
+}
+
+
+def _parse_query(string):
+    '''
+    Splits a Solr query into a list of (negated, field, value) filters and
+    the remaining free text.
+    '''
+    filters = []
+    for match in FIELD_TERM.finditer(string):
+        negated, field, quoted, value = match.groups()
+        filters.append((negated == '-', field,
+                        quoted if quoted is not None else value))
+    text = FIELD_TERM.sub(' ', string.replace('*:*', ' '))
+    return filters, ' '.join(text.split())
+
+
+def _package_ids_with_tag(name, vocabulary=None):
+    package_tag = model.package_tag_table.c
+    tag = model.tag_table.c
+    where = [package_tag.tag_id == tag.id,
+             package_tag.state == u'active',
+             tag.name == name]
+    if vocabulary:
+        vocab = model.Vocabulary.by_name(vocabulary)
+        where.append(tag.vocabulary_id == (vocab.id if vocab else None))
+    else:
+        where.append(tag.vocabulary_id == None)
+    return select([package_tag.package_id], and_(*where))
+
+
+def _package_ids_in_group(name):
+    member = model.group.member_table.c
+    group = model.group_table.c
+    return select([member.table_id], and_(
+        member.group_id == group.id,
+        member.table_name == u'package',
+        member.state == u'active',
+        group.state == u'active',
+        group.name == name))
+
+
+def _private_package_ids():
+    member = model.group.member_table.c
+    return select([member.table_id], and_(
+        member.table_name == u'package',
+        member.state == u'active',
+        member.capacity == u'private'))
+
+
+def _package_ids_with_format(format):
+    resource = model.resource_table.c
+    resource_group = model.resource_group_table.c
+    return select([resource_group.package_id], and_(
+        resource.resource_group_id == resource_group.id,
+        resource.state == u'active',
+        resource.format == format))
+
+
+def _package_ids_with_extra(key, value):
+    extra = model.package_extra_table.c
+    # the value is JSON encoded by the column type, as stored
+    return select([extra.package_id], and_(
+        extra.key == key,
+        extra.state == u'active',
+        extra.value == value))
+
+
+def _filter_condition(field, value):
+    package = model.package_table.c
+    if field == 'capacity':
+        private = package.id.in_(_private_package_ids())
+        return not_(private) if value == 'public' else private
+    if field == 'tags':
+        return package.id.in_(_package_ids_with_tag(value))
+    if field.startswith('vocab_'):
+        return package.id.in_(_package_ids_with_tag(value, field[6:]))
+    if field == 'groups':
+        return package.id.in_(_package_ids_in_group(value))
+    if field == 'res_format':
+        return package.id.in_(_package_ids_with_format(value))
+    if field == 'license':
+        field = 'license_id'
+    if field in PACKAGE_FIELDS:
+        return getattr(package, field) == value
+    # any other field is an extra, as in the Solr index
+    return package.id.in_(_package_ids_with_extra(field, value))
+
+
+def _text_condition(text):
+    '''Full text search on the package search vector and the tags.'''
+    package = model.package_table.c
+    if model.engine_is_sqlite():
+        # no full text search in sqlite, match each term in the text fields
+        conditions = []
+        for term in text.split():
+            conditions.append(or_(*[column.ilike(u'%' + term + u'%')
+                for column in (package.name, package.title, package.notes)]))
+        return and_(*conditions)
+    ts_query = func.plainto_tsquery('english', text)
+    package_tag = model.package_tag_table.c
+    tag = model.tag_table.c
+    tagged = select([package_tag.package_id], and_(
+        package_tag.tag_id == tag.id,
+        package_tag.state == u'active',
+        func.to_tsvector('english', tag.name).op('@@')(ts_query)))
+    return or_(literal_column(SEARCH_VECTOR).op('@@')(ts_query),
+               package.id.in_(tagged))
+
+
+def _facet_query(field, package_ids):
+    '''
+    Returns a query of (value, count) rows for a facet field, for the
+    given query of package ids, or None if the field is not supported.
+    '''
+    count = func.count(literal_column('*'))
+    if field == 'tags' or field.startswith('vocab_'):
+        package_tag = model.package_tag_table.c
+        tag = model.tag_table.c
+        where = [package_tag.tag_id == tag.id,
+                 package_tag.state == u'active',
+                 package_tag.package_id.in_(package_ids)]
+        if field == 'tags':
+            where.append(tag.vocabulary_id == None)
+        else:
+            vocab = model.Vocabulary.by_name(field[6:])
+            where.append(tag.vocabulary_id == (vocab.id if vocab else None))
+        return select([tag.name, count], and_(*where)).group_by(tag.name)
+    if field == 'groups':
+        member = model.group.member_table.c
+        group = model.group_table.c
+        return select([group.name, count], and_(
+            member.group_id == group.id,
+            member.table_name == u'package',
+            member.state == u'active',
+            group.state == u'active',
+            member.table_id.in_(package_ids))).group_by(group.name)
+    if field == 'res_format':
+        resource = model.resource_table.c
+        resource_group = model.resource_group_table.c
+        return select([resource.format, count], and_(
+            resource.resource_group_id == resource_group.id,
+            resource.state == u'active',
+            resource.format != u'',
+            resource_group.package_id.in_(package_ids))
+            ).group_by(resource.format)
+    if field in ('license', 'license_id'):
+        package = model.package_table.c
+        return select([package.license_id, count], and_(
+            package.license_id != None,
+            package.id.in_(package_ids))).group_by(package.license_id)
+    return None
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
 class PackageSearchQuery(SearchQuery):
+    '''
+    Dataset search using the database, for sites not using Solr
+    (ckan.simple_search). Free text is matched against a weighted
+    tsvector of the name, title and notes of the datasets (indexed with a
+    GIN index) and their tags, and results are ranked by relevance.
+    Filters, sorting on the main dataset fields, paging and facet counts
+    on tags, groups, resource formats and licenses are supported.
+    '''
+
     def get_all_entity_ids(self, max_results=100):
         """
         Return a list of the IDs of all indexed packages.
         """
-        # could make this a pure sql query which would be much more efficient!
-        q = model.Session.query(model.Package).filter_by(state='active').limit(max_results)
-
-        return [r.id for r in q]
+        q = model.Session.query(model.Package.id).filter_by(state='active')
+        return [r[0] for r in q.limit(max_results)]
 
     def run(self, query):
-        assert isinstance(query, dict)
-        # no support for faceting atm
+        assert isinstance(query, (dict, MultiDict))
+        if not set(query.keys()) <= VALID_SOLR_PARAMETERS:
+            invalid_params = [s for s in set(query.keys()) - VALID_SOLR_PARAMETERS]
+            raise SearchQueryError("Invalid search parameters: %s" % invalid_params)
+
+        package = model.package_table.c
+        filters, text = _parse_query(query.get('q') or '')
+        fq_filters, fq_text = _parse_query(query.get('fq') or '')
+        filters.extend(fq_filters)
+        text = ' '.join([text, fq_text]).strip()
+        if text in ('""', "''"):
+            text = ''
+
+        conditions = [package.state == u'active']
+        for negated, field, value in filters:
+            if field in IGNORED_FIELDS:
+                continue
+            condition = _filter_condition(field, value)
+            conditions.append(not_(condition) if negated else condition)
+        if text:
+            conditions.append(_text_condition(text))
+
+        # cursor based paging, sorting on the dataset id
+        use_cursor = 'cursor' in query
+        cursor = query.get('cursor')
+        if cursor:
+            conditions.append(package.id > cursor)
+        where = and_(*conditions)
+
+        self.count = model.Session.execute(
+            select([func.count(package.id)], where)).scalar()
+
+        # sorting
+        order_by = []
+        sort = query.get('sort')
+        if use_cursor:
+            sort = 'id asc'
+        elif sort in (None, 'rank'):
+            sort = 'score desc, name asc'
+        for sort_field in sort.split(','):
+            try:
+                field, direction = sort_field.split()
+            except ValueError:
+                raise SearchQueryError('Invalid sort order: %r' % sort_field)
+            if field == 'score':
+                if not text or model.engine_is_sqlite():
+                    continue
+                column = func.ts_rank_cd(literal_column(SEARCH_VECTOR),
+                                         func.plainto_tsquery('english', text))
+            elif field in SORT_FIELDS:
+                column = SORT_FIELDS[field]
+            else:
+                raise SearchQueryError('Sorting on %s is not supported' % field)
+            order_by.append(desc(column) if direction == 'desc' else column)
+
+        # paging
+        rows = min(1000, int(query.get('rows', 10)))
+        start = 0 if use_cursor else int(query.get('start', 0))
+
+        page = select([package.id, package.name], where, order_by=order_by,
+                      offset=start, limit=rows)
+        rows_found = model.Session.execute(page).fetchall()
+
+        self.next_cursor = None
+        if use_cursor and rows_found and len(rows_found) == rows:
+            self.next_cursor = rows_found[-1][0]
+
+        fl = query.get('fl', 'id')
+        if fl in ('id', 'name'):
+            self.results = [row[fl == 'name' and 1 or 0] for row in rows_found]
+        else:
+            self.results = [{'id': row[0], 'name': row[1]}
+                            for row in rows_found]
+
+        # facets
         self.facets = {}
-        limit = min(1000, int(query.get('rows', 10)))
-        
-        q = query.get('q')
-        ourq = model.Session.query(model.Package.id).filter_by(state='active')
-
-        def makelike(field):
-            _attr = getattr(model.Package, field)
-            return _attr.ilike('%' + term + '%')
-        if q and q not in ('""', "''", '*:*'):
-            terms = q.split()
-            # TODO: tags ...?
-            fields = ['name', 'title', 'notes']
-            for term in terms:
-                args = [makelike(field) for field in fields]
-                subq = or_(*args)
-                ourq = ourq.filter(subq)
-        self.count = ourq.count()
-        ourq = ourq.limit(limit)
-        self.results = [r[0] for r in ourq.all()]
-
-        return {'results': self.results, 'count': self.count}
+        if str(query.get('facet', 'true')).lower() == 'true':
+            facet_limit = int(query.get('facet.limit', 50))
+            facet_mincount = int(query.get('facet.mincount', 1))
+            if hasattr(query, 'getall'):
+                facet_fields = query.getall('facet.field')
+            else:
+                facet_fields = _as_list(query.get('facet.field', []))
+            package_ids = select([package.id], where)
+            for field in facet_fields:
+                facet_query = _facet_query(field, package_ids)
+                if facet_query is None:
+                    log.debug('Facet not supported by the SQL search: %s',
+                              field)
+                    self.facets[field] = {}
+                    continue
+                count = func.count(literal_column('*'))
+                facet_query = facet_query.having(count >= facet_mincount).\
+                    order_by(desc(count))
+                if facet_limit >= 0:
+                    facet_query = facet_query.limit(facet_limit)
+                self.facets[field] = dict(
+                    model.Session.execute(facet_query).fetchall())
 
+        result = {'results': self.results, 'count': self.count}
+        if use_cursor:
+            result['next_cursor'] = self.next_cursor
+        return result
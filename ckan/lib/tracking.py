@@ -0,0 +1,249 @@
+'''
+Buffered storage of the page view and resource download events recorded by
+TrackingMiddleware.
+
+Events are kept in a bounded in-process buffer and written to the
+tracking_raw table in multi-row inserts by a background thread, every
+ckan.tracking.flush_size events or ckan.tracking.flush_interval seconds,
+so recording an event doesn't need a database write in the request.
+
+If the database can't be written to, or the buffer is full because it is
+too slow, events are appended to a spool file in ckan.tracking.spool_dir
+(if set), which is loaded into the database once it is available again.
+Otherwise they are dropped. The counts of buffered, written, spooled and
+dropped events can be obtained with tracking_stats().
+'''
+import os
+import glob
+import json
+import atexit
+import logging
+import datetime
+import threading
+
+import sqlalchemy as sa
+from pylons import config
+
+log = logging.getLogger(__name__)
+
+SPOOL_PATTERN = 'tracking-*.spool'
+
+# Rows per INSERT statement: each row has 4 bind parameters, and SQLite
+# allows at most 999 in a statement by default
+INSERT_ROWS = 999 // 4
+
+
+def _parse_timestamp(timestamp):
+    if '.' in timestamp:
+        return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f')
+    return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
+
+
+class TrackingBuffer(object):
+    '''
+        Buffers tracking events (user key, url, tracking type and time) and
+        writes them to the tracking_raw table in batches.
+    '''
+
+    def __init__(self, engine, size, flush_size, flush_interval,
+                 spool_dir=None):
+        self.engine = engine
+        self.size = size
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.spool_dir = spool_dir
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stats = dict.fromkeys(
+            ['events', 'written', 'spooled', 'dropped', 'flush_errors'], 0)
+
+    def add(self, user_key, url, tracking_type):
+        event = (user_key, url, tracking_type, datetime.datetime.now())
+        with self._lock:
+            self._stats['events'] += 1
+            if len(self._events) < self.size:
+                self._events.append(event)
+                full = len(self._events) >= self.flush_size
+                event = None
+        if event is not None:
+            # the database can't keep up
+            self._spool([event])
+        elif full:
+            self._wakeup.set()
+        self._start()
+
+    def _start(self):
+        '''Starts the flushing thread, again in processes forked after it
+        was started, as threads don't survive the fork. Without a flush
+        interval, events are only written when flush is called.'''
+        if self._pid == os.getpid() or not self.flush_interval:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run,
+                                            name='tracking-flush')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception, e:
+                log.exception(e)
+
+    def flush(self):
+        '''
+            Writes the buffered events to the database, flush_size events at
+            a time, and then any spooled events. Returns the number of
+            events written.
+        '''
+        with self._flush_lock:
+            written = 0
+            while True:
+                with self._lock:
+                    events = self._events[:self.flush_size]
+                    del self._events[:self.flush_size]
+                if not events:
+                    break
+                if not self._write(events):
+                    self._spool(events)
+                    return written
+                written += len(events)
+            return written + self._load_spool()
+
+    def _write(self, events):
+        '''Inserts the events in one transaction, INSERT_ROWS rows per
+        statement. Returns whether they were written.'''
+        try:
+            conn = self.engine.connect()
+            try:
+                trans = conn.begin()
+                try:
+                    for i in range(0, len(events), INSERT_ROWS):
+                        self._insert(conn, events[i:i + INSERT_ROWS])
+                    trans.commit()
+                except:
+                    trans.rollback()
+                    raise
+            finally:
+                conn.close()
+        except sa.exc.SQLAlchemyError, e:
+            log.error('Could not write %i tracking events: %r',
+                      len(events), e)
+            with self._lock:
+                self._stats['flush_errors'] += 1
+            return False
+        with self._lock:
+            self._stats['written'] += len(events)
+        return True
+
+    def _insert(self, conn, events):
+        params = {}
+        rows = []
+        for i, (user_key, url, tracking_type, timestamp) in \
+                enumerate(events):
+            rows.append('(:k%i, :u%i, :t%i, :a%i)' % (i, i, i, i))
+            params.update({'k%i' % i: user_key, 'u%i' % i: url,
+                           't%i' % i: tracking_type, 'a%i' % i: timestamp})
+        sql = '''INSERT INTO tracking_raw
+                 (user_key, url, tracking_type, access_timestamp)
+                 VALUES %s''' % ', '.join(rows)
+        conn.execute(sa.text(sql), **params)
+
+    def _spool(self, events):
+        if not self.spool_dir:
+            with self._lock:
+                self._stats['dropped'] += len(events)
+            return
+        path = os.path.join(self.spool_dir, 'tracking-%s.spool' % os.getpid())
+        lines = [json.dumps([user_key, url, tracking_type,
+                             timestamp.isoformat()]) + '\n'
+                 for user_key, url, tracking_type, timestamp in events]
+        with self._lock:
+            try:
+                with open(path, 'a') as f:
+                    f.writelines(lines)
+            except IOError, e:
+                log.error('Could not spool %i tracking events: %r',
+                          len(events), e)
+                self._stats['dropped'] += len(events)
+                return
+            self._stats['spooled'] += len(events)
+
+    def _load_spool(self):
+        '''Writes the events spooled by any process to the database.'''
+        if not self.spool_dir:
+            return 0
+        written = 0
+        for path in glob.glob(os.path.join(self.spool_dir, SPOOL_PATTERN)):
+            # take the file, so no other process loads it at the same time
+            # and this process spools new events to a new file
+            loading = '%s.loading-%s' % (path, os.getpid())
+            try:
+                os.rename(path, loading)
+            except OSError:
+                continue
+            with open(loading) as f:
+                events = []
+                for line in f:
+                    user_key, url, tracking_type, timestamp = json.loads(line)
+                    events.append((user_key, url, tracking_type,
+                                   _parse_timestamp(timestamp)))
+            os.remove(loading)
+            for i in range(0, len(events), self.flush_size):
+                chunk = events[i:i + self.flush_size]
+                if not self._write(chunk):
+                    self._spool(events[i:])
+                    return written
+                written += len(chunk)
+        return written
+
+    def stats(self):
+        '''
+            Returns the number of events recorded, written to the
+            database, spooled and dropped, the failed writes and the number
+            of events currently in the buffer.
+        '''
+        with self._lock:
+            stats = dict(self._stats)
+            stats['buffered'] = len(self._events)
+        return stats
+
+
+_tracking_buffer = None
+
+
+def get_tracking_buffer():
+    '''
+        Returns the tracking buffer of this process, configured with the
+        ckan.tracking.* options.
+    '''
+    global _tracking_buffer
+    if _tracking_buffer is None:
+        _tracking_buffer = TrackingBuffer(
+            sa.create_engine(config.get('sqlalchemy.url')),
+            int(config.get('ckan.tracking.buffer_size', 10000)),
+            int(config.get('ckan.tracking.flush_size', 500)),
+            float(config.get('ckan.tracking.flush_interval', 5)),
+            config.get('ckan.tracking.spool_dir'))
+        atexit.register(_tracking_buffer.flush)
+    return _tracking_buffer
+
+
+def tracking_stats():
+    '''
+        Returns the counts of tracking events of this process, see
+        TrackingBuffer.stats.
+    '''
+    if _tracking_buffer is None:
+        return {}
+    return _tracking_buffer.stats()
@@ -296,3 +296,21 @@ def side_effect_free(action):
     wrapper.side_effect_free = True
 
     return wrapper
+
+
+def cache_key(key_function):
+    '''A decorator that gives the given action a cache key, so conditional
+    GET requests for its results can be answered without running it.
+
+    key_function(context, data_dict) returns a tuple (etag, last_modified),
+    where etag is a string that changes whenever the result of the action
+    does and last_modified is the datetime it last changed (or None), or it
+    returns None if there's no cheap way to tell. It may raise NotFound or
+    NotAuthorized, which are then reported by the action itself.
+    '''
+
+    def decorator(action):
+        action.cache_key = key_function
+        return action
+
+    return decorator
@@ -15,6 +15,7 @@ import ckan.logic.auth as auth
 
 # FIXME this looks nasty and should be shared better
 from ckan.logic.action.update import _update_package_relationship
+from ckan.logic.action.update import _package_save_many
 
 log = logging.getLogger(__name__)
 
@@ -161,6 +162,28 @@ def package_create(context, data_dict):
     log.debug('Created object %s' % str(pkg.name))
     return _get_action('package_show')(context, {'id':context['id']})
 
+def package_create_many(context, data_dict):
+    '''Create many datasets at once.
+
+    The datasets are validated one by one, and those that are valid are
+    created together under a single revision and then sent to the search
+    index in one batch. Tags and groups are only looked up once for the
+    whole batch. This is much faster than calling ``package_create()`` for
+    each of them, e.g. when harvesting.
+
+    :param data: the datasets to create, each one with the parameters of
+        ``package_create()``
+    :type data: list of dictionaries
+
+    :returns: a result for each dataset, in the same order, with key
+        ``'success'`` and either key ``'result'`` (a dictionary with the
+        ``'id'`` and ``'name'`` of the new dataset) or key ``'error'`` (a
+        dictionary describing the error, like the errors of the action API)
+    :rtype: list of dictionaries
+
+    '''
+    return _package_save_many(context, data_dict, 'create')
+
 def package_create_validate(context, data_dict):
     model = context['model']
     schema = lib_plugins.lookup_package_plugin().form_to_db_schema()
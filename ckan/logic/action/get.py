@@ -4,6 +4,7 @@ import json
 
 from pylons import config
 from pylons.i18n import _
+import paste.deploy.converters
 import webhelpers.html
 import sqlalchemy
 
@@ -19,15 +20,19 @@ import ckan.model.misc as misc
 import ckan.plugins as plugins
 import ckan.lib.search as search
 import ckan.lib.plugins as lib_plugins
+import ckan.lib.package_cache as package_cache
+import ckan.lib.page_cache as page_cache
 
 log = logging.getLogger('ckan.logic')
 
 # Define some shortcuts
 # Ensure they are module-private so that they don't get loaded as available
 # actions in the action API.
+_validate_trusted = ckan.lib.navl.dictization_functions.validate_trusted
 _validate = ckan.lib.navl.dictization_functions.validate
 _table_dictize = ckan.lib.dictization.table_dictize
 _render = ckan.lib.base.render
+_tag_page = page_cache.tag_page
 Authorizer = ckan.authz.Authorizer
 _check_access = logic.check_access
 NotFound = logic.NotFound
@@ -42,14 +47,15 @@ _func = sqlalchemy.func
 _desc = sqlalchemy.desc
 _case = sqlalchemy.case
 _text = sqlalchemy.text
+_asbool = paste.deploy.converters.asbool
+
+# The default and maximum numbers of activities returned by the activity
+# stream actions
+_ACTIVITY_LIST_LIMIT = 15
+_ACTIVITY_LIST_MAX_LIMIT = 100
 
 def _package_list_with_resources(context, package_revision_list):
-    package_list = []
-    model = context["model"]
-    for package in package_revision_list:
-        result_dict = model_dictize.package_dictize(package,context)
-        package_list.append(result_dict)
-    return package_list
+    return model_dictize.package_list_dictize(package_revision_list, context)
 
 def site_read(context,data_dict=None):
     '''Return ``True``.
@@ -71,6 +77,7 @@ def package_list(context, data_dict):
     ref_package_by = 'id' if api == 2 else 'name'
 
     _check_access('package_list', context, data_dict)
+    _tag_page('package')
 
     query = model.Session.query(model.PackageRevision)
     query = query.filter(model.PackageRevision.state=='active')
@@ -107,6 +114,7 @@ def current_package_list_with_resources(context, data_dict):
     page = int(data_dict.get('page', 1))
 
     _check_access('current_package_list_with_resources', context, data_dict)
+    _tag_page('package')
 
     query = model.Session.query(model.PackageRevision)
     query = query.filter(model.PackageRevision.state=='active')
@@ -288,6 +296,7 @@ def group_list(context, data_dict):
     all_fields = data_dict.get('all_fields',None)
 
     _check_access('group_list', context, data_dict)
+    _tag_page('group')
 
     query = model.Session.query(model.Group).join(model.GroupRevision)
     query = query.filter(model.GroupRevision.state=='active')
@@ -296,15 +305,19 @@ def group_list(context, data_dict):
         query = query.filter(model.GroupRevision.name.in_(groups))
 
     if order_by == 'name':
-        sort_by, reverse = 'name', False
+        sort_key = lambda x: x['name']
+    else:
+        # count the datasets and sort the groups in the database
+        counts = model.Group.package_count_select(
+            context.get('include_private_packages', False)).alias('counts')
+        query = query.outerjoin(counts, counts.c.group_id == model.Group.id)
+        query = query.order_by(
+            _desc(_func.coalesce(counts.c.package_count, 0)), model.Group.name)
+        sort_key = None
 
     groups = query.all()
 
-    if order_by == 'packages':
-        sort_by, reverse = 'packages', True
-
-    group_list = model_dictize.group_list_dictize(groups, context,
-                                    lambda x:x[sort_by], reverse)
+    group_list = model_dictize.group_list_dictize(groups, context, sort_key)
 
     if not all_fields:
         group_list = [group[ref_group_by] for group in group_list]
@@ -406,6 +419,7 @@ def tag_list(context, data_dict):
     all_fields = data_dict.get('all_fields', None)
 
     _check_access('tag_list', context, data_dict)
+    _tag_page('package')
 
     if query:
         tags, count = _tag_search(context, data_dict)
@@ -439,6 +453,7 @@ def user_list(context, data_dict):
     user = context['user']
 
     _check_access('user_list',context, data_dict)
+    _tag_page('user')
 
     q = data_dict.get('q','')
     order_by = data_dict.get('order_by','name')
@@ -543,6 +558,47 @@ def package_relationships_list(context, data_dict):
 
     return relationship_dicts
 
+def _latest_revision(model, cls, *criteria):
+    '''Returns a scalar select of the time of the latest revision of the
+    objects of the given revisioned class matching the criteria.'''
+    return model.Session.query(_func.max(model.Revision.timestamp))\
+        .filter(cls.revision_id == model.Revision.id)\
+        .filter(*criteria).as_scalar()
+
+def _package_show_cache_key(context, data_dict):
+    '''The cache key of package_show (see ckan.logic.cache_key): the
+    dataset's revision and options, and the time of the last change to it,
+    its groups and the tracking totals.'''
+    model = context['model']
+    name_or_id = data_dict.get("id") or _get_or_bust(data_dict, 'name_or_id')
+    pkg = model.Package.get(name_or_id)
+    if pkg is None:
+        raise NotFound
+    context['package'] = pkg
+    _check_access('package_show', context, data_dict)
+
+    variant = package_cache.variant_key(pkg, context)
+    if variant is None:
+        return None
+    group_ids = model.Session.query(model.Member.group_id)\
+        .filter(model.Member.table_id == pkg.id)\
+        .filter(model.Member.table_name == 'package')
+    changes = model.Session.execute(_select([
+        _latest_revision(model, model.Member,
+                         model.Member.table_id == pkg.id,
+                         model.Member.table_name == 'package'),
+        _latest_revision(model, model.Group,
+                         model.Group.id.in_(group_ids.subquery())),
+    ])).fetchone()
+    watermarks = model.tracking_watermark_table.c
+    tracked = model.Session.execute(
+        _select([_func.max(watermarks.access_timestamp)])).scalar()
+    dates = [date for date in [pkg.metadata_modified, tracked] + list(changes)
+             if date is not None]
+    last_modified = max(dates) if dates else None
+    return '%s:%s:%s' % (pkg.id, variant, last_modified), last_modified
+
+@logic.cache_key(_package_show_cache_key)
 def package_show(context, data_dict):
     '''Return the metadata of a dataset (package) and its resources.
 
@@ -564,6 +620,16 @@ def package_show(context, data_dict):
     context['package'] = pkg
 
     _check_access('package_show', context, data_dict)
+    _tag_page('package:%s' % pkg.id)
+
+    cache = package_cache.get_package_cache()
+    cache_key = cache and package_cache.variant_key(pkg, context)
+    if cache_key:
+        package_dict = cache.get(pkg.id, cache_key)
+        if package_dict is not None:
+            for item in plugins.PluginImplementations(plugins.IPackageController):
+                item.read(pkg)
+            return package_dict
 
     package_dict = model_dictize.package_dictize(pkg, context)
 
@@ -580,7 +646,18 @@ def package_show(context, data_dict):
         schema = package_plugin.db_to_form_schema()
 
     if schema and context.get('validate', True):
-        package_dict, errors = _validate(package_dict, schema, context=context)
+        # the dict comes from package_dictize, so it already conforms to the
+        # schema and plugins can choose to run only its output transforms
+        trusted = getattr(package_plugin, 'db_to_form_trusted', None)
+        if trusted and trusted() and not context.get('schema'):
+            package_dict = _validate_trusted(package_dict, schema,
+                                             context=context)
+        else:
+            package_dict, errors = _validate(package_dict, schema,
+                                             context=context)
+
+    if cache_key:
+        cache.set(pkg.id, cache_key, package_dict)
 
     return package_dict
 
@@ -656,6 +733,35 @@ def revision_show(context, data_dict):
                                       ref_package_by=ref_package_by)
     return rev_dict
 
+def _group_show_cache_key(context, data_dict):
+    '''The cache key of group_show (see ckan.logic.cache_key): the time of
+    the last change to the group, its extras, members and datasets.'''
+    model = context['model']
+    group = model.Group.get(_get_or_bust(data_dict, 'id'))
+    if group is None:
+        raise NotFound
+    context['group'] = group
+    _check_access('group_show', context, data_dict)
+
+    packages = model.Session.query(
+        _func.max(model.Package.metadata_modified))\
+        .filter(model.Package.id == model.Member.table_id)\
+        .filter(model.Member.group_id == group.id)\
+        .filter(model.Member.table_name == 'package').as_scalar()
+    changes = model.Session.execute(_select([
+        _latest_revision(model, model.Group, model.Group.id == group.id),
+        _latest_revision(model, model.GroupExtra,
+                         model.GroupExtra.group_id == group.id),
+        _latest_revision(model, model.Member,
+                         model.Member.group_id == group.id),
+        packages,
+    ])).fetchone()
+    dates = [date for date in changes if date is not None]
+    last_modified = max(dates) if dates else None
+    return '%s:%s:%s' % (group.id, context.get('api_version'),
+                         last_modified), last_modified
+
+@logic.cache_key(_group_show_cache_key)
 def group_show(context, data_dict):
     '''Return the details of a group.
 
@@ -677,6 +783,9 @@ def group_show(context, data_dict):
     _check_access('group_show',context, data_dict)
 
     group_dict = model_dictize.group_dictize(group, context)
+    _tag_page('group:%s' % group.id,
+              *['package:%s' % package['id']
+                for package in group_dict.get('packages', [])])
 
     for item in plugins.PluginImplementations(plugins.IGroupController):
         item.read(group)
@@ -732,11 +841,7 @@ def group_package_show(context, data_dict):
     if context.get('return_query'):
         return query
 
-    result = []
-    for pkg_rev in query.all():
-        result.append(model_dictize.package_dictize(pkg_rev, context))
-
-    return result
+    return model_dictize.package_list_dictize(query.all(), context)
 
 def tag_show(context, data_dict):
     '''Return the details of a tag and all its datasets.
@@ -762,12 +867,12 @@ def tag_show(context, data_dict):
 
     tag_dict = model_dictize.tag_dictize(tag,context)
 
-    extended_packages = []
-    for package in tag_dict['packages']:
-        pkg = model.Package.get(package['id'])
-        extended_packages.append(model_dictize.package_dictize(pkg,context))
-
-    tag_dict['packages'] = extended_packages
+    package_ids = [package['id'] for package in tag_dict['packages']]
+    packages = dict((pkg.id, pkg) for pkg in model.Session.query(model.Package)
+                    .filter(model.Package.id.in_(package_ids)))
+    tag_dict['packages'] = model_dictize.package_list_dictize(
+        [packages[package_id] for package_id in package_ids
+         if package_id in packages], context)
 
     return tag_dict
 
@@ -800,6 +905,7 @@ def user_show(context, data_dict):
         raise NotFound
 
     _check_access('user_show',context, data_dict)
+    _tag_page('user:%s' % user_obj.id)
 
     user_dict = model_dictize.user_dictize(user_obj,context)
 
@@ -1025,6 +1131,13 @@ def package_search(context, data_dict):
     :param facet.field: the fields to facet upon.  Default empty.  If empty,
         then the returned facet information is empty.
     :type facet.field: list of strings
+    :param cursor: use cursor based paging instead of ``start``, for walking
+        through large result sets.  Results are sorted by dataset id, and only
+        datasets with an id greater than the cursor are returned.  Use an
+        empty string to get the first page, and then the ``next_cursor`` value
+        of each result as the cursor of the following request.  The ``count``
+        of each page is the number of results after its cursor.  Optional.
+    :type cursor: string
 
     **Results:**
 
@@ -1045,6 +1158,10 @@ def package_search(context, data_dict):
         "count", "display_name" and "name" entries.  The display_name is a
         form of the name that can be used in titles.
     :type search_facets: nested dict of dicts.
+    :param next_cursor: only if the ``cursor`` parameter was given, the
+        cursor to use to get the next page of results, or ``None`` if there
+        are no more results.
+    :type next_cursor: string
 
     An example result: ::
 
@@ -1074,6 +1191,7 @@ def package_search(context, data_dict):
     session = context['session']
 
     _check_access('package_search', context, data_dict)
+    _tag_page('package')
 
     # check if some extension needs to modify the search params
     for item in plugins.PluginImplementations(plugins.IPackageController):
@@ -1082,6 +1200,7 @@ def package_search(context, data_dict):
     # the extension may have decided that it is not necessary to perform
     # the query
     abort = data_dict.get('abort_search',False)
+    use_cursor = 'cursor' in data_dict
 
     results = []
     if not abort:
@@ -1101,21 +1220,43 @@ def package_search(context, data_dict):
         query = search.query_for(model.Package)
         query.run(data_dict)
 
-        for package in query.results:
-            # get the package object
-            package, package_dict = package['id'], package.get('data_dict')
-            pkg_query = session.query(model.PackageRevision)\
-                .filter(model.PackageRevision.id == package)\
+        # check the datasets in the index still exist in the database, with
+        # a single query per page of results (unless configured to trust the
+        # search index)
+        trust_index = _asbool(config.get('search.trust_index', False))
+        ids_to_dictize = [package['id'] for package in query.results
+                          if not package.get('data_dict')]
+        ids_to_check = [package['id'] for package in query.results
+                        if package.get('data_dict') and not trust_index]
+
+        def _active_package_revisions(columns, ids):
+            if not ids:
+                return []
+            return session.query(columns)\
+                .filter(model.PackageRevision.id.in_(ids))\
                 .filter(_and_(
                     model.PackageRevision.state == u'active',
                     model.PackageRevision.current == True
-                ))
-            pkg = pkg_query.first()
+                )).all()
+
+        active_ids = set(row[0] for row in _active_package_revisions(
+            model.PackageRevision.id, ids_to_check))
+        pkgs_to_dictize = _active_package_revisions(model.PackageRevision,
+                                                    ids_to_dictize)
+        dictized = dict(zip([pkg.id for pkg in pkgs_to_dictize],
+            model_dictize.package_list_dictize(pkgs_to_dictize, context)))
+
+        for package in query.results:
+            package_id, package_dict = package['id'], package.get('data_dict')
 
             ## if the index has got a package that is not in ckan then
             ## ignore it.
-            if not pkg:
-                log.warning('package %s in index but not in database' % package)
+            if package_dict and not trust_index:
+                exists = package_id in active_ids
+            else:
+                exists = package_dict or package_id in dictized
+            if not exists:
+                log.warning('package %s in index but not in database' % package_id)
                 continue
             ## use data in search index if there
             if package_dict:
@@ -1126,7 +1267,7 @@ def package_search(context, data_dict):
                         package_dict = item.before_view(package_dict)
                 results.append(package_dict)
             else:
-                results.append(model_dictize.package_dictize(pkg,context))
+                results.append(dictized[package_id])
 
         count = query.count
         facets = query.facets
@@ -1140,9 +1281,13 @@ def package_search(context, data_dict):
         'facets': facets,
         'results': results
     }
+    if use_cursor:
+        search_results['next_cursor'] = None if abort else query.next_cursor
 
     # Transform facets into a more useful data structure.
     restructured_facets = {}
+    group_display_names = model.Group.get_display_names(
+        search_results['facets'].get('groups', {}).keys())
     for key, value in search_results['facets'].items():
         restructured_facets[key] = {
                 'title': key,
@@ -1152,11 +1297,8 @@ def package_search(context, data_dict):
             new_facet_dict = {}
             new_facet_dict['name'] = key_
             if key == 'groups':
-                group = model.Group.get(key_)
-                if group:
-                    new_facet_dict['display_name'] = group.display_name
-                else:
-                    new_facet_dict['display_name'] = key_
+                new_facet_dict['display_name'] = group_display_names.get(
+                    key_, key_)
             else:
                 new_facet_dict['display_name'] = key_
             new_facet_dict['count'] = value_
@@ -1569,73 +1711,124 @@ def vocabulary_show(context, data_dict):
     vocabulary_dict = model_dictize.vocabulary_dictize(vocabulary, context)
     return vocabulary_dict
 
+def _activity_list(context, data_dict, query):
+    '''Returns the dicts of the activities of the given query, newest
+    first, a page at a time.
+
+    Pages are given by the limit and before parameters, where before is the
+    id of the last activity of the previous page, rather than an offset, so
+    the activity indexes are used to find every page straight away.
+    '''
+    model = context['model']
+    try:
+        limit = int(data_dict.get('limit', _ACTIVITY_LIST_LIMIT))
+        if limit < 1:
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ValidationError({'limit': [_('Must be a positive integer')]})
+    limit = min(limit, _ACTIVITY_LIST_MAX_LIMIT)
+
+    before = data_dict.get('before')
+    if before:
+        activity = model.Session.query(model.Activity).get(before)
+        if activity is None:
+            raise ValidationError({'before': [_('Activity not found')]})
+        # activities at the same time are ordered by id
+        query = query.filter(
+            model.Activity.timestamp <= activity.timestamp).filter(
+            _or_(model.Activity.timestamp < activity.timestamp,
+                 model.Activity.id < activity.id))
+    query = query.order_by(_desc(model.Activity.timestamp),
+                           _desc(model.Activity.id))
+    activity_objects = query.limit(limit).all()
+    return model_dictize.activity_list_dictize(activity_objects, context)
+
 def user_activity_list(context, data_dict):
     '''Return a user's public activity stream.
 
     :param id: the id or name of the user
     :type id: string
+    :param limit: the maximum number of activities to return (optional,
+        default: 15, at most 100)
+    :type limit: int
+    :param before: the id of an activity; only older activities are
+        returned, to get the next page of the stream (optional)
+    :type before: string
 
     :rtype: list of dictionaries
 
     '''
     model = context['model']
     user_id = _get_or_bust(data_dict, 'id')
+    _tag_page('user:%s' % user_id)
     query = model.Session.query(model.Activity)
     query = query.filter_by(user_id=user_id)
-    query = query.order_by(_desc(model.Activity.timestamp))
-    query = query.limit(15)
-    activity_objects = query.all()
-    return model_dictize.activity_list_dictize(activity_objects, context)
+    return _activity_list(context, data_dict, query)
 
 def package_activity_list(context, data_dict):
     '''Return a package's activity stream.
 
     :param id: the id or name of the package
     :type id: string
+    :param limit: the maximum number of activities to return (optional,
+        default: 15, at most 100)
+    :type limit: int
+    :param before: the id of an activity; only older activities are
+        returned, to get the next page of the stream (optional)
+    :type before: string
 
     :rtype: list of dictionaries
 
     '''
     model = context['model']
     package_id = _get_or_bust(data_dict, 'id')
+    _tag_page('package:%s' % package_id)
     query = model.Session.query(model.Activity)
     query = query.filter_by(object_id=package_id)
-    query = query.order_by(_desc(model.Activity.timestamp))
-    query = query.limit(15)
-    activity_objects = query.all()
-    return model_dictize.activity_list_dictize(activity_objects, context)
+    return _activity_list(context, data_dict, query)
 
 def group_activity_list(context, data_dict):
     '''Return a group's activity stream.
 
     :param id: the id or name of the group
     :type id: string
+    :param limit: the maximum number of activities to return (optional,
+        default: 15, at most 100)
+    :type limit: int
+    :param before: the id of an activity; only older activities are
+        returned, to get the next page of the stream (optional)
+    :type before: string
 
     :rtype: list of dictionaries
 
     '''
     model = context['model']
     group_id = _get_or_bust(data_dict, 'id')
+    _tag_page('group:%s' % group_id)
     query = model.Session.query(model.Activity)
     query = query.filter_by(object_id=group_id)
-    query = query.order_by(_desc(model.Activity.timestamp))
-    query = query.limit(15)
-    activity_objects = query.all()
-    return model_dictize.activity_list_dictize(activity_objects, context)
+    return _activity_list(context, data_dict, query)
 
 def recently_changed_packages_activity_list(context, data_dict):
     '''Return the activity stream of all recently added or changed packages.
 
+    :param limit: the maximum number of activities to return (optional,
+        default: 15, at most 100)
+    :type limit: int
+    :param before: the id of an activity; only older activities are
+        returned, to get the next page of the stream (optional)
+    :type before: string
+
     :rtype: list of dictionaries
 
     '''
     model = context['model']
+    _tag_page('package')
     query = model.Session.query(model.Activity)
-    query = query.filter(model.Activity.activity_type.endswith('package'))
-    query = query.order_by(_desc(model.Activity.timestamp))
-    query = query.limit(15)
-    activity_objects = query.all()
-    return model_dictize.activity_list_dictize(activity_objects, context)
+    # the same filter as the index of these activities
+    query = query.filter(model.Activity.activity_type.in_(
+        model.activity.PACKAGE_ACTIVITY_TYPES))
+    return _activity_list(context, data_dict, query)
 
 def activity_detail_list(context, data_dict):
     '''Return an activity's list of activity detail items.
@@ -2052,13 +2245,19 @@ def dataset_followee_list(context, data_dict):
     datasets = [dataset for dataset in datasets if dataset is not None]
 
     # Dictize the list of Package objects.
-    return [model_dictize.package_dictize(dataset, context) for dataset in datasets]
+    return model_dictize.package_list_dictize(datasets, context)
 
 def dashboard_activity_list(context, data_dict):
     '''Return the dashboard activity stream of the given user.
 
     :param id: the id or name of the user
     :type id: string
+    :param limit: the maximum number of activities to return (optional,
+        default: 15, at most 100)
+    :type limit: int
+    :param before: the id of an activity; only older activities are
+        returned, to get the next page of the stream (optional)
+    :type before: string
 
     :rtype: list of dictionaries
 
@@ -2077,11 +2276,7 @@ def dashboard_activity_list(context, data_dict):
 
     query = from_user_query.union(about_user_query).union(
             user_followees_query).union(dataset_followees_query)
-    query = query.order_by(_desc(model.Activity.timestamp))
-    query = query.limit(15)
-    activity_objects = query.all()
-
-    return model_dictize.activity_list_dictize(activity_objects, context)
+    return _activity_list(context, data_dict, query)
 
 def dashboard_activity_list_html(context, data_dict):
     '''Return the dashboard activity stream of the given user as HTML.
@@ -13,6 +13,7 @@ import ckan.lib.dictization.model_save as model_save
 import ckan.lib.navl.dictization_functions
 import ckan.lib.navl.validators as validators
 import ckan.lib.plugins as lib_plugins
+import ckan.lib.search as search
 
 log = logging.getLogger(__name__)
 
@@ -24,6 +25,7 @@ _error_summary = logic.action.error_summary
 _get_action = logic.get_action
 _check_access = logic.check_access
 NotFound = logic.NotFound
+NotAuthorized = logic.NotAuthorized
 ValidationError = logic.ValidationError
 _get_or_bust = logic.get_or_bust
 
@@ -305,6 +307,176 @@ def package_update_validate(context, data_dict):
     return data
 
 
+def _package_error(exception):
+    '''Returns the error dict of a dataset of package_create_many or
+    package_update_many which could not be saved, as in the action API.'''
+    if isinstance(exception, ValidationError):
+        return dict(exception.error_dict, __type='Validation Error')
+    if isinstance(exception, NotAuthorized):
+        return {'__type': 'Authorization Error',
+                'message': _('Access denied')}
+    return {'__type': 'Not Found Error', 'message': _('Not found')}
+
+def _package_validate_many(context, package_dict, operation, seen):
+    '''Validates one of the datasets of package_create_many or
+    package_update_many, returning the validated data.'''
+    model = context['model']
+    pkg = None
+    if operation == 'update':
+        name_or_id = package_dict.get('id') or package_dict.get('name')
+        pkg = model.Package.get(name_or_id) if name_or_id else None
+        if pkg is None:
+            raise NotFound(_('Package was not found.'))
+        context['package'] = pkg
+        package_dict['id'] = pkg.id
+        if pkg.id in seen:
+            raise ValidationError(
+                {'id': [_('Dataset is updated twice in the same batch')]})
+
+    package_type = pkg.type if pkg else package_dict.get('type')
+    package_plugin = lib_plugins.lookup_package_plugin(package_type)
+    try:
+        schema = package_plugin.form_to_db_schema_options({'type': operation,
+                                               'api':'api_version' in context,
+                                               'context': context})
+    except AttributeError:
+        schema = package_plugin.form_to_db_schema()
+
+    _check_access('package_%s' % operation, context, package_dict)
+
+    if 'api_version' not in context:
+        try:
+            package_plugin.check_data_dict(package_dict, schema)
+        except TypeError:
+            package_plugin.check_data_dict(package_dict)
+
+    data, errors = _validate(package_dict, schema, context)
+    # the name validators only check the datasets already in the database
+    if data.get('name') in seen:
+        errors.setdefault('name', []).append(
+            _('That URL is already in use.'))
+    if errors:
+        raise ValidationError(errors, _error_summary(errors))
+    if pkg:
+        seen.add(pkg.id)
+    seen.add(data.get('name'))
+    return data
+
+def _package_save_many(context, data_dict, operation):
+    '''Creates or updates a list of datasets under a single revision and
+    reindexes them at once, see package_create_many and
+    package_update_many.'''
+    model = context['model']
+    user = context['user']
+    package_dicts = data_dict.get('data')
+    if not isinstance(package_dicts, list):
+        raise ValidationError(
+            {'data': [_('A list of dataset dictionaries is required')]})
+
+    model.Session.remove()
+    model.Session()._context = context
+    # tags and groups looked up when saving a dataset are reused for the
+    # rest of the batch
+    context.setdefault('tag_cache', {})
+    context.setdefault('group_cache', {})
+
+    results = [None] * len(package_dicts)
+    valid = []
+    seen = set()
+    for num, package_dict in enumerate(package_dicts):
+        item_context = dict(context)
+        try:
+            data = _package_validate_many(item_context, package_dict,
+                                          operation, seen)
+        except (ValidationError, NotAuthorized, NotFound), e:
+            results[num] = {'success': False, 'error': _package_error(e)}
+            continue
+        valid.append((num, item_context, data))
+
+    if not valid:
+        model.Session.rollback()
+        return results
+
+    rev = model.repo.new_revision()
+    rev.author = user
+    if 'message' in context:
+        rev.message = context['message']
+    elif operation == 'create':
+        rev.message = _(u'REST API: Create %s objects') % len(valid)
+    else:
+        rev.message = _(u'REST API: Update %s objects') % len(valid)
+
+    defer_commit = context.get('defer_commit')
+    if not defer_commit:
+        search.begin_index_batch()
+    try:
+        admins = []
+        if operation == 'create' and user:
+            admins = [model.User.by_name(user.decode('utf8'))]
+        pkgs = []
+        for num, item_context, data in valid:
+            pkg = model_save.package_dict_save(data, item_context)
+            if operation == 'create':
+                model.setup_default_user_roles(pkg, admins)
+            pkgs.append((num, pkg))
+        # Needed to let extensions know the package ids
+        model.Session.flush()
+
+        for num, pkg in pkgs:
+            for item in plugins.PluginImplementations(
+                    plugins.IPackageController):
+                if operation == 'create':
+                    item.create(pkg)
+                else:
+                    item.edit(pkg)
+            results[num] = {'success': True,
+                            'result': {'id': pkg.id, 'name': pkg.name}}
+
+        if not defer_commit:
+            model.repo.commit()
+    except Exception, e:
+        if not defer_commit:
+            search.discard_index_batch()
+        model.Session.rollback()
+        log.exception(e)
+        for num, item_context, data in valid:
+            results[num] = {'success': False,
+                            'error': {'__type': 'Database Error',
+                                      'message': _('The datasets could not '
+                                                   'be saved')}}
+        return results
+
+    if not defer_commit:
+        try:
+            search.commit_index_batch()
+        except search.SearchIndexError, e:
+            # the datasets are saved, the index can be fixed with
+            # paster search-index rebuild -o
+            log.exception(e)
+    return results
+
+def package_update_many(context, data_dict):
+    '''Update many datasets at once.
+
+    The datasets are validated one by one, and those that are valid are
+    saved together under a single revision and then sent to the search
+    index in one batch. This is much faster than calling
+    ``package_update()`` for each of them, e.g. when harvesting.
+
+    :param data: the datasets to update, each one with the parameters of
+        ``package_update()``
+    :type data: list of dictionaries
+
+    :returns: a result for each dataset, in the same order, with key
+        ``'success'`` and either key ``'result'`` (a dictionary with the
+        ``'id'`` and ``'name'`` of the dataset) or key ``'error'`` (a
+        dictionary describing the error, like the errors of the action API)
+    :rtype: list of dictionaries
+
+    '''
+    return _package_save_many(context, data_dict, 'update')
+
+
 def _update_package_relationship(relationship, comment, context):
     model = context['model']
     api = context.get('api_version')
@@ -1,6 +1,6 @@
 from pylons.i18n import _
 from ckan import model
-from ckan.lib.navl.dictization_functions import Invalid
+from ckan.lib.navl.dictization_functions import Invalid, output_transform
 from ckan.lib.field_types import DateType, DateConvertError
 from ckan.logic.validators import tag_length_validator, tag_name_validator, \
     tag_in_vocabulary_validator
@@ -11,6 +11,7 @@ def convert_to_extras(key, data, errors, context):
         data[('extras',)] = extras
     extras.append({'key': key[-1], 'value': data[key]})
 
+@output_transform
 def convert_from_extras(key, data, errors, context):
     for data_key, data_value in data.iteritems():
         if (data_key[0] == 'extras'
@@ -25,6 +26,7 @@ def date_to_db(value, context):
         raise Invalid(str(e))
     return value
 
+@output_transform
 def date_to_form(value, context):
     try:
         value = DateType.db_to_form(value)
@@ -32,6 +34,7 @@ def date_to_form(value, context):
         raise Invalid(str(e))
     return value
 
+@output_transform
 def free_tags_only(key, data, errors, context):
     tag_number = key[1]
     if not data.get(('tags', tag_number, 'vocabulary_id')):
@@ -68,6 +71,7 @@ def convert_to_tags(vocab):
     return callable
 
 def convert_from_tags(vocab):
+    @output_transform
     def callable(key, data, errors, context):
         v = model.Vocabulary.get(vocab)
         if not v:
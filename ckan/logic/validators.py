@@ -3,7 +3,8 @@ from pylons.i18n import _
 from itertools import count
 import re
 from pylons.i18n import _, ungettext, N_, gettext
-from ckan.lib.navl.dictization_functions import Invalid, Missing, missing, unflatten
+from ckan.lib.navl.dictization_functions import (Invalid, Missing, missing,
+                                               unflatten, output_transform)
 from ckan.authz import Authorizer
 from ckan.logic import check_access, NotAuthorized
 from ckan.lib.helpers import date_str_to_datetime
@@ -319,6 +320,7 @@ def ignore_not_admin(key, data, errors, context):
     # Deprecated in favour of ignore_not_package_admin
     return ignore_not_package_admin(key, data, errors, context)
 
+@output_transform
 def ignore_not_package_admin(key, data, errors, context):
     '''Ignore if the user is not allowed to administer the package specified.'''
 
@@ -345,6 +347,7 @@ def ignore_not_package_admin(key, data, errors, context):
 
     data.pop(key)
 
+@output_transform
 def ignore_not_group_admin(key, data, errors, context):
     '''Ignore if the user is not allowed to administer for the group specified.'''
 
@@ -0,0 +1,18 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    migrate_engine.execute('''
+        BEGIN;
+        CREATE TABLE search_index_queue (
+            id serial NOT NULL,
+            package_id text NOT NULL,
+            operation text NOT NULL,
+            "timestamp" timestamp without time zone
+        );
+        ALTER TABLE search_index_queue
+            ADD CONSTRAINT search_index_queue_pkey PRIMARY KEY (id);
+        CREATE INDEX search_index_queue_package_id ON search_index_queue(package_id);
+        COMMIT;
+    '''
+    )
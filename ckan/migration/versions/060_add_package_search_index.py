@@ -0,0 +1,12 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    # The indexed expression must match SEARCH_VECTOR in ckan.lib.search.sql
+    migrate_engine.execute('''
+        CREATE INDEX package_search_vector_idx ON package USING gin((
+            setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(notes, '')), 'C')));
+    '''
+    )
@@ -0,0 +1,34 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    migrate_engine.execute('''
+        BEGIN;
+        CREATE TABLE tracking_total (
+            tracking_type character varying(10) NOT NULL,
+            key text NOT NULL,
+            running_total int NOT NULL DEFAULT 0,
+            recent_views int NOT NULL DEFAULT 0,
+            tracking_date date
+        );
+        ALTER TABLE tracking_total
+            ADD CONSTRAINT tracking_total_pkey PRIMARY KEY (tracking_type, key);
+
+        INSERT INTO tracking_total
+            (tracking_type, key, running_total, recent_views, tracking_date)
+        SELECT DISTINCT ON (package_id)
+            'page', package_id, running_total, recent_views, tracking_date
+        FROM tracking_summary
+        WHERE package_id IS NOT NULL AND package_id != '~~not~found~~'
+        ORDER BY package_id, tracking_date DESC;
+
+        INSERT INTO tracking_total
+            (tracking_type, key, running_total, recent_views, tracking_date)
+        SELECT DISTINCT ON (url)
+            'resource', url, running_total, recent_views, tracking_date
+        FROM tracking_summary
+        WHERE tracking_type = 'resource'
+        ORDER BY url, tracking_date DESC;
+        COMMIT;
+    '''
+    )
@@ -0,0 +1,50 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    migrate_engine.execute('''
+        BEGIN;
+        ALTER TABLE package
+            ADD COLUMN metadata_modified timestamp without time zone;
+        ALTER TABLE package
+            ADD COLUMN metadata_created timestamp without time zone;
+
+        UPDATE package SET metadata_created = created.timestamp
+        FROM (SELECT id, min(revision_timestamp) AS timestamp
+              FROM package_revision GROUP BY id) AS created
+        WHERE package.id = created.id;
+
+        UPDATE package SET metadata_modified = modified.timestamp
+        FROM (SELECT package_id, max(timestamp) AS timestamp FROM (
+                SELECT p.id AS package_id, r.timestamp
+                FROM package p JOIN revision r ON p.revision_id = r.id
+              UNION ALL
+                SELECT e.package_id, r.timestamp
+                FROM package_extra e JOIN revision r ON e.revision_id = r.id
+              UNION ALL
+                SELECT pr.subject_package_id, r.timestamp
+                FROM package_relationship pr
+                JOIN revision r ON pr.revision_id = r.id
+              UNION ALL
+                SELECT pr.object_package_id, r.timestamp
+                FROM package_relationship pr
+                JOIN revision r ON pr.revision_id = r.id
+              UNION ALL
+                SELECT rg.package_id, r.timestamp
+                FROM resource_group rg JOIN revision r ON rg.revision_id = r.id
+              UNION ALL
+                SELECT rg.package_id, r.timestamp
+                FROM resource res
+                JOIN resource_group rg ON res.resource_group_id = rg.id
+                JOIN revision r ON res.revision_id = r.id
+              UNION ALL
+                SELECT pt.package_id, r.timestamp
+                FROM package_tag pt JOIN revision r ON pt.revision_id = r.id
+              ) AS timestamps GROUP BY package_id) AS modified
+        WHERE package.id = modified.package_id;
+
+        CREATE INDEX idx_package_metadata_modified ON package(metadata_modified);
+        CREATE INDEX idx_package_metadata_created ON package(metadata_created);
+        COMMIT;
+    '''
+    )
@@ -0,0 +1,29 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    migrate_engine.execute('''
+        BEGIN;
+        CREATE TABLE tracking_watermark (
+            name character varying(100) NOT NULL,
+            access_timestamp timestamp without time zone NOT NULL
+        );
+        ALTER TABLE tracking_watermark
+            ADD CONSTRAINT tracking_watermark_pkey PRIMARY KEY (name);
+
+        CREATE TABLE tracking_raw_archive (
+            user_key character varying(100) NOT NULL,
+            url text NOT NULL,
+            tracking_type character varying(10) NOT NULL,
+            access_timestamp timestamp without time zone
+        );
+        CREATE INDEX tracking_raw_archive_access_timestamp
+            ON tracking_raw_archive(access_timestamp);
+
+        CREATE INDEX tracking_summary_url_date
+            ON tracking_summary(url, tracking_date);
+        CREATE INDEX tracking_summary_package_id_date
+            ON tracking_summary(package_id, tracking_date);
+        COMMIT;
+    '''
+    )
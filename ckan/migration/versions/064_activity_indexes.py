@@ -0,0 +1,22 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    # The partial index is used by recently_changed_packages_activity_list,
+    # whose filter must match its WHERE clause (see
+    # ckan.model.activity.PACKAGE_ACTIVITY_TYPES).
+    migrate_engine.execute('''
+        BEGIN;
+        CREATE INDEX activity_user_id_timestamp
+            ON activity(user_id, "timestamp");
+        CREATE INDEX activity_object_id_timestamp
+            ON activity(object_id, "timestamp");
+        CREATE INDEX activity_package_timestamp
+            ON activity("timestamp")
+            WHERE activity_type IN ('new package', 'changed package',
+                                    'deleted package');
+        CREATE INDEX activity_detail_activity_id
+            ON activity_detail(activity_id);
+        COMMIT;
+    '''
+    )
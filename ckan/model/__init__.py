@@ -108,6 +108,8 @@ from resource import (
 )
 from tracking import (
     tracking_summary_table,
+    tracking_total_table,
+    tracking_watermark_table,
     TrackingSummary,
 )
 from rating import (
@@ -146,6 +148,10 @@ from follower import (
     UserFollowingUser,
     UserFollowingDataset,
 )
+from search_queue import (
+    SearchIndexQueue,
+    search_index_queue_table,
+)
 
 import ckan.migration
 
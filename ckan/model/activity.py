@@ -10,6 +10,10 @@ __all__ = ['Activity', 'activity_table',
            'ActivityDetail', 'activity_detail_table',
            ]
 
+# The activity types of the recently changed datasets stream, which has a
+# partial index on them (see migration 064)
+PACKAGE_ACTIVITY_TYPES = ['new package', 'changed package', 'deleted package']
+
 activity_table = Table(
     'activity', meta.metadata,
     Column('id', types.UnicodeText, primary_key=True, default=_types.make_uuid),
@@ -1,6 +1,9 @@
 import datetime
+import time
 
-from sqlalchemy import orm, types, Column, Table, ForeignKey, or_
+from pylons import config
+from sqlalchemy import orm, types, Column, Table, ForeignKey, or_, and_, \
+    select, func, distinct
 import vdm.sqlalchemy
 
 import meta
@@ -39,6 +42,15 @@ group_table = Table('group', meta.metadata,
 vdm.sqlalchemy.make_table_stateful(group_table)
 group_revision_table = core.make_revisioned_table(group_table)
 
+# Display names of groups, keyed by group name and id, shared between
+# requests. It is cleared whenever a group is modified in this process, and
+# entries expire after ckan.group_display_names_cache_ttl seconds so changes
+# made by other processes are eventually seen.
+_display_names_cache = {}
+
+def clear_display_names_cache():
+    _display_names_cache.clear()
+
 
 class Member(vdm.sqlalchemy.RevisionedObjectMixin,
         vdm.sqlalchemy.StatefulObjectMixin,
@@ -105,6 +117,33 @@ class Group(vdm.sqlalchemy.RevisionedObjectMixin,
         return group
     # Todo: Make sure group names can't be changed to look like group IDs?
 
+    @classmethod
+    def get_display_names(cls, references):
+        '''Returns a dict mapping each of the given group ids or names to the
+        display name of the group, fetching all the groups not already cached
+        in a single query. References not matching a group are not included.'''
+        ttl = int(config.get('ckan.group_display_names_cache_ttl', 300))
+        references = set(references)
+        now = time.time()
+        display_names = {}
+        missing = []
+        for reference in references:
+            cached = _display_names_cache.get(reference)
+            if cached and now - cached[1] < ttl:
+                display_names[reference] = cached[0]
+            else:
+                missing.append(reference)
+        if missing:
+            query = meta.Session.query(cls.id, cls.name, cls.title).filter(
+                or_(cls.id.in_(missing), cls.name.in_(missing)))
+            for id, name, title in query:
+                display_name = title if title else name
+                for key in (id, name):
+                    _display_names_cache[key] = (display_name, now)
+                    if key in references:
+                        display_names[key] = display_name
+        return display_names
+
     @classmethod
     def all(cls, group_type=None, state=('active',)):
         """
@@ -180,6 +219,33 @@ class Group(vdm.sqlalchemy.RevisionedObjectMixin,
 
         return query
 
+    @classmethod
+    def package_count_select(cls, with_private=False):
+        '''Returns a select of (group_id, package_count) rows with the number
+        of active datasets in each group, as counted by active_packages.'''
+        package_table = _package.package_table
+        where = [member_table.c.table_id == package_table.c.id,
+                 member_table.c.state == 'active',
+                 package_table.c.state == vdm.sqlalchemy.State.ACTIVE]
+        if not with_private:
+            where.append(member_table.c.capacity == 'public')
+        package_count = func.count(distinct(package_table.c.id))
+        return select([member_table.c.group_id,
+                       package_count.label('package_count')],
+                      and_(*where)).group_by(member_table.c.group_id)
+
+    @classmethod
+    def get_package_counts(cls, group_ids, with_private=False):
+        '''Returns a dict with the number of active datasets of each of the
+        given groups, counted with a single query.'''
+        group_ids = list(group_ids)
+        counts = dict.fromkeys(group_ids, 0)
+        if group_ids:
+            query = cls.package_count_select(with_private).where(
+                member_table.c.group_id.in_(group_ids))
+            counts.update(meta.Session.execute(query).fetchall())
+        return counts
+
     @classmethod
     def search_by_name_or_title(cls, text_query, group_type=None):
         text_query = text_query.strip().lower()
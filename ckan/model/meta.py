@@ -5,6 +5,7 @@ from pylons import config
 """SQLAlchemy Metadata and Session object"""
 from sqlalchemy import MetaData, and_
 import sqlalchemy.orm as orm
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.session import SessionExtension
 
 import extension
@@ -16,40 +17,48 @@ __all__ = ['Session', 'engine_is_sqlite']
 class CkanCacheExtension(SessionExtension):
     ''' This extension checks what tables have been affected by
     database access and allows us to act on them. Currently this is
-    used by the page cache to flush the cache when data in the database
-    is altered. '''
+    used by the page cache to remove the pages showing the objects
+    altered in the database. '''
 
     def __init__(self, *args, **kw):
         super(CkanCacheExtension, self).__init__(*args, **kw)
-        # Setup Redis support if needed.
         self.use_redis = asbool(config.get('ckan.page_cache_enabled'))
-        if self.use_redis:
-            import redis
-            self.redis = redis
-            self.redis_connection is None
-            self.redis_exception = redis.exceptions.ConnectionError
+
+    def before_commit(self, session):
+        # The pages to remove are worked out before the commit, as the
+        # objects are expired after it.
+        if not self.use_redis:
+            return
+        session.flush()
+        if not hasattr(session, '_object_cache'):
+            return
+        from ckan.lib.page_cache import object_tags
+        oc = session._object_cache
+        tags = set()
+        for item in oc['new'] | oc['changed'] | oc['deleted']:
+            tags.update(object_tags(item))
+        session._page_cache_tags = tags
 
     def after_commit(self, session):
+        objs = set()
         if hasattr(session, '_object_cache'):
             oc = session._object_cache
-            oc_list = oc['new']
-            oc_list.update(oc['changed'])
-            oc_list.update(oc['deleted'])
-            objs = set()
-            for item in oc_list:
+            for item in oc['new'] | oc['changed'] | oc['deleted']:
                 objs.add(item.__class__.__name__)
 
-        # Flush Redis
-        if self.use_redis:
-            if self.redis_connection is None:
-                try:
-                    self.redis_connection = self.redis.StrictRedis()
-                except self.redis_exception:
-                    pass
-            try:
-                self.redis_connection.flushdb()
-            except self.redis_exception:
-                pass
+        if 'Group' in objs:
+            from ckan.model.group import clear_display_names_cache
+            clear_display_names_cache()
+
+        # Remove the cached pages showing the objects changed
+        if hasattr(session, '_page_cache_tags'):
+            from ckan.lib.page_cache import get_page_cache
+            get_page_cache().invalidate(session._page_cache_tags)
+            del session._page_cache_tags
+
+    def after_rollback(self, session):
+        if hasattr(session, '_page_cache_tags'):
+            del session._page_cache_tags
 
 class CkanSessionExtension(SessionExtension):
 
@@ -79,39 +88,95 @@ class CkanSessionExtension(SessionExtension):
         new = obj_cache['new']
         changed = obj_cache['changed']
         deleted = obj_cache['deleted']
-        for obj in new | changed | deleted:
+        self._update_revisions(session, new | changed | deleted, revision)
+        self._update_package_dates(session, new, changed | deleted, revision)
+
+    def _update_revisions(self, session, objs, revision):
+        '''
+        Sets the revision timestamp of the revision rows added in this
+        revision, marks them as current (unless the object is pending) and
+        expires the previous revision rows of the objects.
+
+        There are a few UPDATE statements per revision table, for all the
+        objects of that table at once.
+        '''
+        # ids of the active and the pending objects, by revision table
+        active = {}
+        pending = {}
+        for obj in objs:
             if not hasattr(obj, '__revision_class__'):
                 continue
-            revision_cls = obj.__revision_class__
-            revision_table = orm.class_mapper(revision_cls).mapped_table
-            ## when a normal active transaction happens
+            revision_table = orm.class_mapper(
+                obj.__revision_class__).mapped_table
             if 'pending' not in obj.state:
-                ### this is asql statement as we do not want it in object cache
-                session.execute(
-                    revision_table.update().where(
-                        and_(revision_table.c.id == obj.id,
-                             revision_table.c.current == '1')
-                    ).values(current='0')
-                )
-
-            q = session.query(revision_cls)
-            q = q.filter_by(expired_timestamp=datetime.datetime(9999, 12, 31), id=obj.id)
-            results = q.all()
-            for rev_obj in results:
-                values = {}
-                if rev_obj.revision_id == revision.id:
-                    values['revision_timestamp'] = revision.timestamp
-                    if 'pending' not in obj.state:
-                        values['current'] = '1'
-                else:
-                    values['expired_id'] = revision.id
-                    values['expired_timestamp'] = revision.timestamp
-                session.execute(
-                    revision_table.update().where(
-                        and_(revision_table.c.id == rev_obj.id,
-                             revision_table.c.revision_id == rev_obj.revision_id)
-                    ).values(**values)
-                )
+                active.setdefault(revision_table, set()).add(obj.id)
+            else:
+                pending.setdefault(revision_table, set()).add(obj.id)
+
+        not_expired = datetime.datetime(9999, 12, 31)
+        ### these are sql statements as we do not want them in object cache
+        for revision_table in set(active) | set(pending):
+            c = revision_table.c
+            active_ids = list(active.get(revision_table, []))
+            pending_ids = list(pending.get(revision_table, []))
+            latest = and_(c.expired_timestamp == not_expired,
+                          c.revision_id == revision.id)
+            if active_ids:
+                ## when a normal active transaction happens
+                session.execute(revision_table.update().where(
+                    and_(c.id.in_(active_ids), c.current == '1')
+                ).values(current='0'))
+                session.execute(revision_table.update().where(
+                    and_(c.id.in_(active_ids), latest)
+                ).values(revision_timestamp=revision.timestamp, current='1'))
+            if pending_ids:
+                session.execute(revision_table.update().where(
+                    and_(c.id.in_(pending_ids), latest)
+                ).values(revision_timestamp=revision.timestamp))
+            session.execute(revision_table.update().where(
+                and_(c.id.in_(active_ids + pending_ids),
+                     c.expired_timestamp == not_expired,
+                     c.revision_id != revision.id)
+            ).values(expired_id=revision.id,
+                     expired_timestamp=revision.timestamp))
+
+    def _update_package_dates(self, session, new, changed, revision):
+        '''
+        Updates the metadata_modified date of the datasets changed in this
+        revision, either directly or through their resources, tags, extras
+        or relationships (but not their groups), and the metadata_created
+        date of the new ones.
+        '''
+        from ckan.model.package import package_table
+        packages = set()
+        for obj in new | changed:
+            name = obj.__class__.__name__
+            if name == 'Package':
+                packages.add(obj)
+            elif name in ('PackageTag', 'PackageExtra', 'ResourceGroup'):
+                packages.add(obj.package)
+            elif name == 'Resource':
+                packages.add(getattr(obj.resource_group, 'package', None))
+            elif name == 'PackageRelationship':
+                packages.update([obj.subject, obj.object])
+        packages.discard(None)
+        if not packages:
+            return
+
+        # Use SQL statements, as the dates are not revisioned
+        session.execute(package_table.update().where(
+            package_table.c.id.in_([pkg.id for pkg in packages])
+        ).values(metadata_modified=revision.timestamp))
+        created = [pkg.id for pkg in packages if pkg in new]
+        if created:
+            session.execute(package_table.update().where(
+                package_table.c.id.in_(created)
+            ).values(metadata_created=revision.timestamp))
+        for pkg in packages:
+            set_committed_value(pkg, 'metadata_modified', revision.timestamp)
+            if pkg in new:
+                set_committed_value(pkg, 'metadata_created',
+                                    revision.timestamp)
 
     def after_commit(self, session):
         if hasattr(session, '_object_cache'):
@@ -1,6 +1,7 @@
 import logging
 
 import ckan.plugins as plugins
+import ckan.lib.package_cache as package_cache
 import extension
 import domain_object
 import package as _package
@@ -61,6 +62,19 @@ class DomainObjectModificationExtension(plugins.SingletonPlugin, extension.Obser
         for obj in changed_pkgs:
             self.notify(obj, domain_object.DomainObjectOperation.changed)
 
+        # The cached dicts are removed once the changes are committed, as
+        # until then other sessions would cache the old dicts again.
+        session._package_cache_ids = set(
+            obj.id for obj in changed_pkgs | deleted
+            if isinstance(obj, _package.Package))
+
+    def after_commit(self, session):
+        for package_id in getattr(session, '_package_cache_ids', ()):
+            package_cache.invalidate(package_id)
+        session._package_cache_ids = set()
+
+    def after_rollback(self, session):
+        session._package_cache_ids = set()
 
     def notify(self, entity, operation):
         for observer in self.observers:
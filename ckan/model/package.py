@@ -1,9 +1,8 @@
 import datetime
-from calendar import timegm
 import logging
 logger = logging.getLogger(__name__)
 
-from sqlalchemy.sql import select, and_, union, or_
+from sqlalchemy.sql import select, and_, or_
 from sqlalchemy import orm
 from sqlalchemy import types, Column, Table
 from pylons import config
@@ -49,6 +48,14 @@ package_table = Table('package', meta.metadata,
 vdm.sqlalchemy.make_table_stateful(package_table)
 package_revision_table = core.make_revisioned_table(package_table)
 
+# The most recent timestamp of the revisions of the package and its related
+# objects (excluding its groups) and the timestamp of its first revision.
+# They are kept up to date by CkanSessionExtension.before_commit and are
+# not revisioned.
+NON_REVISIONED_FIELDS = ['metadata_modified', 'metadata_created']
+package_table.append_column(Column('metadata_modified', types.DateTime))
+package_table.append_column(Column('metadata_created', types.DateTime))
+
 ## -------------------
 ## Mapped classes
 
@@ -524,47 +531,6 @@ class Package(vdm.sqlalchemy.RevisionedObjectMixin,
                         results[key] = value_diff
         return results
 
-    @property
-    def metadata_modified(self):
-        """
-        Return most recent timestamp for revisions related to this package.
-        NB Excludes changes to the package's groups
-        """
-        from ckan import model
-        where = [model.package_table.c.id == self.id]
-        where_clauses = [
-            and_(model.package_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.package_extra_table.c.package_id == model.package_table.c.id,
-                 model.package_extra_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.package_relationship_table.c.subject_package_id == model.package_table.c.id,
-                 model.package_relationship_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.package_relationship_table.c.object_package_id == model.package_table.c.id,
-                 model.package_relationship_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.resource_group_table.c.package_id == model.package_table.c.id,
-                 model.resource_group_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.resource_group_table.c.package_id == model.package_table.c.id,
-                 model.resource_table.c.resource_group_id == model.resource_group_table.c.id,
-                 model.resource_table.c.revision_id == model.revision_table.c.id, *where),
-            and_(model.package_tag_table.c.package_id == model.package_table.c.id,
-                 model.package_tag_table.c.revision_id == model.revision_table.c.id, *where)
-            ]
-
-        query = union(*[select([model.revision_table.c.timestamp], x) for x in where_clauses]
-                      ).order_by('timestamp DESC').limit(1)
-        # Use current connection because we might be in a 'before_commit' of
-        # a SessionExtension - only by using the current connection can we get
-        # at the newly created revision etc. objects.
-        conn = model.Session.connection()
-        result = conn.execute(query).fetchone()
-
-        if result:
-            result_datetime = _types.iso_date_to_datetime_for_sqlite(result[0])
-            timestamp_without_usecs = result_datetime.utctimetuple()
-            usecs = float(result_datetime.microsecond) / 1e6
-            # use timegm instead of mktime, because we don't want it localised
-            timestamp_float = timegm(timestamp_without_usecs) + usecs
-            return datetime.datetime.utcfromtimestamp(timestamp_float)
-
     @property
     def is_private(self):
         """
@@ -595,15 +561,10 @@ class Package(vdm.sqlalchemy.RevisionedObjectMixin,
             groups = [g[0] for g in groupcaps if g[1] == capacity]
         return groups
 
-    @property
-    def metadata_created(self):
-        import ckan.model as model
-        q = meta.Session.query(model.PackageRevision.revision_timestamp)\
-            .filter(model.PackageRevision.id == self.id)\
-            .order_by(model.PackageRevision.revision_timestamp.asc())
-        ts = q.first()
-        if ts:
-            return ts[0]
+    @classmethod
+    def revisioned_fields(cls):
+        return [field for field in super(Package, cls).revisioned_fields()
+                if field not in NON_REVISIONED_FIELDS]
 
     @staticmethod
     def get_fields(core_only=False, fields_to_ignore=None):
@@ -0,0 +1,56 @@
+import datetime
+
+from sqlalchemy import types, Column, Table
+
+import meta
+import domain_object
+
+__all__ = ['SearchIndexQueue', 'search_index_queue_table']
+
+search_index_queue_table = Table('search_index_queue', meta.metadata,
+    Column('id', types.Integer, primary_key=True),
+    Column('package_id', types.UnicodeText, nullable=False),
+    Column('operation', types.UnicodeText, nullable=False),
+    Column('timestamp', types.DateTime, default=datetime.datetime.now),
+)
+
+
+class SearchIndexQueue(domain_object.DomainObject):
+    '''Pending search index operations, recorded when datasets are modified
+    and processed later on by ``paster search-index process-queue``.
+
+    '''
+    @classmethod
+    def enqueue(cls, package_id, operation):
+        '''Record an index operation for a dataset.
+
+        The row is written with a plain insert, in the same transaction as
+        the modification itself, so it does not interfere with the objects
+        being committed by the session.
+
+        '''
+        meta.Session.execute(search_index_queue_table.insert().values(
+            package_id=package_id, operation=operation,
+            timestamp=datetime.datetime.now()))
+
+    @classmethod
+    def next_batch(cls, limit):
+        '''Return the oldest pending operations, as (id, package_id,
+        operation) tuples.'''
+        table = search_index_queue_table
+        query = meta.Session.query(table.c.id, table.c.package_id,
+                                   table.c.operation)
+        return query.order_by(table.c.id).limit(limit).all()
+
+    @classmethod
+    def remove(cls, ids):
+        '''Remove processed operations from the queue.'''
+        if ids:
+            meta.Session.execute(search_index_queue_table.delete().where(
+                search_index_queue_table.c.id.in_(ids)))
+
+    @classmethod
+    def count(cls):
+        return meta.Session.query(search_index_queue_table).count()
+
+meta.mapper(SearchIndexQueue, search_index_queue_table)
@@ -1,9 +1,10 @@
-from sqlalchemy import types, Column, Table
+from sqlalchemy import types, Column, Table, select, and_, or_
 
 import meta
 import domain_object
 
-__all__ = ['tracking_summary_table', 'TrackingSummary']
+__all__ = ['tracking_summary_table', 'tracking_total_table',
+           'tracking_watermark_table', 'TrackingSummary']
 
 tracking_summary_table = Table('tracking_summary', meta.metadata,
         Column('url', types.UnicodeText, primary_key=True, nullable=False),
@@ -15,28 +16,63 @@ tracking_summary_table = Table('tracking_summary', meta.metadata,
         Column('tracking_date', types.DateTime),
     )
 
+# The latest totals of each dataset (tracking_type 'page', the key is the
+# dataset id) and resource (tracking_type 'resource', the key is the
+# resource url), updated from tracking_summary by the tracking command.
+tracking_total_table = Table('tracking_total', meta.metadata,
+        Column('tracking_type', types.Unicode(10), primary_key=True),
+        Column('key', types.UnicodeText, primary_key=True),
+        Column('running_total', types.Integer, nullable=False),
+        Column('recent_views', types.Integer, nullable=False),
+        Column('tracking_date', types.DateTime),
+    )
+
+# The time of the latest tracking_raw row counted by each step of the
+# tracking command, so it only counts the rows added since.
+tracking_watermark_table = Table('tracking_watermark', meta.metadata,
+        Column('name', types.Unicode(100), primary_key=True),
+        Column('access_timestamp', types.DateTime, nullable=False),
+    )
+
 class TrackingSummary(domain_object.DomainObject):
 
     @classmethod
     def get_for_package(cls, package_id):
-        obj = meta.Session.query(cls).autoflush(False)
-        obj = obj.filter_by(package_id=package_id)
-        data = obj.order_by('tracking_date desc').first()
-        if data:
-            return {'total' : data.running_total,
-                    'recent': data.recent_views}
-
-        return {'total' : 0, 'recent' : 0}
-
+        return cls.get_totals(package_ids=[package_id])[0][package_id]
 
     @classmethod
     def get_for_resource(cls, url):
-        obj = meta.Session.query(cls).autoflush(False)
-        data = obj.filter_by(url=url).order_by('tracking_date desc').first()
-        if data:
-            return {'total' : data.running_total,
-                    'recent': data.recent_views}
+        return cls.get_totals(urls=[url])[1][url]
 
-        return {'total' : 0, 'recent' : 0}
+    @classmethod
+    def get_totals(cls, package_ids=(), urls=()):
+        '''
+        Returns the latest tracking totals of the given datasets and
+        resource urls with a single query, as two dicts of
+        {'total': ..., 'recent': ...} keyed by dataset id and by url.
+        '''
+        packages = dict((package_id, {'total': 0, 'recent': 0})
+                        for package_id in package_ids)
+        resources = dict((url, {'total': 0, 'recent': 0}) for url in urls)
+        totals = tracking_total_table.c
+        conditions = []
+        if packages:
+            conditions.append(and_(totals.tracking_type == u'page',
+                                   totals.key.in_(packages.keys())))
+        if resources:
+            conditions.append(and_(totals.tracking_type == u'resource',
+                                   totals.key.in_(resources.keys())))
+        if not conditions:
+            return packages, resources
+        q = select([totals.tracking_type, totals.key, totals.running_total,
+                    totals.recent_views], or_(*conditions))
+        for tracking_type, key, running_total, recent_views in \
+                meta.Session.execute(q):
+            if tracking_type == u'page':
+                result = packages
+            else:
+                result = resources
+            result[key] = {'total': running_total, 'recent': recent_views}
+        return packages, resources
 
 meta.mapper(TrackingSummary, tracking_summary_table)
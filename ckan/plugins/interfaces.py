@@ -540,6 +540,19 @@ class IDatasetForm(Interface):
         format suitable for the form (optional)
         """
 
+    def db_to_form_trusted(self):
+        """
+        Returns True if the package dicts read from the database only need
+        the output transforms of the db_to_form_schema run on them when
+        shown, instead of the whole schema (optional).
+
+        Output transforms are converters which only change how valid data
+        is shown, marked with
+        ckan.lib.navl.dictization_functions.output_transform (for instance
+        ignore_missing or convert_from_tags). Plugins using their own
+        converters in the db_to_form_schema should mark them too.
+        """
+
     def check_data_dict(self, data_dict, schema=None):
         """
         Check if the return data is correct.
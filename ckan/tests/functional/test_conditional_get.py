@@ -0,0 +1,69 @@
+import json
+
+from nose.tools import assert_equal
+
+from ckan.lib.create_test_data import CreateTestData
+import ckan.model as model
+from ckan.tests import TestController
+
+
+class TestConditionalGet(TestController):
+
+    @classmethod
+    def setup_class(cls):
+        CreateTestData.create()
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+
+    def _not_modified(self, url):
+        res = self.app.get(url)
+        etag = res.header('ETag')
+        assert etag
+        res = self.app.get(url, headers={'If-None-Match': etag}, status=304)
+        assert_equal(res.body, '')
+        return etag
+
+    def test_package_read(self):
+        self._not_modified('/dataset/annakarenina')
+
+    def test_group_read(self):
+        self._not_modified('/group/david')
+
+    def test_package_show(self):
+        etag = self._not_modified(
+            '/api/action/package_show?id=annakarenina')
+        other = self.app.get('/api/action/package_show?id=warandpeace')
+        assert other.header('ETag') != etag
+
+    def test_group_show(self):
+        self._not_modified('/api/action/group_show?id=david')
+
+    def test_action_without_cache_key(self):
+        self._not_modified('/api/action/package_list')
+
+    def test_change_updates_etag(self):
+        url = '/api/action/package_show?id=warandpeace'
+        etag = self.app.get(url).header('ETag')
+        rev = model.repo.new_revision()
+        pkg = model.Package.by_name(u'warandpeace')
+        pkg.notes = u'Changed notes'
+        model.repo.commit_and_remove()
+        res = self.app.get(url, headers={'If-None-Match': etag})
+        assert_equal(res.status_int, 200)
+        assert res.header('ETag') != etag
+
+    def test_if_modified_since(self):
+        url = '/api/action/package_show?id=annakarenina'
+        last_modified = self.app.get(url).header('Last-Modified')
+        self.app.get(url, headers={'If-Modified-Since': last_modified},
+                     status=304)
+
+    def test_missing_id(self):
+        # reported by the action, as without conditional GETs
+        for action in ('package_show', 'group_show'):
+            res = self.app.get('/api/action/%s' % action, status=409)
+            assert not res.header('ETag', None)
+            error = json.loads(res.body)['error']
+            assert_equal(error['__type'], 'Validation Error')
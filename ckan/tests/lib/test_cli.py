@@ -1,14 +1,18 @@
 import os
 import csv
+import tempfile
+import datetime
 
 from nose.tools import assert_equal
+from nose.plugins.skip import SkipTest
 
 from ckan import model
-from ckan.lib.cli import ManageDb,SearchIndexCommand
+from ckan.lib.cli import ManageDb,SearchIndexCommand,Tracking
 from ckan.lib.create_test_data import CreateTestData
 from ckan.lib.helpers import json
 
 from ckan.lib.search import index_for,query_for
+from ckan.tests import is_migration_supported
 
 class TestDb:
     @classmethod
@@ -88,6 +92,26 @@ class TestSearch:
 
         assert self.query.count == pkg_count
 
+    def test_rebuild_in_batches(self):
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'rebuild.checkpoint')
+
+        self.search.args = ()
+        self.search.options = FakeOptions()
+        self.search.clear()
+
+        self.search.options = FakeOptions(only_missing=False, force=False,
+                                          refresh=False, batch_size=1,
+                                          workers=None, commit_every=1,
+                                          checkpoint=checkpoint)
+        self.search.rebuild()
+        pkg_count = model.Session.query(model.Package).filter(model.Package.state==u'active').count()
+
+        self.query.run({'q':'*:*'})
+
+        assert self.query.count == pkg_count
+        # removed once the rebuild has finished
+        assert not os.path.exists(checkpoint)
+
     def test_clear_and_rebuild_only_one(self):
 
         pkg_count = model.Session.query(model.Package).filter(model.Package.state==u'active').count()
@@ -109,3 +133,69 @@ class TestSearch:
         self.query.run({'q':'*:*'})
 
         assert self.query.count == pkg_count
+
+class TestTracking:
+    @classmethod
+    def setup_class(cls):
+        if not is_migration_supported():
+            raise SkipTest('Tracking tables are only created by migrations')
+        cls.tracking = Tracking('tracking')
+        cls.engine = model.meta.engine
+        CreateTestData.create()
+        cls._clean()
+
+    @classmethod
+    def teardown_class(cls):
+        cls._clean()
+        model.repo.rebuild_db()
+
+    @classmethod
+    def _clean(cls):
+        cls.engine.execute('''DELETE FROM tracking_raw;
+                              DELETE FROM tracking_raw_archive;
+                              DELETE FROM tracking_watermark;
+                              DELETE FROM tracking_summary;
+                              DELETE FROM tracking_total;''')
+
+    def _track(self, user_key, url, tracking_type, timestamp):
+        self.engine.execute('''INSERT INTO tracking_raw
+            (user_key, url, tracking_type, access_timestamp)
+            VALUES (%s, %s, %s, %s)''', user_key, url, tracking_type,
+            timestamp)
+
+    def test_incremental_update(self):
+        pkg = model.Package.by_name(u'annakarenina')
+        url = '/dataset/annakarenina'
+        resource_url = 'http://example.com/data.csv'
+        self._track('a', url, 'page', '2012-01-01 10:00')
+        self._track('a', url, 'page', '2012-01-01 11:00')
+        self._track('b', url, 'page', '2012-01-01 12:00')
+        self._track('a', resource_url, 'resource', '2012-01-01 12:00')
+        assert_equal(self.tracking.update_tracking(self.engine),
+                     datetime.date(2012, 1, 1))
+        assert_equal(model.TrackingSummary.get_for_package(pkg.id),
+                     {'total': 2, 'recent': 2})
+        assert_equal(model.TrackingSummary.get_for_resource(resource_url),
+                     {'total': 1, 'recent': 1})
+
+        self._track('c', url, 'page', '2012-01-05 10:00')
+        self.tracking.update_tracking(self.engine)
+        assert_equal(model.TrackingSummary.get_for_package(pkg.id),
+                     {'total': 3, 'recent': 3})
+        assert self.tracking.update_tracking(self.engine) is None
+
+        # the totals carry on without the archived data
+        assert_equal(self.tracking.archive_tracking(self.engine, 2), 4)
+        self._track('d', url, 'page', '2012-01-06 10:00')
+        self.tracking.update_tracking(self.engine)
+        assert_equal(model.TrackingSummary.get_for_package(pkg.id),
+                     {'total': 4, 'recent': 4})
+        assert_equal(model.TrackingSummary.get_for_resource(resource_url),
+                     {'total': 1, 'recent': 1})
+
+        # updating from a date before the archived data counts it again
+        self.tracking.update_tracking(self.engine, datetime.date(2012, 1, 1))
+        assert_equal(model.TrackingSummary.get_for_package(pkg.id),
+                     {'total': 4, 'recent': 4})
+        assert_equal(model.TrackingSummary.get_for_resource(resource_url),
+                     {'total': 1, 'recent': 1})
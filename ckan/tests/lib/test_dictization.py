@@ -5,9 +5,11 @@ from difflib import unified_diff
 from ckan.lib.create_test_data import CreateTestData
 from ckan import model
 from ckan.lib.dictization import (table_dictize,
+                              table_list_dictize,
                               table_dict_save)
 
 from ckan.lib.dictization.model_dictize import (package_dictize,
+                                                package_list_dictize,
                                                 resource_dictize,
                                                 group_dictize,
                                                 activity_dictize,
@@ -232,6 +234,41 @@ class TestBasicDictize:
         assert sorted(result.values()) == sorted(self.package_expected.values())
         assert result == self.package_expected
 
+    def test_02_package_list_dictize(self):
+
+        context = {"model": model,
+                   "session": model.Session}
+
+        model.Session.remove()
+        pkgs = model.Session.query(model.Package).order_by(model.Package.name).all()
+        pkg_revs = model.Session.query(model.PackageRevision)\
+            .filter_by(current=True).order_by(model.PackageRevision.name).all()
+        expected = [package_dictize(pkg, context) for pkg in pkgs]
+
+        assert_equal(package_list_dictize(pkgs, context), expected)
+        assert_equal(package_list_dictize(pkg_revs, context), expected)
+        assert_equal(package_list_dictize([], context), [])
+
+    def test_02_table_list_dictize(self):
+
+        context = {"model": model,
+                   "session": model.Session}
+
+        resources = model.Session.query(model.Resource).all()
+        expected = [table_dictize(res, context) for res in resources]
+        assert_equal(table_list_dictize(resources, context), expected)
+        assert_equal(context['metadata_modified'],
+                     max(res['revision_timestamp'] for res in expected))
+
+        rows = model.Session.execute(
+            model.resource_revision_table.select()).fetchall()
+        expected = [table_dictize(row, context) for row in rows]
+        dictized = table_list_dictize(rows, context)
+        assert_equal(dictized, expected)
+        assert 'continuity_id' not in dictized[0], dictized[0]
+
+        assert_equal(table_list_dictize([], context), [])
+
     def test_03_package_to_api1(self):
 
         context = {"model": model,
@@ -726,6 +763,21 @@ class TestBasicDictize:
 
         assert third_dictized == forth_dictized
 
+    def test_13_get_package_list_in_past(self):
+
+        context = {'model': model,
+                   'session': model.Session}
+
+        anna1 = model.Session.query(model.Package).filter_by(name='annakarenina_changed2').one()
+        pkgs = [anna1, model.Package.by_name(u'warandpeace')]
+        pkgrevisions = model.Session.query(model.PackageRevision).filter_by(id=anna1.id).all()
+        sorted_packages = sorted(pkgrevisions, key=lambda x:x.revision_timestamp)
+
+        for package_revision in sorted_packages:
+            context['revision_id'] = package_revision.revision_id
+            expected = [package_dictize(pkg, context) for pkg in pkgs]
+            assert_equal(package_list_dictize(pkgs, context), expected)
+
     def test_14_resource_no_id(self):
 
         context = {"model": model,
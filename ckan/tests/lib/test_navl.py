@@ -6,7 +6,12 @@ from ckan.lib.navl.dictization_functions import (flatten_schema,
                                    missing,
                                    augment_data,
                                    validate,
-                                   validate_flattened)
+                                   validate_flattened,
+                                   validate_trusted,
+                                   output_transform,
+                                   compile_schema,
+                                   transforms_schema,
+                                   copy_data)
 from pprint import pprint, pformat
 from ckan.lib.navl.validators import (identity_converter,
                         empty,
@@ -366,3 +371,110 @@ def test_range_validator():
 
 
 
+
+
+def test_compiled_schema():
+
+    schema = {
+        "name": [not_empty, unicode],
+        "numbers": {
+            "number": [convert_int],
+        },
+    }
+
+    # keys added to a schema after it is used are seen by the next
+    # validation
+    compile_schema(schema)
+    schema["age"] = [default(1), convert_int]
+    assert ("age",) in compile_schema(schema).flattened_schema
+    assert transforms_schema(schema)["age"] == []
+
+    data = {"name": "fred", "numbers": [{"number": "1"}, {"number": "2"}]}
+    for i in range(2):
+        converted_data, errors = validate(data, schema)
+        assert not errors, errors
+        assert converted_data == {'name': u'fred', 'age': 1,
+                                  'numbers': [{'number': 1}, {'number': 2}]}
+
+    ## changing the validators of a key is seen by the compiled schema
+    schema["name"][:] = [default("weee")]
+    converted_data, errors = validate({}, schema)
+    assert not errors, errors
+    assert converted_data == {'name': 'weee', 'age': 1}, converted_data
+
+
+def test_copy_data():
+
+    data = {
+        ('name',): u'fred',
+        ('age',): 32,
+        ('tags',): [u'a', u'b'],
+        ('extras',): {u'key': u'value'},
+    }
+
+    copied_data = copy_data(data)
+
+    assert copied_data == data
+    assert copied_data[('name',)] is data[('name',)]
+    assert copied_data[('tags',)] is not data[('tags',)]
+    assert copied_data[('extras',)] is not data[('extras',)]
+
+
+def test_converters_are_called_the_same_way_again():
+
+    calls = []
+
+    def value_and_context(value, context):
+        calls.append(value)
+        return value.upper()
+
+    schema = {
+        "name": [value_and_context],
+    }
+
+    for name in ("fred", "bob"):
+        converted_data, errors = validate({"name": name}, schema)
+        assert not errors, errors
+        assert converted_data == {"name": name.upper()}, converted_data
+
+    assert calls == ["fred", "bob"], calls
+
+
+def test_validate_trusted():
+
+    checked = []
+
+    def check(value, context):
+        checked.append(value)
+        return value
+
+    @output_transform
+    def upper(value, context):
+        return value.upper()
+
+    schema = {
+        "name": [not_empty, check, upper],
+        "age": [ignore_missing, check],
+        "secret": [ignore],
+        "numbers": {
+            "number": [check, upper],
+            "__extras": [ignore],
+        },
+        "__extras": [ignore],
+    }
+
+    data = {"name": "fred",
+            "secret": "shh",
+            "other": "dropped",
+            "numbers": [{"number": "one", "code": "+44"}]}
+
+    converted_data = validate_trusted(data, schema)
+
+    assert converted_data == {'name': 'FRED',
+                              'numbers': [{'number': 'ONE'}]}, converted_data
+    assert not checked, checked
+
+    converted_data, errors = validate(data, schema)
+    assert converted_data == {'name': 'FRED',
+                              'numbers': [{'number': 'ONE'}]}, converted_data
+    assert checked == ['fred', 'one'], checked
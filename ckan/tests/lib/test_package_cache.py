@@ -0,0 +1,113 @@
+import time
+
+from nose.tools import assert_equal
+from pylons import config
+
+from ckan import model
+from ckan.lib.create_test_data import CreateTestData
+from ckan.lib.package_cache import (PackageCache, get_package_cache,
+                                    reset_package_cache)
+import ckan.logic as logic
+
+
+class TestPackageCache:
+
+    def test_get_set(self):
+        cache = PackageCache(size=10, ttl=60)
+        assert cache.get('a', 'show') is None
+        cache.set('a', 'show', {'name': 'a'})
+        assert_equal(cache.get('a', 'show'), {'name': 'a'})
+        assert cache.get('a', 'view') is None
+        assert_equal(cache.stats(), {'hits': 1, 'shared_hits': 0,
+                                     'misses': 2, 'invalidations': 0})
+
+    def test_size_and_ttl(self):
+        cache = PackageCache(size=1, ttl=60)
+        cache.set('a', 'show', 1)
+        cache.set('b', 'show', 2)
+        assert cache.get('a', 'show') is None
+        cache = PackageCache(size=10, ttl=0)
+        cache.set('a', 'show', 1)
+        time.sleep(0.01)
+        assert cache.get('a', 'show') is None
+
+    def test_invalidate(self):
+        cache = PackageCache(size=10, ttl=60)
+        cache.set('a', 'show', 1)
+        cache.set('a', 'view', 2)
+        cache.set('b', 'show', 3)
+        cache.invalidate('a')
+        assert cache.get('a', 'show') is None
+        assert cache.get('a', 'view') is None
+        assert_equal(cache.get('b', 'show'), 3)
+
+
+class TestPackageShowCache:
+
+    @classmethod
+    def setup_class(cls):
+        CreateTestData.create()
+        cls.original_backend = config.get('ckan.package_cache')
+        config['ckan.package_cache'] = 'memory'
+        reset_package_cache()
+
+    @classmethod
+    def teardown_class(cls):
+        if cls.original_backend is None:
+            del config['ckan.package_cache']
+        else:
+            config['ckan.package_cache'] = cls.original_backend
+        reset_package_cache()
+        model.repo.rebuild_db()
+
+    def _package_show(self, **context):
+        context.update({'model': model, 'ignore_auth': True})
+        return logic.get_action('package_show')(
+            context, {'id': u'annakarenina'})
+
+    def test_package_show(self):
+        cache = get_package_cache()
+        first = self._package_show()
+        hits = cache.stats()['hits']
+        assert_equal(self._package_show(), first)
+        assert_equal(cache.stats()['hits'], hits + 1)
+
+        # other variants are cached separately
+        self._package_show(validate=False)
+        assert_equal(cache.stats()['hits'], hits + 1)
+
+        # changes to related objects invalidate the cached dicts
+        model.repo.new_revision()
+        pkg = model.Package.by_name(u'annakarenina')
+        pkg.resources[0].description = u'A new description'
+        model.repo.commit_and_remove()
+        assert_equal(self._package_show()['resources'][0]['description'],
+                     u'A new description')
+        assert_equal(cache.stats()['hits'], hits + 1)
+
+    def test_variants_by_user_and_schema(self):
+        cache = get_package_cache()
+        self._package_show()
+        misses = cache.stats()['misses']
+        context = {'model': model, 'user': u'annafan'}
+        logic.get_action('package_show')(context, {'id': u'annakarenina'})
+        assert_equal(cache.stats()['misses'], misses + 1)
+
+        # dicts for a schema given by the caller are not cached
+        stats = cache.stats()
+        self._package_show(schema={'name': []})
+        self._package_show(schema={'name': []})
+        assert_equal(cache.stats(), stats)
+
+    def test_invalidated_after_commit(self):
+        cache = get_package_cache()
+        self._package_show()
+        invalidations = cache.stats()['invalidations']
+        model.repo.new_revision()
+        pkg = model.Package.by_name(u'annakarenina')
+        pkg.notes = u'Changed notes'
+        model.Session.flush()
+        assert_equal(cache.stats()['invalidations'], invalidations)
+        model.repo.commit_and_remove()
+        assert_equal(cache.stats()['invalidations'], invalidations + 1)
+        assert_equal(self._package_show()['notes'], u'Changed notes')
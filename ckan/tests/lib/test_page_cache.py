@@ -0,0 +1,156 @@
+from nose.tools import assert_equal
+from nose.plugins.skip import SkipTest
+
+from ckan import model
+from ckan.model.meta import CkanCacheExtension
+import ckan.lib.page_cache as page_cache
+from ckan.lib.page_cache import object_tags, PageCache
+
+
+class TestObjectTags:
+
+    def test_package(self):
+        pkg = model.Package(name=u'test')
+        pkg.id = u'pkg-id'
+        assert_equal(object_tags(pkg), ['package', 'package:pkg-id'])
+
+    def test_member(self):
+        member = model.Member(group_id=u'group-id', table_id=u'pkg-id',
+                              table_name=u'package')
+        assert_equal(object_tags(member),
+                     ['group', 'group:group-id', 'package:pkg-id'])
+
+    def test_activity(self):
+        activity = model.Activity(u'user-id', u'pkg-id', u'revision-id',
+                                  u'changed package')
+        assert_equal(object_tags(activity),
+                     ['user:user-id', 'package:pkg-id'])
+
+    def test_other_objects(self):
+        assert_equal(object_tags(model.TaskStatus()), [])
+
+
+class FakeRedis(object):
+    '''The Redis commands used by the page cache, in memory.'''
+
+    def __init__(self):
+        self.data = {}
+        self.calls = None
+
+    def pipeline(self):
+        pipe = FakeRedis()
+        pipe.data = self.data
+        pipe.calls = []
+        return pipe
+
+    def __getattr__(self, name):
+        command = getattr(self, '_' + name)
+        if self.calls is None:
+            return command
+        return lambda *args: self.calls.append((command, args))
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [command(*args) for command, args in calls]
+
+    def _delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def _rpush(self, key, value):
+        self.data.setdefault(key, []).append(value)
+
+    def _lrange(self, key, start, end):
+        return self.data.get(key, [])[start:end + 1]
+
+    def _expire(self, key, ttl):
+        pass
+
+    def _sadd(self, key, value):
+        self.data.setdefault(key, set()).add(value)
+
+    def _smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def _zadd(self, key, score, value):
+        self.data.setdefault(key, {})[value] = score
+
+    def _zremrangebyscore(self, key, low, high):
+        items = self.data.get(key, {})
+        for value, score in items.items():
+            if score <= high:
+                del items[value]
+
+    def _zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    def _zrange(self, key, start, end):
+        items = self.data.get(key, {})
+        return sorted(items, key=items.get)[start:end + 1]
+
+    def _zrem(self, key, *values):
+        for value in values:
+            self.data.get(key, {}).pop(value, None)
+
+
+class FakeSession(object):
+
+    def __init__(self, **object_cache):
+        self._object_cache = object_cache
+
+    def flush(self):
+        pass
+
+
+class TestPageCache:
+
+    def setup(self):
+        try:
+            self.cache = PageCache(size=2, ttl=60)
+        except ImportError:
+            raise SkipTest('redis is not installed')
+        self.cache._connection = FakeRedis()
+
+    def teardown(self):
+        page_cache._page_cache = None
+
+    def _set(self, key, *tags):
+        self.cache.set(key, '200 OK', [], 'page %s' % key, tags)
+
+    def test_size(self):
+        self._set('a')
+        self._set('b')
+        # storing a page again doesn't add it to the index twice
+        self._set('a')
+        self._set('c')
+        assert self.cache.get('a')
+        assert self.cache.get('b') is None
+        assert self.cache.get('c')
+
+    def test_invalidate(self):
+        self._set('a', 'package:1')
+        self._set('b', 'package:2')
+        self.cache.invalidate(['package:1'])
+        assert self.cache.get('a') is None
+        assert_equal(self.cache.get('b'), ('200 OK', [], 'page b'))
+        assert_equal(self.cache.stats()['invalidations'], 1)
+        # the removed page no longer counts towards the size
+        self._set('c')
+        assert self.cache.get('b')
+
+    def test_session_extension(self):
+        page_cache._page_cache = self.cache
+        self._set('a', 'package:pkg-id')
+        self._set('b', 'group:group-id')
+        pkg = model.Package(name=u'test')
+        pkg.id = u'pkg-id'
+        session = FakeSession(new=set(), changed=set([pkg]), deleted=set())
+
+        extension = CkanCacheExtension()
+        extension.use_redis = True
+        extension.before_commit(session)
+        # the pages are removed only once the change is committed
+        assert self.cache.get('a')
+        extension.after_commit(session)
+        assert self.cache.get('a') is None
+        assert self.cache.get('b')
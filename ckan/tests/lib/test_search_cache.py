@@ -0,0 +1,55 @@
+import time
+
+from nose.tools import assert_equal
+
+from ckan.lib.search.cache import make_key, MemoryQueryCache
+
+
+class TestQueryCacheKey:
+
+    def test_equivalent_queries(self):
+        assert_equal(make_key({'q': 'test', 'fq': '+groups:a  +tags:b'}),
+                     make_key({'fq': ' +groups:a +tags:b', 'q': 'test'}))
+
+    def test_different_queries(self):
+        assert make_key({'q': 'test', 'rows': 10}) != \
+            make_key({'q': 'test', 'rows': 20})
+
+    def test_facet_fields(self):
+        assert_equal(make_key({'facet.field': ['tags', 'groups']}),
+                     make_key({'facet.field': ['groups', 'tags']}))
+
+
+class TestMemoryQueryCache:
+
+    def test_get_set(self):
+        cache = MemoryQueryCache(size=10, ttl=60)
+        assert cache.get('a') is None
+        cache.set('a', {'count': 1})
+        assert_equal(cache.get('a'), {'count': 1})
+        assert_equal(cache.stats(),
+                     {'hits': 1, 'misses': 1, 'invalidations': 0})
+
+    def test_size(self):
+        cache = MemoryQueryCache(size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        # b was the least recently used
+        assert cache.get('b') is None
+        assert_equal(cache.get('a'), 1)
+        assert_equal(cache.get('c'), 3)
+
+    def test_ttl(self):
+        cache = MemoryQueryCache(size=10, ttl=0)
+        cache.set('a', 1)
+        time.sleep(0.01)
+        assert cache.get('a') is None
+
+    def test_invalidate(self):
+        cache = MemoryQueryCache(size=10, ttl=60)
+        cache.set('a', 1)
+        cache.invalidate()
+        assert cache.get('a') is None
+        assert_equal(cache.stats()['invalidations'], 1)
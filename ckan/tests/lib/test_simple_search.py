@@ -33,3 +33,44 @@ class TestSimpleSearch:
         # This is the default query from the search page
         res = PackageSearchQuery().run({'q': u''})
         assert res['count'] >= 2, res['count']
+
+    def test_run_query_text_terms(self):
+        res = PackageSearchQuery().run({'q': u'novel tolstoy'})
+        anna = model.Package.by_name(u'annakarenina')
+        assert_equal(res['results'], [anna.id])
+
+    def test_run_query_filters(self):
+        war = model.Package.by_name(u'warandpeace')
+        res = PackageSearchQuery().run({'q': u'tags:russian',
+                                        'fq': u'-groups:roger',
+                                        'fl': 'name'})
+        assert_equal(res, {'results': [war.name], 'count': 1})
+        res = PackageSearchQuery().run({'q': u'genre:"romantic novel"',
+                                        'fl': 'name'})
+        assert_equal(res['results'], [u'annakarenina'])
+        res = PackageSearchQuery().run({'fq': u'+res_format:json',
+                                        'fl': 'name'})
+        assert_equal(res['results'], [u'annakarenina'])
+
+    def test_run_query_sort_and_paging(self):
+        query = {'q': u'tags:russian', 'fl': 'name', 'sort': 'name desc'}
+        res = PackageSearchQuery().run(query)
+        assert_equal(res['results'], [u'warandpeace', u'annakarenina'])
+        query.update({'rows': 1, 'start': 1})
+        res = PackageSearchQuery().run(query)
+        assert_equal(res, {'results': [u'annakarenina'], 'count': 2})
+
+    def test_run_query_facets(self):
+        query = PackageSearchQuery()
+        res = query.run({'q': u'tags:russian',
+                         'facet.field': ['groups', 'tags', 'res_format',
+                                         'license_id', 'unknown']})
+        assert_equal(res['count'], 2)
+        assert_equal(query.facets['groups'], {u'david': 2, u'roger': 1})
+        assert_equal(query.facets['tags'][u'tolstoy'], 1)
+        assert_equal(query.facets['tags'][u'russian'], 2)
+        assert_equal(query.facets['res_format'],
+                     {u'plain text': 1, u'json': 1})
+        assert_equal(query.facets['license_id'],
+                     {u'other-open': 1, u'cc-nc': 1})
+        assert_equal(query.facets['unknown'], {})
@@ -214,6 +214,30 @@ class TestSearch(TestController):
         assert len(pkgs) == 2, pkgs
         assert pkgs == all_pkgs[4:6]
 
+    def test_cursor_pagination(self):
+        all_results = search.query_for(model.Package).run(
+            {'q': self.q_all, 'fl': 'id', 'sort': 'id asc'})
+        all_ids = all_results['results']
+
+        ids = []
+        cursor = ''
+        while cursor is not None:
+            result = search.query_for(model.Package).run(
+                {'q': self.q_all, 'fl': 'id', 'rows': 2, 'cursor': cursor})
+            assert len(result['results']) <= 2, result['results']
+            # count is the number of results left
+            assert result['count'] == all_results['count'] - len(ids)
+            ids.extend(result['results'])
+            cursor = result['next_cursor']
+        assert ids == all_ids, (ids, all_ids)
+
+    def test_iter_packages(self):
+        names = [pkg['name'] for pkg in
+                 search.iter_packages(q=self.q_all, page_size=2)]
+        all_results = search.query_for(model.Package).run(
+            {'q': self.q_all, 'rows': 100})
+        assert sorted(names) == sorted(all_results['results']), names
+
     def test_order_by(self):
         # TODO: fix this test
         #
@@ -2,9 +2,11 @@ from datetime import datetime
 import hashlib
 import socket
 import solr
+from nose.tools import assert_equal
 from pylons import config
 from ckan import model
 import ckan.lib.search as search
+from ckan.lib.search.index import IndexingContext
 from ckan.tests import TestController, CreateTestData, setup_test_search_index, is_search_supported
 
 class TestSolrConfig(TestController):
@@ -28,6 +30,20 @@ class TestSolrConfig(TestController):
             else:
                 raise AssertionError('SOLR connection problem. Connection defined in development.ini as: solr_url=%s Error: %s' % (config['solr_url'], e))
 
+    def test_connections_are_reused(self):
+        if not is_search_supported():
+            from nose import SkipTest
+            raise SkipTest("Search not supported")
+
+        conn = search.make_connection()
+        conn.query("*:*", rows=1)
+        conn.close()
+        hits = search.connection_pool_stats()['hits']
+        conn = search.make_connection()
+        conn.query("*:*", rows=1)
+        conn.close()
+        assert search.connection_pool_stats()['hits'] == hits + 1
+
 
 class TestSolrSearchIndex(TestController):
     """
@@ -101,6 +117,20 @@ class TestSolrSearchIndex(TestController):
         response = self.solr.query('title:penguin', fq=self.fq)
         assert len(response) == 0
 
+    def test_index_packages_deferred_commit(self):
+        pkg_dicts = [{
+            'id': u'penguin-%i' % i,
+            'title': u'penguin %i' % i,
+            'state': u'active',
+            'metadata_created': datetime.now().isoformat(),
+            'metadata_modified': datetime.now().isoformat(),
+        } for i in range(3)]
+        package_index = search.index_for('Package')
+        package_index.index_packages(pkg_dicts, defer_commit=True)
+        package_index.commit()
+        response = self.solr.query('title:penguin', fq=self.fq)
+        assert len(response) == 3, len(response)
+
     def test_index_illegal_xml_chars(self):
 
         pkg_dict = {
@@ -118,6 +148,101 @@ class TestSolrSearchIndex(TestController):
         assert response.results[0]['title'] == u'\u00c3altimo n\u00famero penguin'
 
 
+class TestSolrBatchedIndexing:
+    """
+    Tests the batched indexing used by rebuild: deferred commits and the
+    data looked up once for each batch.
+    """
+    @classmethod
+    def setup_class(cls):
+        if not is_search_supported():
+            from nose import SkipTest
+            raise SkipTest("Search not supported")
+        setup_test_search_index()
+        CreateTestData.create()
+        cls.solr = search.make_connection()
+        cls.fq = " +site_id:\"%s\" " % config['ckan.site_id']
+        cls.package_index = search.index_for('Package')
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+        cls.solr.close()
+
+    def teardown(self):
+        self.package_index.clear()
+
+    def _pkg_dict(self, i, state=u'active'):
+        return {
+            'id': u'penguin-%i' % i,
+            'name': u'penguin-%i' % i,
+            'title': u'penguin %i' % i,
+            'state': state,
+            'metadata_created': datetime.now().isoformat(),
+            'metadata_modified': datetime.now().isoformat(),
+        }
+
+    def _count(self):
+        return len(self.solr.query('title:penguin', fq=self.fq))
+
+    def test_index_packages_deferred_commit(self):
+        self.package_index.index_packages(
+            [self._pkg_dict(i) for i in range(3)], defer_commit=True)
+        assert_equal(self._count(), 0)
+        self.package_index.commit()
+        assert_equal(self._count(), 3)
+
+        # inactive packages in a batch are removed from the index
+        self.package_index.index_packages(
+            [self._pkg_dict(0, state=u'deleted'), self._pkg_dict(3)],
+            defer_commit=True)
+        assert_equal(self._count(), 3)
+        self.package_index.commit()
+        assert_equal(self._count(), 3)
+        ids = sorted(r['id'] for r in
+                     self.solr.query('title:penguin', fq=self.fq).results)
+        assert_equal(ids, [u'penguin-1', u'penguin-2', u'penguin-3'])
+
+    def test_delete_package_deferred_commit(self):
+        self.package_index.index_package(self._pkg_dict(0))
+        assert_equal(self._count(), 1)
+        self.package_index.delete_package(self._pkg_dict(0),
+                                          defer_commit=True)
+        assert_equal(self._count(), 1)
+        self.package_index.commit()
+        assert_equal(self._count(), 0)
+
+    def test_indexing_context(self):
+        anna = model.Package.by_name(u'annakarenina')
+        war = model.Package.by_name(u'warandpeace')
+        pkg_dicts = [
+            {'relationships_as_subject': [{'object_package_id': war.id}],
+             'relationships_as_object': []},
+            None,
+            {'relationships_as_object': [{'subject_package_id': anna.id}]},
+        ]
+        indexing_context = IndexingContext(pkg_dicts)
+        assert_equal(indexing_context.package_names,
+                     {war.id: u'warandpeace', anna.id: u'annakarenina'})
+
+        # packages flushed but not committed yet are found too, and names
+        # not looked up for the batch are fetched when asked for
+        model.repo.new_revision()
+        pkg = model.Package(name=u'penguin-pending')
+        model.Session.add(pkg)
+        model.Session.flush()
+        try:
+            indexing_context = IndexingContext([
+                {'relationships_as_subject': [{'object_package_id': pkg.id}]}])
+            assert_equal(indexing_context.package_name(pkg.id),
+                         u'penguin-pending')
+            assert_equal(IndexingContext([]).package_name(pkg.id),
+                         u'penguin-pending')
+        finally:
+            model.Session.rollback()
+            model.Session.remove()
+
+
 class TestSolrSearch:
     @classmethod
     def setup_class(cls):
@@ -141,6 +266,30 @@ class TestSolrSearch:
         results = self.solr.query('*:*', fq=self.fq)
         assert len(results) == 6, len(results)
 
+    def test_0_indexing_batches(self):
+        search.rebuild(batch_size=4, commit_every=2)
+        results = self.solr.query('*:*', fq=self.fq)
+        assert len(results) == 6, len(results)
+
+    def test_0_reconcile(self):
+        pkg = model.Package.by_name(u'se-opengov')
+        search.clear(pkg.id)
+        orphan = {
+            'id': u'orphan-id',
+            'title': u'orphan',
+            'state': u'active',
+            'metadata_created': datetime.now().isoformat(),
+            'metadata_modified': datetime.now().isoformat(),
+        }
+        search.index_for('Package').index_package(orphan)
+        assert_equal(list(search.reconcile(chunk_size=2)),
+                     [('missing', pkg.id), ('orphaned', u'orphan-id')])
+
+        search.rebuild(only_missing=True)
+        assert_equal(list(search.reconcile()), [])
+        results = self.solr.query('*:*', fq=self.fq)
+        assert len(results) == 6, len(results)
+
     def test_1_basic(self):
         results = self.solr.query('sweden', fq=self.fq)
         assert len(results) == 2
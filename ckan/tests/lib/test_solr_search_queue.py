@@ -0,0 +1,63 @@
+from ckan import model
+from ckan import plugins
+import ckan.lib.search as search
+
+from ckan.tests import CreateTestData, setup_test_search_index
+
+
+class TestSearchIndexQueue:
+    '''Changes to datasets are only indexed once the queue is processed
+    when using the asynchronous_search plugin.
+    '''
+
+    @classmethod
+    def setup_class(cls):
+        setup_test_search_index()
+        plugins.unload('synchronous_search')
+        plugins.load('asynchronous_search')
+
+    @classmethod
+    def teardown_class(cls):
+        plugins.unload('asynchronous_search')
+        plugins.load('synchronous_search')
+        model.repo.rebuild_db()
+        search.clear()
+
+    def _indexed_names(self):
+        return search.query_for(model.Package).get_all_entity_ids()
+
+    def test_changes_are_queued(self):
+        CreateTestData.create_arbitrary([{'name': u'queued-dataset'}])
+        pkg = model.Package.by_name(u'queued-dataset')
+        assert pkg.id not in self._indexed_names()
+        assert model.SearchIndexQueue.count() > 0
+
+        search.process_queue()
+        assert pkg.id in self._indexed_names()
+        assert model.SearchIndexQueue.count() == 0
+
+    def test_repeated_changes_are_collapsed(self):
+        CreateTestData.create_arbitrary([{'name': u'edited-dataset'}])
+        for title in (u'First', u'Second'):
+            rev = model.repo.new_revision()
+            pkg = model.Package.by_name(u'edited-dataset')
+            pkg.title = title
+            model.repo.commit_and_remove()
+        assert model.SearchIndexQueue.count() >= 3
+
+        search.process_queue()
+        index = search.show(u'edited-dataset')
+        assert index['title'] == u'Second', index['title']
+
+    def test_purged_dataset_is_removed(self):
+        CreateTestData.create_arbitrary([{'name': u'purged-dataset'}])
+        search.process_queue()
+        pkg = model.Package.by_name(u'purged-dataset')
+        pkg_id = pkg.id
+        assert pkg_id in self._indexed_names()
+
+        rev = model.repo.new_revision()
+        pkg.purge()
+        model.repo.commit_and_remove()
+        search.process_queue()
+        assert pkg_id not in self._indexed_names()
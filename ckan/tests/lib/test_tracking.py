@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+
+import sqlalchemy as sa
+from nose.tools import assert_equal
+
+from ckan.lib.tracking import TrackingBuffer, INSERT_ROWS
+
+
+class TestTrackingBuffer:
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = sa.create_engine(
+            'sqlite:///%s' % os.path.join(self.dir, 'tracking.db'))
+        self.engine.execute('''CREATE TABLE tracking_raw (
+            user_key varchar(100) NOT NULL,
+            url text NOT NULL,
+            tracking_type varchar(10) NOT NULL,
+            access_timestamp timestamp)''')
+
+    def teardown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def _rows(self):
+        return self.engine.execute(
+            'SELECT user_key, url, tracking_type FROM tracking_raw '
+            'ORDER BY url').fetchall()
+
+    def test_flush(self):
+        buffer = TrackingBuffer(self.engine, size=10, flush_size=2,
+                                flush_interval=0)
+        buffer.add('a', '/dataset/1', 'page')
+        buffer.add('b', '/dataset/2', 'page')
+        buffer.add('c', '/dataset/3.csv', 'resource')
+        assert_equal(buffer.stats()['buffered'], 3)
+        assert_equal(buffer.flush(), 3)
+        assert_equal([tuple(row) for row in self._rows()],
+                     [('a', '/dataset/1', 'page'),
+                      ('b', '/dataset/2', 'page'),
+                      ('c', '/dataset/3.csv', 'resource')])
+        stats = buffer.stats()
+        assert_equal((stats['events'], stats['written'], stats['buffered']),
+                     (3, 3, 0))
+
+    def test_flush_more_rows_than_bind_parameters(self):
+        # the default flush_size has more parameters than SQLite allows in
+        # a statement, so the rows are inserted in several statements
+        events = INSERT_ROWS * 2 + 1
+        buffer = TrackingBuffer(self.engine, size=events, flush_size=events,
+                                flush_interval=0)
+        for i in range(events):
+            buffer.add('a', '/dataset/%i' % i, 'page')
+        assert_equal(buffer.flush(), events)
+        assert_equal(len(self._rows()), events)
+        assert_equal(buffer.stats()['flush_errors'], 0)
+
+    def test_full_buffer_drops_events(self):
+        buffer = TrackingBuffer(self.engine, size=1, flush_size=10,
+                                flush_interval=0)
+        buffer.add('a', '/dataset/1', 'page')
+        buffer.add('b', '/dataset/2', 'page')
+        assert_equal(buffer.stats()['dropped'], 1)
+        assert_equal(buffer.flush(), 1)
+
+    def test_spool(self):
+        buffer = TrackingBuffer(self.engine, size=1, flush_size=10,
+                                flush_interval=0, spool_dir=self.dir)
+        buffer.add('a', '/dataset/1', 'page')
+        buffer.add('b', '/dataset/2', 'page')
+        assert_equal(buffer.stats()['spooled'], 1)
+
+        self.engine.execute('ALTER TABLE tracking_raw RENAME TO moved')
+        assert_equal(buffer.flush(), 0)
+        stats = buffer.stats()
+        assert_equal((stats['spooled'], stats['flush_errors']), (2, 1))
+
+        self.engine.execute('ALTER TABLE moved RENAME TO tracking_raw')
+        assert_equal(buffer.flush(), 2)
+        assert_equal(len(self._rows()), 2)
+        assert not [name for name in os.listdir(self.dir)
+                    if name.startswith('tracking-')]
@@ -1,4 +1,5 @@
 import re
+import datetime
 import json
 from pprint import pprint
 from nose.tools import assert_equal, assert_raises
@@ -13,7 +14,7 @@ from ckan.tests import WsgiAppCase
 from ckan.tests.functional.api import assert_dicts_equal_ignoring_ordering
 from ckan.tests import setup_test_search_index, search_related
 from ckan.tests import StatusCodes
-from ckan.logic import get_action, NotAuthorized
+from ckan.logic import get_action, NotAuthorized, ValidationError
 from ckan.logic.action import get_domain_object
 from ckan.tests import TestRoles
 
@@ -1120,6 +1121,112 @@ class TestActionTermTranslation(WsgiAppCase):
 
 
 
+class TestActionPackageMany(WsgiAppCase):
+
+    @classmethod
+    def setup_class(self):
+        CreateTestData.create()
+        self.sysadmin_user = model.User.get('testsysadmin')
+
+    @classmethod
+    def teardown_class(self):
+        model.repo.rebuild_db()
+
+    def _post(self, action, data):
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/%s' % action, params=postparams,
+                            extra_environ={'Authorization': str(self.sysadmin_user.apikey)},
+                            status=200)
+        return json.loads(res.body)['result']
+
+    def test_1_create_many(self):
+        revisions = model.Session.query(model.Revision).count()
+        results = self._post('package_create_many', {'data': [
+            {'name': u'many-1', 'tags': [{'name': u'manytag'}],
+             'groups': [{'name': u'david'}]},
+            {'name': u'many-2', 'tags': [{'name': u'manytag'}],
+             'groups': [{'name': u'david'}]},
+            {'name': u'annakarenina'},
+            {'name': u'many-1'},
+            {'name': u'many-3', 'url': u'http://example.com'},
+        ]})
+
+        assert [result['success'] for result in results] == \
+            [True, True, False, False, True], results
+        assert results[0]['result']['name'] == u'many-1'
+        assert results[2]['error']['__type'] == 'Validation Error'
+        assert 'name' in results[2]['error'], results[2]
+        assert 'name' in results[3]['error'], results[3]
+
+        # a single revision for the whole batch
+        assert model.Session.query(model.Revision).count() == revisions + 1
+
+        # the new tag is shared by both datasets
+        tag = model.Tag.by_name(u'manytag')
+        assert set(pkg.name for pkg in tag.packages) == \
+            set([u'many-1', u'many-2'])
+        assert u'david' in [group.name for group in
+                            model.Package.by_name(u'many-2').get_groups()]
+
+    def test_2_update_many(self):
+        results = self._post('package_update_many', {'data': [
+            {'id': u'many-1', 'name': u'many-1', 'title': u'Many one'},
+            {'name': u'many-2', 'title': u'Many two'},
+            {'id': u'many-missing', 'name': u'many-missing'},
+            {'id': u'many-1', 'name': u'many-1', 'title': u'Twice'},
+        ]})
+
+        assert [result['success'] for result in results] == \
+            [True, True, False, False], results
+        assert results[2]['error']['__type'] == 'Not Found Error'
+        assert results[3]['error']['__type'] == 'Validation Error'
+        assert model.Package.by_name(u'many-1').title == u'Many one'
+        assert model.Package.by_name(u'many-2').title == u'Many two'
+
+
+class TestActionActivityList(WsgiAppCase):
+
+    @classmethod
+    def setup_class(self):
+        CreateTestData.create()
+        self.object_id = u'activity-test-object'
+        # two activities at each time, to page through ties
+        for i in range(6):
+            activity = model.Activity(u'activity-test-user', self.object_id,
+                                      None, u'changed package')
+            activity.timestamp = datetime.datetime(2012, 1, 1, 12, i / 2)
+            model.Session.add(activity)
+        model.Session.commit()
+
+    @classmethod
+    def teardown_class(self):
+        model.repo.rebuild_db()
+
+    def _list(self, **data_dict):
+        data_dict['id'] = self.object_id
+        context = {'model': model, 'session': model.Session, 'user': u''}
+        return get_action('package_activity_list')(context, data_dict)
+
+    def test_1_pages(self):
+        everything = [activity['id'] for activity in self._list()]
+        assert len(everything) == 6, everything
+
+        pages = []
+        before = None
+        while True:
+            page = self._list(limit=4, before=before)
+            if not page:
+                break
+            assert len(page) <= 4
+            pages.extend([activity['id'] for activity in page])
+            before = page[-1]['id']
+        assert_equal(pages, everything)
+
+    def test_2_bad_params(self):
+        assert_raises(ValidationError, self._list, limit=u'x')
+        assert_raises(ValidationError, self._list, limit=0)
+        assert_raises(ValidationError, self._list, before=u'no-such-activity')
+
 class TestActionPackageSearch(WsgiAppCase):
 
     @classmethod
@@ -1210,6 +1317,28 @@ class TestActionPackageSearch(WsgiAppCase):
         result_names = [r['name'] for r in result['results']]
         assert result_names == ['warandpeace', 'annakarenina'], result_names
 
+    def test_5_index_only_datasets_are_ignored(self):
+        # a dataset that is in the index but not in the database
+        pkg_dict = {
+            'id': u'index-only-id',
+            'name': u'index-only',
+            'title': u'index only dataset',
+            'state': u'active',
+            'metadata_created': u'2012-01-01T00:00:00',
+            'metadata_modified': u'2012-01-01T00:00:00',
+        }
+        ckan.lib.search.index_for('Package').index_package(pkg_dict)
+        search_params = '%s=1' % json.dumps({'q': '*:*', 'rows': 20})
+        try:
+            res = self.app.post('/api/action/package_search',
+                                params=search_params)
+            result = json.loads(res.body)['result']
+            result_names = [r['name'] for r in result['results']]
+            assert 'index-only' not in result_names, result_names
+            assert 'annakarenina' in result_names, result_names
+        finally:
+            ckan.lib.search.clear('index-only-id')
+
 class MockPackageSearchPlugin(SingletonPlugin):
     implements(IPackageController, inherit=True)
 
@@ -68,6 +68,30 @@ class TestGroup(object):
         assert_equal(search_results('Books'), set(['david', 'roger']))
 
 
+    def test_4_display_names(self):
+        david = model.Group.by_name(u'david')
+        display_names = model.Group.get_display_names(
+            [u'david', david.id, u'unknown'])
+        assert_equal(display_names, {u'david': u'Dave\'s books',
+                                     david.id: u'Dave\'s books'})
+
+        # the cache is cleared when a group is modified
+        model.repo.new_revision()
+        david.title = u'Dave\'s new books'
+        model.repo.commit_and_remove()
+        display_names = model.Group.get_display_names([u'david'])
+        assert_equal(display_names, {u'david': u'Dave\'s new books'})
+
+    def test_5_package_counts(self):
+        groups = model.Session.query(model.Group).all()
+        for with_private in (False, True):
+            counts = model.Group.get_package_counts(
+                [group.id for group in groups], with_private=with_private)
+            for group in groups:
+                packages = group.active_packages(with_private=with_private)
+                assert_equal(counts[group.id], len(packages.all()))
+        assert_equal(model.Group.get_package_counts([]), {})
+
 class TestGroupRevisions:
     @classmethod
     def setup_class(self):
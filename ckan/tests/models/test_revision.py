@@ -42,3 +42,32 @@ class TestRevision:
         assert_equal(rev_dict['message'], self.rev.message)
         assert_equal(rev_dict['packages'], [u'testpkg'])
         
+
+    def test_revision_rows_of_changed_objects(self):
+        rev = model.repo.new_revision()
+        pkg = model.Package(name=u'testpkg-resources')
+        model.Session.add(pkg)
+        pkg.add_resource(u'http://example.com/1')
+        pkg.add_resource(u'http://example.com/2')
+        model.repo.commit_and_remove()
+
+        rev = model.repo.new_revision()
+        pkg = model.Package.by_name(u'testpkg-resources')
+        for res in pkg.resources:
+            res.description = u'Changed'
+        model.repo.commit_and_remove()
+
+        pkg = model.Package.by_name(u'testpkg-resources')
+        res_revs = model.Session.query(model.ResourceRevision).filter(
+            model.ResourceRevision.id.in_([res.id for res in pkg.resources]))
+        for res_rev in res_revs:
+            if res_rev.current:
+                assert_equal(res_rev.revision_id, rev.id)
+                assert_equal(res_rev.revision_timestamp, rev.timestamp)
+                assert_equal(res_rev.expired_timestamp,
+                             datetime.datetime(9999, 12, 31))
+            else:
+                assert_equal(res_rev.expired_id, rev.id)
+                assert_equal(res_rev.expired_timestamp, rev.timestamp)
+        assert_equal(res_revs.count(), 4)
+        assert_equal(res_revs.filter_by(current=True).count(), 2)
@@ -0,0 +1,39 @@
+from nose.tools import assert_equal
+
+import ckan.model as model
+
+
+class TestTrackingSummary(object):
+
+    @classmethod
+    def setup_class(self):
+        model.Session.execute(model.tracking_total_table.insert(), [
+            {'tracking_type': u'page', 'key': u'package-1',
+             'running_total': 10, 'recent_views': 2},
+            {'tracking_type': u'resource', 'key': u'http://a.com/data.csv',
+             'running_total': 5, 'recent_views': 1},
+            ])
+        model.Session.commit()
+
+    @classmethod
+    def teardown_class(self):
+        model.Session.remove()
+        model.repo.rebuild_db()
+
+    def test_get_totals(self):
+        packages, resources = model.TrackingSummary.get_totals(
+            [u'package-1', u'package-2'],
+            [u'http://a.com/data.csv', u'package-1'])
+        assert_equal(packages, {u'package-1': {'total': 10, 'recent': 2},
+                                u'package-2': {'total': 0, 'recent': 0}})
+        assert_equal(resources,
+                     {u'http://a.com/data.csv': {'total': 5, 'recent': 1},
+                      u'package-1': {'total': 0, 'recent': 0}})
+
+    def test_get_for_package_and_resource(self):
+        assert_equal(model.TrackingSummary.get_for_package(u'package-1'),
+                     {'total': 10, 'recent': 2})
+        assert_equal(
+            model.TrackingSummary.get_for_resource(u'http://a.com/other'),
+            {'total': 0, 'recent': 0})
+        assert_equal(model.TrackingSummary.get_totals(), ({}, {}))
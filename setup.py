@@ -94,6 +94,7 @@ setup(
 
     [ckan.plugins]
     synchronous_search = ckan.lib.search:SynchronousSearchPlugin
+    asynchronous_search = ckan.lib.search:AsynchronousSearchPlugin
     stats=ckanext.stats.plugin:StatsPlugin
     publisher_form=ckanext.publisher_form.forms:PublisherForm
     publisher_dataset_form=ckanext.publisher_form.forms:PublisherDatasetForm